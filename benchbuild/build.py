@@ -64,12 +64,11 @@ def clone_or_pull(repo_dict, to_dir):
             # latest commit hash
             current_hash = git("rev-parse", "--verify", "HEAD").rstrip("\n")
             if current_hash != commit_hash:
-                # Make sure we have a full history, not just depth 1
+                from benchbuild.utils.downloader import git_fetch_commit
                 print(("HEAD for repository {:s} is not at configured commit"
                        "hash {:s}, fetching and checking out.".format(
                            url, commit_hash)))
-                git("fetch", "--unshallow")
-                git("checkout", commit_hash)
+                git_fetch_commit(commit_hash)
 
 
 def configure_papi(cmake_cmd, root):
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+""" Create and extract offline source bundles. """
+from plumbum import cli
+from benchbuild.settings import CFG
+
+
+class BenchBuildBundle(cli.Application):
+    """ Package the sources of projects for nodes without network access. """
+
+    def main(self, *args):
+        if args:
+            print("Unknown command {0!r}".format(args[0]))
+            return 1
+        if not self.nested_command:
+            print("No command given")
+            return 1
+
+
+@BenchBuildBundle.subcommand("create")
+class BundleCreate(cli.Application):
+    """ Fetch the sources of the selected projects into a bundle. """
+
+    _experiment_names = []
+    _project_names = []
+    _group_name = None
+
+    @cli.switch(["-E", "--experiment"],
+                str,
+                list=True,
+                mandatory=True,
+                help="Bundle the sources of these experiments")
+    def experiments(self, experiments):
+        self._experiment_names = experiments
+
+    @cli.switch(["-P", "--project"],
+                str,
+                list=True,
+                help="Specify projects to bundle")
+    def projects(self, projects):
+        self._project_names = projects
+
+    @cli.switch(["-G", "--group"],
+                str,
+                help="Bundle a group of projects")
+    def group(self, group):
+        self._group_name = group
+
+    compression = cli.SwitchAttr(["-c", "--compression"],
+                                 cli.Set("", "gz", "bz2", "xz"),
+                                 default="",
+                                 help="Compress the bundle")
+
+    def main(self, bundle_f):
+        from benchbuild.prefetch import select_projects
+        from benchbuild.utils import bundle
+        from benchbuild.utils.downloader import prefetch
+
+        projects = select_projects(self._experiment_names,
+                                   self._project_names, self._group_name)
+        prefetch(projects)
+
+        sources = [src for prj in projects for src in prj.sources()]
+        missing = bundle.create(bundle_f, sources, str(CFG["tmp_dir"]),
+                                self.compression)
+        for name in missing:
+            print("{0} is missing in the cache.".format(name))
+        print("Created {0}".format(bundle_f))
+        return 1 if missing else 0
+
+
+@BenchBuildBundle.subcommand("extract")
+class BundleExtract(cli.Application):
+    """ Extract the sources of bundles into the cache. """
+
+    def main(self, *bundles):
+        from benchbuild.utils import bundle
+        from benchbuild.utils.downloader import source_required, update_hash
+
+        root = str(CFG["tmp_dir"])
+        for bundle_f in bundles:
+            names = [
+                name for name in sorted(bundle.read_index(bundle_f))
+                if source_required(name, root)
+            ]
+            extracted = bundle.extract_all(bundle_f, names, root)
+            for name in extracted:
+                update_hash(name, root)
+                print("{0}: {1}".format(bundle_f, name))
+            for name in sorted(set(names) - set(extracted)):
+                print("{0}: Could not extract {1}".format(bundle_f, name))
+            if len(extracted) != len(names):
+                return 1
+        return 0
@@ -69,4 +69,11 @@ def main(*args):
     PollyProfiling.subcommand("log", "benchbuild.log.BenchBuildLog")
     PollyProfiling.subcommand("test", "benchbuild.test.BenchBuildTest")
     PollyProfiling.subcommand("slurm", "benchbuild.slurm.Slurm")
+    PollyProfiling.subcommand("ingest", "benchbuild.ingest.BenchBuildIngest")
+    PollyProfiling.subcommand("prefetch",
+                              "benchbuild.prefetch.BenchBuildPrefetch")
+    PollyProfiling.subcommand("bundle", "benchbuild.bundle.BenchBuildBundle")
+    PollyProfiling.subcommand("migrate",
+                              "benchbuild.migrate.BenchBuildMigrate")
+    PollyProfiling.subcommand("prune", "benchbuild.prune.BenchBuildPrune")
     return PollyProfiling.run(*args)
@@ -25,6 +25,8 @@ An experiment performs the following actions in order:
         This to perform all your experiment needs.
 
 """
+import copy
+import uuid
 import warnings
 import logging
 import traceback as tb
@@ -41,7 +43,9 @@ from benchbuild import projects
 from benchbuild.project import ProjectRegistry
 from benchbuild.utils.run import GuardedRunException
 from benchbuild.settings import CFG
-from benchbuild.utils.actions import Step, Clean, MakeBuildDir, RequireAll
+from benchbuild.utils.actions import (Step, Clean, MakeBuildDir, RequireAll,
+                                      Echo, Run, SnapshotBuildDir,
+                                      ResetBuildDir)
 
 
 def newline(ostream):
@@ -310,14 +314,66 @@ class Experiment(object, metaclass=ExperimentRegistry):
 
         for project in self.projects:
             p = self.projects[project]
-            actns.append(RequireAll(self.actions_for_project(p)))
+            actns.append(RequireAll(self.actions_for_project(p),
+                                    key="{0}/{1}".format(self.name, p.name)))
 
         actns.append(Clean(self))
         return actns
 
+def cores_axis():
+    """
+    The default variant axis: all core counts from 1 to CFG["jobs"].
+
+    Returns (range):
+        The core counts we want to run with.
+    """
+    return range(1, int(str(CFG["jobs"])) + 1)
+
+
 class RuntimeExperiment(Experiment):
     """ Additional runtime only features for experiments. """
 
+    def run_variants(self, project, runtime_extension, axis=None,
+                     name="cores"):
+        """
+        Expand the run step of a project along a variant axis.
+
+        Build-invariant parameters, like the number of cores, the environment
+        or the input set, do not require a fresh build of the project. Each
+        value on the axis gets its own run group. All variants run in the
+        build directory of :project:. Everything a variant adds to it is
+        removed before the next variant runs, see
+        :class:`benchbuild.utils.actions.ResetBuildDir`.
+
+        Args:
+            project (benchbuild.Project): The project we want to run. It has
+                to be built by earlier actions in the same chain.
+            runtime_extension: A function ``f(project, value)`` that returns
+                the runtime extension for the variant with the given value.
+            axis (iterable): The values of the variant axis. Defaults to
+                all core counts, see :func:`cores_axis`.
+            name (str): A short description of the variant axis.
+
+        Returns (list(benchbuild.utils.actions.Step)):
+            The run actions of all variants.
+        """
+        if axis is None:
+            axis = cores_axis()
+
+        state = {}
+        actns = [SnapshotBuildDir(project, state)]
+        for value in axis:
+            variant = copy.copy(project)
+            variant.run_uuid = uuid.uuid4()
+            variant.runtime_extension = runtime_extension(variant, value)
+            actns.extend([
+                Echo("{0}: Run with {1} = {2}".format(
+                    self.name, name, value)),
+                Run(variant),
+                ResetBuildDir(variant, state)
+            ])
+        return actns
+
     def get_papi_calibration(self, project, calibrate_call):
         """
         Get calibration values for PAPI based measurements.
@@ -355,13 +411,10 @@ class RuntimeExperiment(Experiment):
                 The calibration time in nanoseconds.
         """
         if calibration:
-            from benchbuild.utils.db import create_run
-            from benchbuild.utils import schema as s
+            from benchbuild.utils.db import create_run, persist_metrics
 
             run, session = create_run(
                 str(cmd), project.name, self.name, project.run_uuid)
-            metric = s.Metric(name="papi.calibration.time_ns",
-                              value=calibration,
-                              run_id=run.id)
-            session.add(metric)
+            persist_metrics(run, session,
+                            {"papi.calibration.time_ns": calibration})
             session.commit()
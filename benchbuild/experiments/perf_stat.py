@@ -0,0 +1,171 @@
+"""
+The 'perf-stat' Experiment.
+
+This experiment compiles all projects with the flags of the 'raw'
+experiment, -O3 -fno-omit-frame-pointer, and runs the binaries wrapped with
+``perf stat``. Counts are therefore comparable to the timings of 'raw'. It
+reads hardware counters through the kernel, so it works for every project
+without a toolchain that links in libpapi or liblikwid.
+
+Measurements
+------------
+
+For every event in BB_PERF_EVENTS:
+    perf.<event> - The event count. perf scales the count, if the event was
+        multiplexed with other events.
+    perf.<event>.ratio - The fraction of the run time the event was actually
+        counted (1.0, if it was not multiplexed).
+
+Events the CPU does not support, or that were never scheduled, are skipped.
+"""
+from benchbuild.experiment import RuntimeExperiment
+from benchbuild.utils.actions import (Prepare, Build, Download, Configure,
+                                      Clean, MakeBuildDir, Run, Echo)
+from benchbuild.settings import CFG
+from benchbuild.utils.run import partial
+from benchbuild.utils.run_spec import runtime_handler
+
+
+def parse_perf_stat(lines):
+    """
+    Parse the CSV output of ``perf stat -x,``.
+
+    The lines are processed one by one, :lines: may be an open file.
+
+    Args:
+        lines: The lines of the output.
+
+    Yields:
+        (event, count, ratio) for every counted event, where ratio is the
+        fraction of the run time the event was counted.
+
+    >>> out = ["# started on Mon Jan  1 00:00:00 2018", "",
+    ...        "2080212,,cycles,1034020,100.00,,",
+    ...        "1504110,,instructions,517010,50.00,0.72,insn per cycle",
+    ...        "3.50,msec,task-clock,3500000,100.00,0.9,CPUs utilized",
+    ...        "<not counted>,,cache-misses,0,0.00,,",
+    ...        "<not supported>,,branch-misses,0,100.00,,"]
+    >>> for record in parse_perf_stat(out):
+    ...     print(record)
+    ('cycles', 2080212.0, 1.0)
+    ('instructions', 1504110.0, 0.5)
+    ('task-clock', 3.5, 1.0)
+    """
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        fields = line.split(",")
+        if len(fields) < 3:
+            continue
+        value, event = fields[0], fields[2]
+        if not event or value.startswith("<"):
+            continue
+        try:
+            count = float(value)
+        except ValueError:
+            continue
+        ratio = 1.0
+        if len(fields) > 4 and fields[4]:
+            try:
+                ratio = float(fields[4]) / 100.0
+            except ValueError:
+                pass
+        yield event, count, ratio
+
+
+def perf_stat_metrics(records):
+    """
+    Turn parsed perf stat records into metrics.
+
+    >>> perf_stat_metrics([("cycles", 10.0, 1.0), ("instructions", 5.0, .5)])
+    {'perf.cycles': 10.0, 'perf.cycles.ratio': 1.0, \
+'perf.instructions': 5.0, 'perf.instructions.ratio': 0.5}
+    """
+    metrics = {}
+    for event, count, ratio in records:
+        metrics["perf." + event] = count
+        metrics["perf." + event + ".ratio"] = ratio
+    return metrics
+
+
+@runtime_handler
+def run_with_perf_stat(project, experiment, config, jobs, run_f, args,
+                       **kwargs):
+    """
+    Run the given binary wrapped with perf stat.
+
+    Args:
+        project: The benchbuild.project.
+        experiment: The benchbuild.experiment.
+        config: The benchbuild.settings.config.
+        jobs: Number of cores we should use for this exection.
+        run_f: The file we want to execute.
+        args: List of arguments that should be passed to the wrapped binary.
+        **kwargs: Dictionary with our keyword args. We support the following
+            entries:
+
+            project_name: The real name of our project. This might not
+                be the same as the configured project name, if we got wrapped
+                with ::benchbuild.project.wrap_dynamic
+            has_stdin: Signals whether we should take care of stdin.
+    """
+    import os
+    import tempfile
+    from plumbum import local
+    from benchbuild.settings import CFG as c
+    from benchbuild.utils.run import guarded_exec, handle_stdin
+    from benchbuild.utils.db import persist_metrics, persist_config
+    from benchbuild.utils import placement
+
+    c.update(config)
+    project.name = kwargs.get("project_name", project.name)
+    events = str(c["perf"]["events"])
+
+    with tempfile.TemporaryDirectory(prefix="bb-perf-stat-") as stat_dir:
+        stat_f = os.path.join(stat_dir, "perf-stat.csv")
+        perf = local["perf"]
+        run_cmd = perf["stat", "-x,", "-o", stat_f, "-e", events, "--",
+                       run_f]
+        run_cmd = handle_stdin(run_cmd[args], kwargs)
+
+        with placement.place(jobs), local.env(OMP_NUM_THREADS=str(jobs)):
+            with guarded_exec(run_cmd, project, experiment) as run:
+                ri = run()
+
+        with open(stat_f, 'r') as stat_file:
+            metrics = perf_stat_metrics(parse_perf_stat(stat_file))
+
+    persist_metrics(ri.db_run, ri.session, metrics)
+    persist_config(ri.db_run, ri.session, {
+        "cores": str(jobs),
+        "perf.events": events
+    })
+
+class PerfStat(RuntimeExperiment):
+    """Hardware counters of all projects, measured with perf stat."""
+
+    NAME = "perf-stat"
+
+    def actions_for_project(self, project):
+        """
+        Compile like 'raw' and run the binaries with perf stat.
+
+        The flags have to stay in sync with RawRuntime, the frame pointer
+        is kept in both experiments.
+        """
+        project.cflags = ["-O3", "-fno-omit-frame-pointer"]
+        project.runtime_extension = \
+            partial(run_with_perf_stat, project, self, CFG,
+                    CFG["jobs"].value())
+        return [
+            MakeBuildDir(project),
+            Echo("Compiling... {}".format(project.name)),
+            Prepare(project),
+            Download(project),
+            Configure(project),
+            Build(project),
+            Echo("Running... {}".format(project.name)),
+            Run(project),
+            Clean(project),
+        ]
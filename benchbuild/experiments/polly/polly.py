@@ -17,7 +17,9 @@ Measurements
     time.real_s - The time spent overall in seconds (aka Wall clock)
 """
 
-from benchbuild.experiment import step, RuntimeExperiment
+from benchbuild.experiment import RuntimeExperiment
+from benchbuild.utils.actions import (Prepare, Build, Download, Configure,
+                                      Clean, MakeBuildDir, Echo)
 from benchbuild.settings import CFG
 
 
@@ -26,20 +28,22 @@ class Polly(RuntimeExperiment):
 
     NAME = "polly"
 
-    def run_project(self, p):
-        from uuid import uuid4
+    def actions_for_project(self, p):
         from benchbuild.experiments.raw import run_with_time
         from benchbuild.utils.run import partial
 
         p.cflags = ["-O3", "-Xclang", "-load", "-Xclang", "LLVMPolyJIT.so",
                     "-mllvm", "-polly"]
 
-        for i in range(1, int(CFG["jobs"]) + 1):
-            p.run_uuid = uuid4()
-            with step("time: {0} cores & uuid {1}".format(i, p.run_uuid)):
-                p.clean()
-                p.prepare()
-                p.download()
-                p.configure()
-                p.build()
-                p.run(partial(run_with_time, p, self, CFG, i))
+        actns = [
+            MakeBuildDir(p),
+            Echo("{0}: Configure & Compile {1}".format(self.name, p.name)),
+            Prepare(p),
+            Download(p),
+            Configure(p),
+            Build(p)
+        ]
+        actns.extend(self.run_variants(
+            p, lambda cp, i: partial(run_with_time, cp, self, CFG, i)))
+        actns.append(Clean(p))
+        return actns
@@ -19,11 +19,12 @@ Measurements
 
 import os
 import re
-import uuid
 import warnings
 
 from benchbuild.utils.run import partial
-from benchbuild.experiment import step, RuntimeExperiment
+from benchbuild.experiment import RuntimeExperiment
+from benchbuild.utils.actions import (Prepare, Build, Download, Configure,
+                                      Clean, MakeBuildDir, Echo)
 from benchbuild.settings import CFG
 
 class ShouldNotBeNone(RuntimeWarning):
@@ -35,14 +36,14 @@ class PollyPerformance(RuntimeExperiment):
 
     NAME = "pollyperformance"
 
-    def run_project(self, p):
+    def actions_for_project(self, p):
         from benchbuild.experiments.raw import run_with_time
 
         configs = CFG["perf"]["config"].value()
         if configs is None:
             warnings.warn("({0}) should not be null.".format(repr(CFG["perf"]["config"])),
                           category=ShouldNotBeNone, stacklevel=2)
-            return
+            return []
 
         config_list = re.split(r'\s*', configs)
 
@@ -54,13 +55,15 @@ class PollyPerformance(RuntimeExperiment):
         p.cflags = ["-O3", "-Xclang", "-load", "-Xclang", "LLVMPolyJIT.so",
                     "-mllvm", "-polly"] + config_with_llvm
 
-        jobs = CFG["jobs"].value()
-        for i in range(1, int(jobs) + 1):
-            p.run_uuid = uuid.uuid4()
-            with step("time: {0} cores & uuid {1}".format(i, p.run_uuid)):
-                p.clean()
-                p.prepare()
-                p.download()
-                p.configure()
-                p.build()
-                p.run(partial(run_with_time, p, self, CFG, i))
+        actns = [
+            MakeBuildDir(p),
+            Echo("{0}: Configure & Compile {1}".format(self.name, p.name)),
+            Prepare(p),
+            Download(p),
+            Configure(p),
+            Build(p)
+        ]
+        actns.extend(self.run_variants(
+            p, lambda cp, i: partial(run_with_time, cp, self, CFG, i)))
+        actns.append(Clean(p))
+        return actns
@@ -4,20 +4,21 @@ The 'polyjit' experiment.
 This experiment uses likwid to measure the performance of all binaries
 when running with polyjit support enabled.
 """
+import os
 from abc import abstractmethod
 from os import path
-import copy
-import uuid
 
 from plumbum.cmd import rm, time  # pylint: disable=E0401
 from plumbum import local
 from benchbuild.experiments.compilestats import collect_compilestats
-from benchbuild.utils.actions import (RequireAll, Prepare, Build, Download, Configure,
-                                 Clean, MakeBuildDir, Run, Echo)
+from benchbuild.utils.actions import (Prepare, Build, Download, Configure,
+                                      Clean, MakeBuildDir, Echo)
 from benchbuild.experiment import RuntimeExperiment
 from benchbuild.utils.run import partial
+from benchbuild.utils.run_spec import runtime_handler
 
 
+@runtime_handler
 def run_raw(project, experiment, config, run_f, args, **kwargs):
     """
     Run the given binary wrapped with nothing.
@@ -48,6 +49,7 @@ def run_raw(project, experiment, config, run_f, args, **kwargs):
         run()
 
 
+@runtime_handler
 def run_with_papi(project, experiment, config, jobs, run_f, args, **kwargs):
     """
     Run the given file with PAPI support.
@@ -73,13 +75,15 @@ def run_with_papi(project, experiment, config, jobs, run_f, args, **kwargs):
     from benchbuild.settings import CFG as c
     from benchbuild.utils.run import guarded_exec, handle_stdin
     from benchbuild.utils.db import persist_config
+    from benchbuild.utils import placement
 
     c.update(config)
     project.name = kwargs.get("project_name", project.name)
     run_cmd = local[run_f]
     run_cmd = handle_stdin(run_cmd[args], kwargs)
 
-    with local.env(POLLI_ENABLE_PAPI=1, OMP_NUM_THREADS=jobs):
+    with placement.place(jobs), \
+            local.env(POLLI_ENABLE_PAPI=1, OMP_NUM_THREADS=jobs):
         with guarded_exec(run_cmd, project, experiment) as run:
             ri = run()
 
@@ -87,6 +91,7 @@ def run_with_papi(project, experiment, config, jobs, run_f, args, **kwargs):
                    {"cores": str(jobs)})
 
 
+@runtime_handler
 def run_with_likwid(project, experiment, config, jobs, run_f, args, **kwargs):
     """
     Run the given file wrapped by likwid.
@@ -110,33 +115,39 @@ def run_with_likwid(project, experiment, config, jobs, run_f, args, **kwargs):
     from benchbuild.utils.run import guarded_exec, handle_stdin
     from benchbuild.utils.db import persist_likwid, persist_config
     from benchbuild.likwid import get_likwid_perfctr
+    from benchbuild.utils import placement
 
     c.update(config)
     project.name = kwargs.get("project_name", project.name)
-    likwid_f = project_name + ".txt"
+    likwid_f = project.name + ".txt"
 
     for group in ["CLOCK"]:
         likwid_path = path.join(c["likwiddir"], "bin")
         likwid_perfctr = local[path.join(likwid_path, "likwid-perfctr")]
-        run_cmd = \
-            likwid_perfctr["-O", "-o", likwid_f, "-m",
-                           "-C", "0-{0:d}".format(jobs),
-                           "-g", group, run_f]
-        run_cmd = handle_stdin(run_cmd[args], kwargs)
 
-        with local.env(POLLI_ENABLE_LIKWID=1):
-            with guarded_exec(run_cmd, project, experiment) as run:
-                ri = run()
+        with placement.place(jobs) as cpus:
+            cpu_list = placement.format_cpu_list(cpus.cpus) if cpus \
+                else "0-{0:d}".format(int(jobs) - 1)
+            run_cmd = \
+                likwid_perfctr["-O", "-o", likwid_f, "-m",
+                               "-C", cpu_list,
+                               "-g", group, run_f]
+            run_cmd = handle_stdin(run_cmd[args], kwargs)
+
+            with local.env(POLLI_ENABLE_LIKWID=1):
+                with guarded_exec(run_cmd, project, experiment) as run:
+                    ri = run()
 
         likwid_measurement = get_likwid_perfctr(likwid_f)
-        persist_likwid(run, ri.session, likwid_measurement)
-        persist_config(run, ri.session, {
+        persist_likwid(ri.db_run, ri.session, likwid_measurement)
+        persist_config(ri.db_run, ri.session, {
             "cores": str(jobs),
             "likwid.group": group
         })
         rm("-f", likwid_f)
 
 
+@runtime_handler
 def run_with_time(project, experiment, config, jobs, run_f, args, **kwargs):
     """
     Run the given binary wrapped with time.
@@ -156,29 +167,19 @@ def run_with_time(project, experiment, config, jobs, run_f, args, **kwargs):
                 with ::benchbuild.project.wrap_dynamic
             has_stdin: Signals whether we should take care of stdin.
     """
-    from benchbuild.utils.run import guarded_exec, handle_stdin, fetch_time_output
     from benchbuild.settings import CFG as c
-    from benchbuild.utils.db import persist_time, persist_config
+    from benchbuild.utils import repetition
 
     c.update(config)
     project.name = kwargs.get("project_name", project.name)
     timing_tag = "BB-JIT: "
 
     run_cmd = time["-f", timing_tag + "%U-%S-%e", run_f]
-    run_cmd = handle_stdin(run_cmd[args], kwargs)
-
-    with local.env(OMP_NUM_THREADS=str(jobs)):
-        with guarded_exec(run_cmd, project, experiment) as run:
-            ri = run()
-        timings = fetch_time_output(
-            timing_tag, timing_tag + "{:g}-{:g}-{:g}", ri.stderr.split("\n"))
-        if not timings:
-            return
-
-    persist_time(ri.db_run, ri.session, timings)
-    persist_config(ri.db_run, ri.session, {"cores": str(jobs)})
+    repetition.run_timed(run_cmd[args], timing_tag, project, experiment, jobs,
+                         kwargs)
 
 
+@runtime_handler
 def run_with_perf(project, experiment, config, jobs, run_f, args, **kwargs):
     """
     Run the given binary wrapped with time.
@@ -200,31 +201,40 @@ def run_with_perf(project, experiment, config, jobs, run_f, args, **kwargs):
     """
     from benchbuild.settings import CFG as c
     from benchbuild.utils.run import guarded_exec, handle_stdin
-    from benchbuild.utils.db import persist_perf, persist_config
+    from benchbuild.utils.db import persist_folded, persist_config
+    from benchbuild.utils import placement, folded
     from plumbum.cmd import perf
+    import subprocess
 
     c.update(config)
     project.name = kwargs.get("project_name", project.name)
+    perf_data = "{0}.{1}.perf.data".format(run_f, os.getpid())
     run_cmd = local[run_f]
     run_cmd = handle_stdin(run_cmd[args], kwargs)
-    run_cmd = perf["record", "-q", "-F", 6249, "-g", run_cmd]
-
-    with local.env(OMP_NUM_THREADS=str(jobs)):
-        with guarded_exec(run_cmd, project, experiment) as run:
-            ri = run(retcode=None)
-
-        fg_path = path.join(c["src_dir"], "extern/FlameGraph")
-        if path.exists(fg_path):
-            sc_perf = local[path.join(fg_path, "stackcollapse-perf.pl")]
-            flamegraph = local[path.join(fg_path, "flamegraph.pl")]
+    run_cmd = perf["record", "-q", "-F", 6249, "-g", "-o", perf_data,
+                   run_cmd]
 
-            fold_cmd = ((perf["script"] | sc_perf) > run_f + ".folded")
-            graph_cmd = (flamegraph[run_f + ".folded"] > run_f + ".svg")
-
-            fold_cmd()
-            graph_cmd()
-            persist_perf(ri.db_run, ri.session, run_f + ".svg")
-            persist_config(ri.db_run, ri.session, {"cores": str(jobs)})
+    try:
+        with placement.place(jobs), local.env(OMP_NUM_THREADS=str(jobs)):
+            with guarded_exec(run_cmd, project, experiment) as run:
+                ri = run(retcode=None)
+
+        # Collapse the stacks while perf script produces them. Nobody reads
+        # its stderr, a full pipe would block perf script.
+        script = perf["script", "-i", perf_data].popen(
+            stderr=subprocess.DEVNULL)
+        try:
+            profile = folded.from_perf_script(
+                line.decode("utf-8", "replace") for line in script.stdout)
+        finally:
+            script.stdout.close()
+            script.wait()
+    finally:
+        if os.path.exists(perf_data):
+            os.unlink(perf_data)
+
+    persist_folded(ri.db_run, ri.session, profile)
+    persist_config(ri.db_run, ri.session, {"cores": str(jobs)})
 
 
 class PolyJIT(RuntimeExperiment):
@@ -273,29 +283,25 @@ class PJITRaw(PolyJIT):
 
         p = self.init_project(p)
 
-        actns = []
-        for i in range(1, int(str(CFG["jobs"])) + 1):
-            cp = copy.deepcopy(p)
-            cp.run_uuid = uuid.uuid4()
-            cp.runtime_extension = partial(run_with_time, cp, self, CFG, i)
-
-            actns.extend([
-                MakeBuildDir(cp),
-                Echo("{0} core configuration. Configure & Compile".format(i)),
-                Prepare(cp),
-                Download(cp),
-                Configure(cp),
-                Build(cp),
-                Echo("{0} core configuration. Run".format(i)),
-                Run(cp),
-                Clean(cp)
-            ])
+        actns = [
+            MakeBuildDir(p),
+            Echo("{0}: Configure & Compile".format(self.name)),
+            Prepare(p),
+            Download(p),
+            Configure(p),
+            Build(p)
+        ]
+        actns.extend(self.run_variants(
+            p, lambda cp, i: partial(run_with_time, cp, self, CFG, i)))
+        actns.append(Clean(p))
         return actns
 
 
 class PJITperf(PolyJIT):
     """
-        An experiment that uses linux perf tools to generate flamegraphs.
+        An experiment that samples call stacks with linux perf tools.
+
+        The stacks are stored as folded stacks, see benchbuild.utils.folded.
     """
 
     NAME = "pj-perf"
@@ -305,23 +311,17 @@ class PJITperf(PolyJIT):
 
         p = self.init_project(p)
 
-        actns = []
-        for i in range(1, int(str(CFG["jobs"])) + 1):
-            cp = copy.deepcopy(p)
-            cp.run_uuid = uuid.uuid4()
-            cp.runtime_extension = partial(run_with_perf, cp, self, CFG, i)
-
-            actns.extend([
-                MakeBuildDir(cp),
-                Echo("perf: {0} core configuration. Configure & Compile".format(i)),
-                Prepare(cp),
-                Download(cp),
-                Configure(cp),
-                Build(cp),
-                Echo("perf: {0} core configuration. Run".format(i)),
-                Run(cp),
-                Clean(cp)
-            ])
+        actns = [
+            MakeBuildDir(p),
+            Echo("perf: Configure & Compile"),
+            Prepare(p),
+            Download(p),
+            Configure(p),
+            Build(p)
+        ]
+        actns.extend(self.run_variants(
+            p, lambda cp, i: partial(run_with_perf, cp, self, CFG, i)))
+        actns.append(Clean(p))
         return actns
 
 
@@ -343,22 +343,17 @@ class PJITlikwid(PolyJIT):
         p = self.init_project(p)
         p.cflags = ["-DLIKWID_PERFMON"] + p.cflags
 
-        actns = []
-        for i in range(1, int(str(CFG["jobs"])) + 1):
-            cp = copy.deepcopy(p)
-            cp.run_uuid = uuid.uuid4()
-            cp.runtime_extension = partial(run_with_likwid, cp, self, CFG, i)
-
-            actns.append(RequireAll([
-                MakeBuildDir(cp),
-                Echo("likwid: {0} core configuration. Configure & Compile".format(i)),
-                Prepare(cp),
-                Download(cp),
-                Configure(cp),
-                Build(cp),
-                Echo("likwid: {0} core configuration. Run".format(i)),
-                Run(cp),
-                Clean(cp)]))
+        actns = [
+            MakeBuildDir(p),
+            Echo("likwid: Configure & Compile"),
+            Prepare(p),
+            Download(p),
+            Configure(p),
+            Build(p)
+        ]
+        actns.extend(self.run_variants(
+            p, lambda cp, i: partial(run_with_likwid, cp, self, CFG, i)))
+        actns.append(Clean(p))
         return actns
 
 
@@ -439,6 +434,9 @@ class PJITpapi(PolyJIT):
         region measurements. In the end the region measurements are
         aggregated and metrics like the dynamic SCoP coverage are extracted.
 
+        Every project is built once and then run once per core count, the
+        runs produce the region measurements.
+
         This uses the same set of flags as all other PolyJIT based experiments.
     """
 
@@ -464,21 +462,18 @@ class PJITpapi(PolyJIT):
         p = self.init_project(p)
         p.cflags = ["-mllvm", "-instrument"] + p.cflags
         p.ldflags = p.ldflags + ["-lbenchbuild"]
+        p.compiler_extension = partial(collect_compilestats, p, self, CFG)
 
-        actns = []
-        for i in range(1, int(str(CFG["jobs"])) + 1):
-            cp = copy.deepcopy(p)
-            cp.compiler_extension = partial(collect_compilestats, cp, self, CFG)
-            cp.runtime_extension = partial(run_with_papi, p, self, CFG, i)
-            actns.extend([
-                MakeBuildDir(cp),
-                Echo("{}: Configure...".format(self.name)),
-                Prepare(cp),
-                Download(cp),
-                Configure(cp),
-                Echo("{}: Building...".format(self.name)),
-                Build(cp),
-                Clean(cp)
-            ])
-
+        actns = [
+            MakeBuildDir(p),
+            Echo("{}: Configure...".format(self.name)),
+            Prepare(p),
+            Download(p),
+            Configure(p),
+            Echo("{}: Building...".format(self.name)),
+            Build(p)
+        ]
+        actns.extend(self.run_variants(
+            p, lambda cp, i: partial(run_with_papi, cp, self, CFG, i)))
+        actns.append(Clean(p))
         return actns
@@ -14,20 +14,25 @@ Measurements
     time.user_s - The time spent in user space in seconds (aka virtual time)
     time.system_s - The time spent in kernel space in seconds (aka system time)
     time.real_s - The time spent overall in seconds (aka Wall clock)
+
+If measurements are repeated (see benchbuild.utils.repetition), every sample
+is stored as a run of its own, warm-up runs are not stored at all. The last
+run additionally carries summary metrics, e.g., time.real_s.median,
+time.real_s.ci_low/ci_high and time.repetitions.
 """
 
 from benchbuild.experiment import RuntimeExperiment
 from benchbuild.utils.actions import (Prepare, Build, Download, Configure, Clean,
                                  MakeBuildDir, Run, Echo)
-from benchbuild.utils.run import guarded_exec, handle_stdin, fetch_time_output
-from benchbuild.utils.db import persist_time, persist_config
+from benchbuild.utils import repetition
 from plumbum.cmd import time
 
 from benchbuild.settings import CFG
 from benchbuild.utils.run import partial
-from plumbum import local
+from benchbuild.utils.run_spec import runtime_handler
 
 
+@runtime_handler
 def run_with_time(project, experiment, config, jobs, run_f, args, **kwargs):
     """
     Run the given binary wrapped with time.
@@ -38,8 +43,8 @@ def run_with_time(project, experiment, config, jobs, run_f, args, **kwargs):
         config: The benchbuild configuration we are running with.
         jobs: The number of cores we are allowed to use. This may differ
             from the actual amount of available cores, obey it.
-            We should enforce this from the outside. However, at the moment we
-            do not do this.
+            With BB_PLACEMENT_ENABLE, we pin the binary to this many CPUs
+            (see benchbuild.utils.placement).
         run_f: The file we want to execute.
         args: List of arguments that should be passed to the wrapped binary.
         **kwargs: Dictionary with our keyword args. We support the following
@@ -55,18 +60,8 @@ def run_with_time(project, experiment, config, jobs, run_f, args, **kwargs):
     timing_tag = "BB-TIME: "
 
     run_cmd = time["-f", timing_tag + "%U-%S-%e", run_f]
-    run_cmd = handle_stdin(run_cmd[args], kwargs)
-
-    with local.env(OMP_NUM_THREADS=str(jobs)):
-        with guarded_exec(run_cmd, project, experiment) as run:
-            ri = run()
-        timings = fetch_time_output(
-            timing_tag, timing_tag + "{:g}-{:g}-{:g}", ri.stderr.split("\n"))
-        if not timings:
-            return
-
-    persist_time(ri.db_run, ri.session, timings)
-    persist_config(ri.db_run, ri.session, {"cores": str(jobs)})
+    repetition.run_timed(run_cmd[args], timing_tag, project, experiment, jobs,
+                         kwargs)
 
 
 class RawRuntime(RuntimeExperiment):
@@ -75,7 +70,11 @@ class RawRuntime(RuntimeExperiment):
     NAME = "raw"
 
     def actions_for_project(self, project):
-        """Compile & Run the experiment with -O3 enabled."""
+        """
+        Compile & Run the experiment with -O3 enabled.
+
+        The frame pointer is kept, perf-stat compiles with the same flags.
+        """
         project.cflags = ["-O3", "-fno-omit-frame-pointer"]
         project.runtime_extension = \
             partial(run_with_time, project, self, CFG, CFG["jobs"].value())
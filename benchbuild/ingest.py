@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+""" Load spooled results into the BB database. """
+import glob
+import os
+from datetime import datetime
+from plumbum import cli
+
+
+def _parse_datetime(value):
+    """
+    Parse a timestamp, as written by the spool.
+
+    Examples:
+        >>> _parse_datetime("2017-01-02T03:04:05.000006")
+        datetime.datetime(2017, 1, 2, 3, 4, 5, 6)
+        >>> _parse_datetime("2017-01-02T03:04:05")
+        datetime.datetime(2017, 1, 2, 3, 4, 5)
+    """
+    for format_s in ["%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"]:
+        try:
+            return datetime.strptime(value, format_s)
+        except ValueError:
+            pass
+    return value
+
+
+def wait_for_writers(spool_f):
+    """Wait until nobody appends to :spool_f: anymore."""
+    import fcntl
+
+    with open(spool_f, 'a') as spool:
+        fcntl.flock(spool, fcntl.LOCK_EX)
+        fcntl.flock(spool, fcntl.LOCK_UN)
+
+
+class Ingestion(object):
+    """Load the records of spool files into a database session."""
+
+    def __init__(self, session):
+        from benchbuild.utils import schema
+
+        self.session = session
+        self.classes = dict([(cls.__tablename__, cls)
+                             for cls in schema.BASE.__subclasses__()])
+        self.run_ids = {}
+
+    def resolve(self, spool_id):
+        """Get the database id of a spooled run."""
+        from benchbuild.utils.schema import SpooledRecord
+
+        if spool_id not in self.run_ids:
+            known = self.session.query(SpooledRecord).get(spool_id)
+            self.run_ids[spool_id] = known.run_id if known else None
+        return self.run_ids[spool_id]
+
+    def convert(self, cls, values):
+        """Replace spool ids and decode timestamps of a single row."""
+        from sqlalchemy import DateTime
+        from benchbuild.utils import spool
+
+        row = {}
+        for key, value in values.items():
+            column = cls.__table__.columns[key]
+            if spool.is_spool_id(value):
+                value = self.resolve(value)
+            elif isinstance(value, str) and isinstance(column.type, DateTime):
+                value = _parse_datetime(value)
+            row[key] = value
+        return row
+
+    def add_object(self, table, values):
+        """Insert or update a single spooled object."""
+        from benchbuild.utils import spool
+        from benchbuild.utils.schema import Run, SpooledRecord
+
+        cls = self.classes[table]
+        spool_id = values.get("id") if cls is Run else None
+        if spool.is_spool_id(spool_id) and self.resolve(spool_id) is None:
+            row = self.convert(cls, dict(values))
+            del row["id"]
+            obj = cls(**row)
+            self.session.add(obj)
+            self.session.flush()
+            self.session.add(SpooledRecord(id=spool_id, run_id=obj.id))
+            self.run_ids[spool_id] = obj.id
+            return
+
+        row = self.convert(cls, values)
+        pkey = tuple(row[column.key]
+                     for column in cls.__table__.primary_key.columns)
+        obj = self.session.query(cls).get(pkey)
+        if obj is None:
+            self.session.add(cls(**row))
+            self.session.flush()
+            return
+
+        for key, value in row.items():
+            if table == "experiment" and key in ("begin", "end"):
+                current = getattr(obj, key)
+                if current is not None:
+                    pick = min if key == "begin" else max
+                    value = pick(current, value)
+            setattr(obj, key, value)
+        self.session.flush()
+
+    def add_rows(self, record_id, table, rows):
+        """Insert a batch of spooled rows, unless we did so before."""
+        from benchbuild.utils.schema import SpooledRecord
+        from benchbuild.utils import interning
+
+        if self.session.query(SpooledRecord).get(record_id) is not None:
+            return
+        cls = self.classes[table]
+        rows = [self.convert(cls, row) for row in rows]
+        if interning.is_logical(table):
+            interning.insert(self.session, table, rows)
+        else:
+            self.session.execute(cls.__table__.insert().values(rows))
+        self.session.add(SpooledRecord(id=record_id))
+        self.session.flush()
+
+    def ingest(self, spool_f):
+        """
+        Load all records of a spool file.
+
+        Returns (int):
+            The number of records we read.
+        """
+        from benchbuild.utils import spool
+
+        count = 0
+        for record in spool.records(spool_f):
+            if record["t"] == "obj":
+                self.add_object(record["table"], record["values"])
+            elif record["t"] == "rows":
+                self.add_rows(record["id"], record["table"], record["rows"])
+            count += 1
+        return count
+
+
+class BenchBuildIngest(cli.Application):
+    """ Load spooled results into the benchbuild database. """
+
+    def main(self, *spool_files):
+        from benchbuild.settings import CFG
+        from benchbuild.utils.schema import Session
+
+        spool_dir = str(CFG["spool"]["dir"])
+        if not spool_files:
+            spool_files = sorted(
+                glob.glob(os.path.join(spool_dir, "*.jsonl")) +
+                glob.glob(os.path.join(spool_dir, "*.ingesting")))
+
+        for spool_f in spool_files:
+            # New results of running nodes go to a new spool file.
+            if not spool_f.endswith(".ingesting"):
+                os.rename(spool_f, spool_f + ".ingesting")
+                spool_f = spool_f + ".ingesting"
+                wait_for_writers(spool_f)
+
+            session = Session()
+            try:
+                count = Ingestion(session).ingest(spool_f)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+            done_f = "{0}.{1}.ingested".format(
+                spool_f[:-len(".ingesting")],
+                datetime.now().strftime("%Y%m%d%H%M%S"))
+            os.rename(spool_f, done_f)
+            print("{0}: {1} records".format(done_f, count))
@@ -3,152 +3,159 @@ Likwid helper functions.
 
 Extract information from likwid's CSV output.
 """
+from array import array
 
+IGNORED_ROWS = ["1", "Region Info", "Event", "Metric", "CPU clock"]
 
-def fetch_cols(fstream, split_char=','):
-    """
-    Fetch columns from likwid's output stream.
-
-    Args:
-        fstream: The filestream with likwid's output.
-        split_car (str): The character we split on, default ','
 
-    Returns (list(str)):
-        A list containing the elements of fstream, after splitting at
-        split_char.
+class LikwidColumns(object):
     """
-    return fstream.readline().strip().split(split_char)
-
-
-def read_struct(fstream):
-    """
-    Read a likwid struct from the text stream.
-
-    Args:
-        fstream: Likwid's filestream.
-
-    Returns (dict(str: str)):
-        A dict containing all likwid's struct info as key/value pairs.
+    Columnar likwid measurements.
+
+    Region, metric and core names are interned; a measurement is a row of
+    the index arrays region_idx, metric_idx and core_idx and the value
+    array. Iterating yields (region, metric, core, value) tuples.
+
+    >>> cols = LikwidColumns()
+    >>> cols.append("main", "CPI", "Core 0", 1.5)
+    >>> cols.append("main", "CPI", "Core 1", 0.5)
+    >>> len(cols), cols.metrics, list(cols.core_idx)
+    (2, ['CPI'], [0, 1])
+    >>> list(cols)[1]
+    ('main', 'CPI', 'Core 1', 0.5)
+    >>> cols.columns()["core"]
+    ['Core 0', 'Core 1']
     """
-    line = fstream.readline().strip()
-    fragments = line.split(",")
-    fragments = [x for x in fragments if x is not None]
-    partition = dict()
-    if not len(fragments) >= 3:
-        return None
-
-    partition["struct"] = fragments[0]
-    partition["info"] = fragments[1]
-    partition["num_lines"] = fragments[2]
-
-    struct = None
-    if partition is not None and partition["struct"] == "STRUCT":
-        num_lines = int(partition["num_lines"].strip())
-        struct = {}
-        for _ in range(num_lines):
-            cols = fetch_cols(fstream)
-            struct.update({cols[0]: cols[1:]})
-    return struct
-
-
-def read_table(fstream):
-    """
-    Read a likwid table info from the text stream.
-
-    Args:
-        fstream: Likwid's filestream.
 
-    Returns (dict(str: str)):
-        A dict containing likwid's table info as key/value pairs.
-    """
-    pos = fstream.tell()
-    line = fstream.readline().strip()
-    fragments = line.split(",")
-    fragments = [x for x in fragments if x is not None]
-    partition = dict()
-    if not len(fragments) >= 4:
+    def __init__(self):
+        self.regions = []
+        self.metrics = []
+        self.cores = []
+        self.region_idx = array('I')
+        self.metric_idx = array('I')
+        self.core_idx = array('I')
+        self.values = array('d')
+        self.__index = ({}, {}, {})
+
+    def __intern(self, kind, table, name):
+        idx = self.__index[kind].get(name)
+        if idx is None:
+            idx = self.__index[kind][name] = len(table)
+            table.append(name)
+        return idx
+
+    def append(self, region, metric, core, value):
+        """Add a single measurement."""
+        self.region_idx.append(self.__intern(0, self.regions, region))
+        self.metric_idx.append(self.__intern(1, self.metrics, metric))
+        self.core_idx.append(self.__intern(2, self.cores, core))
+        self.values.append(value)
+
+    def columns(self):
+        """
+        The measurements, column by column.
+
+        Returns (dict):
+            'region', 'metric', 'core' and 'value' to the column of all
+            measurements.
+        """
+        return {
+            "region": [self.regions[i] for i in self.region_idx],
+            "metric": [self.metrics[i] for i in self.metric_idx],
+            "core": [self.cores[i] for i in self.core_idx],
+            "value": self.values
+        }
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        for i, value in enumerate(self.values):
+            yield (self.regions[self.region_idx[i]],
+                   self.metrics[self.metric_idx[i]],
+                   self.cores[self.core_idx[i]], value)
+
+
+def __to_float(value):
+    try:
+        return float(value)
+    except ValueError:
         return None
 
-    partition["table"] = fragments[0]
-    partition["group"] = fragments[1]
-    partition["set"] = fragments[2]
-    partition["num_lines"] = fragments[3]
-
-    struct = None
-    if partition is not None and partition["table"] == "TABLE":
-        num_lines = int(partition["num_lines"].strip())
-        struct = {}
-        header = fetch_cols(fstream)
-
-        struct.update({header[0]: header[1:]})
-        for _ in range(num_lines):
-            cols = fetch_cols(fstream)
-            struct.update({cols[0]: cols[1:]})
-    else:
-        fstream.seek(pos)
 
-    return struct
+def __add_block(columns, region, core_info, rows, offset=0):
+    """Add the measurements of a STRUCT or TABLE block to :columns:."""
+    cores = [(i, core) for i, core in enumerate(core_info) if core]
+    for metric, slot in rows.items():
+        if metric in IGNORED_ROWS:
+            continue
+        for i, core in cores:
+            idx = offset + i
+            if idx < len(slot) and slot[idx]:
+                value = __to_float(slot[idx])
+                if value is not None:
+                    columns.append(region, metric, core, value)
 
 
-def read_structs(fstream):
+def read_likwid_columns(fstream):
     """
-    Read all structs from likwid's file stream.
-
-    Args:
-        fstream: Likwid's output file stream.
+    Read all measurements of likwid's output in a single pass.
 
-    Returns:
-        A generator that can be used to iterate over all structs in the fstream.
-    """
-    struct = read_struct(fstream)
-    while struct is not None:
-        yield struct
-        struct = read_struct(fstream)
-
-
-def read_tables(fstream):
-    """
-    Read all tables from likwid's file stream.
+    The first STRUCT block (likwid's info block) is skipped. Every further
+    STRUCT block starts a new region, TABLE blocks belong to the region
+    before them. Values that are not numbers are skipped.
 
     Args:
-        fstream: Likwid's output file stream.
-
-    Returns:
-        A generator that can be used to iterate over all tables in the fstream.
-    """
-    table = read_table(fstream)
-    while table is not None:
-        yield table
-        table = read_table(fstream)
-
-
-def get_measurements(region, core_info, data, extra_offset=0):
+        fstream: Likwid's output file stream, or any iterable of lines.
+
+    Returns (LikwidColumns):
+        All measurements.
+
+    >>> out = ["STRUCT,Info,1,,", "CPU name:,Intel,,,",
+    ...        "STRUCT,Region main,2,,", "1,Region,main,,",
+    ...        "Region Info,Core 0,Core 1,,",
+    ...        "TABLE,Region main,Group 1 Raw,1,",
+    ...        "Event,Counter,Core 0,Core 1,",
+    ...        "INSTR_RETIRED_ANY,FIXC0,300,-,",
+    ...        "TABLE,Region main,Group 1 Metric,1,",
+    ...        "Metric,Core 0,Core 1,,",
+    ...        "CPI,1.5,0.5,,"]
+    >>> for measurement in read_likwid_columns(out):
+    ...     print(measurement)
+    ('main', 'INSTR_RETIRED_ANY', 'Core 0', 300.0)
+    ('main', 'CPI', 'Core 0', 1.5)
+    ('main', 'CPI', 'Core 1', 0.5)
     """
-    Get the complete measurement info from likwid's region info.
-
-    Args:
-        region: The region we took a measurement in.
-        core_info: The core information.
-        data: The raw data.
-        extra_offset (int): default = 0
-
-    Returns (list((region, metric, core, value))):
-        A list of measurement tuples, a tuple contains the information about
-        the region, the metric, the core and the actual value.
-    """
-    measurements = []
-    clean_core_info = [x for x in core_info if x]
-    cores = len(clean_core_info)
-    for k in data:
-        if k not in ["1", "Region Info", "Event", "Metric", "CPU clock"]:
-            slot = data[k]
-            for i in range(cores):
-                core = core_info[i]
-                idx = extra_offset + i
-                if core and slot[idx]:
-                    measurements.append((region, k, core, slot[idx]))
-
-    return measurements
+    columns = LikwidColumns()
+    lines = iter(fstream)
+    structs = 0
+    region = None
+    core_info = []
+    for line in lines:
+        fragments = line.strip().split(",")
+        kind = fragments[0]
+        if kind == "STRUCT" and len(fragments) >= 3:
+            rows = {}
+            for _ in range(int(fragments[2].strip())):
+                cols = next(lines).strip().split(",")
+                rows[cols[0]] = cols[1:]
+            structs += 1
+            if structs == 1:
+                continue
+            region = rows.get("1", [None, None])[1]
+            core_info = rows.get("Region Info", [])
+            __add_block(columns, region, core_info, rows)
+        elif kind == "TABLE" and len(fragments) >= 4 and region is not None:
+            header = next(lines).strip().split(",")
+            rows = {}
+            for _ in range(int(fragments[3].strip())):
+                cols = next(lines).strip().split(",")
+                rows[cols[0]] = cols[1:]
+            if header[0] == "Event":
+                __add_block(columns, region, header[2:], rows, offset=1)
+            elif header[0] == "Metric":
+                __add_block(columns, region, header[1:], rows)
+    return columns
 
 
 def get_likwid_perfctr(infile):
@@ -156,29 +163,11 @@ def get_likwid_perfctr(infile):
     Get a complete list of all measurements.
 
     Args:
-        infile: The filestream containing all likwid output.
+        infile: The path of likwid's output file.
 
-    Returns:
-        A list of all measurements extracted from likwid's file stream.
+    Returns (LikwidColumns):
+        All measurements extracted from likwid's output. Iterating yields
+        (region, metric, core, value) tuples.
     """
-    measurements = []
     with open(infile, 'r') as in_file:
-        read_struct(in_file)
-        for region_struct in read_structs(in_file):
-            region = region_struct["1"][1]
-            core_info = region_struct["Region Info"]
-            measurements += \
-                get_measurements(region, core_info, region_struct)
-
-            for table_struct in read_tables(in_file):
-                core_info = None
-                if "Event" in table_struct:
-                    offset = 1
-                    core_info = table_struct["Event"][offset:]
-                    measurements += get_measurements(region, core_info,
-                                                     table_struct, offset)
-                elif "Metric" in table_struct:
-                    core_info = table_struct["Metric"]
-                    measurements += get_measurements(region, core_info,
-                                                     table_struct)
-    return measurements
+        return read_likwid_columns(in_file)
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+""" Migrate the BB database to interned metrics, compilestats and config. """
+from plumbum import cli
+
+
+class BenchBuildMigrate(cli.Application):
+    """ Move old metrics, compilestats and config rows to interned tables. """
+
+    drop = cli.Flag(["--drop"],
+                    help="Drop the old tables, instead of keeping them as "
+                    "<name>_legacy")
+
+    def main(self):
+        from benchbuild.utils.schema import Session
+        from benchbuild.utils import interning
+
+        session = Session()
+        try:
+            migrated = interning.migrate(session.connection(), self.drop)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        if not migrated:
+            print("Nothing to migrate.")
+        for name in sorted(migrated):
+            print("{0}: {1} rows".format(name, migrated[name]))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+""" Fetch the sources of all projects of an experiment into the cache. """
+from plumbum import cli
+from benchbuild.settings import CFG
+
+
+def select_projects(experiment_names, project_names=None, group=None):
+    """
+    Get all projects of the given experiments.
+
+    Args:
+        experiment_names (list(str)): Names of the experiments.
+        project_names (list(str)): Only select these projects.
+        group (str): Only select projects of this group.
+
+    Returns (list):
+        The selected projects of all experiments.
+    """
+    from logging import error
+    from benchbuild import experiment, experiments
+
+    experiments.discover()
+    exps = experiment.ExperimentRegistry.experiments
+
+    projects = []
+    for exp_name in experiment_names:
+        if exp_name not in exps:
+            error("Could not find %s in the experiment registry.", exp_name)
+            continue
+        exp = exps[exp_name](project_names, group)
+        projects.extend(exp.projects.values())
+    return projects
+
+
+class BenchBuildPrefetch(cli.Application):
+    """ Fetch the sources of the selected projects into the cache. """
+
+    _experiment_names = []
+    _project_names = []
+    _group_name = None
+
+    @cli.switch(["-E", "--experiment"],
+                str,
+                list=True,
+                mandatory=True,
+                help="Specify the experiments to fetch the sources for")
+    def experiments(self, experiments):
+        self._experiment_names = experiments
+
+    @cli.switch(["-P", "--project"],
+                str,
+                list=True,
+                help="Specify projects to fetch")
+    def projects(self, projects):
+        self._project_names = projects
+
+    @cli.switch(["-G", "--group"],
+                str,
+                help="Fetch a group of projects")
+    def group(self, group):
+        self._group_name = group
+
+    @cli.switch(["-j", "--jobs"],
+                int,
+                help="Number of concurrent downloads")
+    def jobs(self, num):
+        CFG["download"]["jobs"] = num
+
+    def main(self):
+        from benchbuild.utils.downloader import prefetch
+
+        projects = select_projects(self._experiment_names,
+                                   self._project_names, self._group_name)
+        failed = prefetch(projects)
+        if failed:
+            print("{0} downloads failed.".format(failed))
+            return 1
+        return 0
@@ -1,13 +1,15 @@
 """
 Project handling for the benchbuild study.
 """
+import json
+import os
 from os import path, listdir
 from abc import abstractmethod
 from plumbum import local
 from plumbum.cmd import mv, chmod, rm, mkdir, rmdir  # pylint: disable=E0401
 from benchbuild.settings import CFG
 from benchbuild.utils.db import persist_project
-from benchbuild.utils.actions import Clean, Step, Run
+from benchbuild.utils.actions import Clean, Step, Run, StepResult
 from benchbuild.utils.path import list_to_path
 
 PROJECT_BIN_F_EXT = ".bin"
@@ -38,6 +40,7 @@ class Project(object, metaclass=ProjectRegistry):
     NAME = None
     DOMAIN = None
     GROUP = None
+    VERSION = None
 
     def __new__(cls, *args, **kwargs):
         """Create a new project instance and set some defaults."""
@@ -57,6 +60,7 @@ class Project(object, metaclass=ProjectRegistry):
         new_self.name = cls.NAME
         new_self.domain = cls.DOMAIN
         new_self.group = cls.GROUP
+        new_self.version = cls.VERSION
         return new_self
 
     def __init__(self, exp, group=None):
@@ -109,33 +113,48 @@ class Project(object, metaclass=ProjectRegistry):
         """
         Run the tests of this project.
 
-        This method initializes the default environment and takes care of
-        cleaning up the mess we made, after a successfull run.
+        This method initializes the default environment. The build directory
+        is left untouched, because more run variants might follow. Cleaning
+        up is the job of the Clean action at the end of the project's chain.
 
         Args:
             experiment: The experiment we run this project under
+
+        Returns (StepResult):
+            ERROR, if the run group failed. This includes binaries executed
+            by the shim, that exited with an error.
         """
+        from benchbuild.utils import shim
         from benchbuild.utils.run import GuardedRunException
         from benchbuild.utils.run import (begin_run_group, end_run_group,
                                      fail_run_group)
+        records_f = path.join(self.builddir,
+                              str(self.run_uuid) + shim.RECORDS_EXT)
         with local.cwd(self.builddir):
             with local.env(BB_USE_DATABASE=1,
                            BB_DB_RUN_GROUP=self.run_uuid,
                            BB_DOMAIN=self.domain,
                            BB_GROUP=self.group_name,
-                           BB_SRC_URI=self.src_uri):
+                           BB_SRC_URI=self.src_uri,
+                           BB_SHIM_RECORDS=records_f):
 
                 group, session = begin_run_group(self)
                 try:
                     self.run_tests(experiment)
-                    end_run_group(group, session)
+                    # Binaries executed by the shim report through records.
+                    failed = shim.ingest(records_f, self)
                 except GuardedRunException:
+                    shim.ingest(records_f, self)
                     fail_run_group(group, session)
+                    return StepResult.ERROR
                 except KeyboardInterrupt as key_int:
                     fail_run_group(group, session)
                     raise key_int
-            if CFG["clean"].value():
-                self.clean()
+
+                if failed:
+                    fail_run_group(group, session)
+                    return StepResult.ERROR
+                end_run_group(group, session)
 
     def clean(self):
         """ Clean the project build directory. """
@@ -230,6 +249,33 @@ class Project(object, metaclass=ProjectRegistry):
         """ Download the input source for this project. """
         pass
 
+    def sources(self):
+        """
+        List all downloads of this project.
+
+        The downloads of all projects are fetched into the cache before an
+        experiment starts (see benchbuild prefetch). By default, we derive
+        them from the src_uri, src_file and src_dir attributes. Projects
+        that download more than that extend this list.
+
+        Returns (list(tuple)):
+            (downloader function, url, name in the cache) of all downloads.
+        """
+        from benchbuild.utils.downloader import Git, Rsync, Svn, Wget
+
+        src_uri = getattr(self, "src_uri", None)
+        if not src_uri:
+            return []
+        if getattr(self, "src_file", None):
+            return [(Wget, src_uri, self.src_file)]
+        if not getattr(self, "src_dir", None):
+            return []
+        if src_uri.startswith("svn"):
+            return [(Svn, src_uri, self.src_dir)]
+        if src_uri.startswith("rsync"):
+            return [(Rsync, src_uri, self.src_dir)]
+        return [(Git, src_uri, self.src_dir)]
+
     @abstractmethod
     def configure(self):
         """ Configure the project. """
@@ -258,15 +304,12 @@ class Project(object, metaclass=ProjectRegistry):
         Returns: plumbum command, readty to launch.
 
         """
-        import dill
-
         base_class = self.__class__.__name__
         base_module = self.__module__
 
         name_absolute = path.abspath(name)
         blob_f = name_absolute + PROJECT_BLOB_F_EXT
-        with open(blob_f, 'wb') as blob:
-            blob.write(dill.dumps(runner))
+        spec_f = store_runner(name_absolute, runner)
 
         bin_path = list_to_path(CFG["env"]["binary_path"].value())
         bin_path = list_to_path([bin_path, os.environ["PATH"]])
@@ -277,6 +320,9 @@ class Project(object, metaclass=ProjectRegistry):
         with open(name_absolute, 'w') as wrapper:
             lines = '''#!/usr/bin/env python3
 #
+import os
+os.environ["BB_CONFIG_SNAPSHOT"] = "{config_snapshot}"
+
 from benchbuild.project import Project
 from benchbuild.experiment import Experiment
 from plumbum import cli, local
@@ -287,7 +333,6 @@ from {base_module} import {base_class} as PBC
 import logging
 import os
 import sys
-import dill
 
 log = logging.getLogger("run")
 log.setLevel(logging.ERROR)
@@ -307,19 +352,27 @@ RUN_F = sys.argv[1]
 ARGS = sys.argv[2:]
 PROJECT_NAME = path.basename(RUN_F)
 
-if path.exists("{blobf}"):
-    with local.env(BB_DB_HOST="{db_host}",
+if path.exists("{specf}") or path.exists("{blobf}"):
+    with local.env(BB_DB_CONNECT_STRING="{db_connect_string}",
+               BB_DB_HOST="{db_host}",
                BB_DB_PORT="{db_port}",
                BB_DB_NAME="{db_name}",
                BB_DB_USER="{db_user}",
                BB_DB_PASS="{db_pass}",
+               BB_SPOOL_ENABLE="{spool_enable}",
+               BB_SPOOL_DIR="{spool_dir}",
                BB_PROJECT=PROJECT_NAME,
                BB_LIKWID_DIR="{likwiddir}",
                PATH="{path}",
                LD_LIBRARY_PATH="{ld_lib_path}",
                BB_CMD=RUN_F):
-        with open("{blobf}", "rb") as p:
-            f = dill.load(p)
+        if path.exists("{specf}"):
+            from benchbuild.utils.run_spec import load
+            f = load("{specf}")
+        else:
+            import dill
+            with open("{blobf}", "rb") as p:
+                f = dill.load(p)
         if f is not None:
             project_cls = type("Dyn_" + PROJECT_NAME, (PBC,), {{
                 "NAME" : PROJECT_NAME,
@@ -342,15 +395,20 @@ if path.exists("{blobf}"):
         else:
             sys.exit(1)
 
-    '''.format(db_host=str(CFG["db"]["host"]),
+    '''.format(db_connect_string=str(CFG["db"]["connect_string"]),
+               db_host=str(CFG["db"]["host"]),
                db_port=str(CFG["db"]["port"]),
                db_name=str(CFG["db"]["name"]),
                db_user=str(CFG["db"]["user"]),
                db_pass=str(CFG["db"]["pass"]),
+               spool_enable=json.dumps(CFG["spool"]["enable"].value()),
+               spool_dir=str(CFG["spool"]["dir"]),
                likwiddir=str(CFG["likwid"]["prefix"]),
                path=bin_path,
                ld_lib_path=bin_lib_path,
                blobf=strip_path_prefix(blob_f, sprefix),
+               specf=strip_path_prefix(spec_f, sprefix),
+               config_snapshot=CFG.snapshot_file(str(CFG["build_dir"])),
                base_class=base_class,
                base_module=base_module)
             wrapper.write(lines)
@@ -358,6 +416,37 @@ if path.exists("{blobf}"):
         return local[name_absolute]
 
 
+def store_runner(name, runner):
+    """
+    Store the runtime extension of the wrapper :name:.
+
+    Extensions that can be described by a run spec are stored as such,
+    everything else is pickled with dill.
+
+    Args:
+        name (str): Absolute path of the wrapper.
+        runner: The runtime extension.
+
+    Returns (str):
+        Path to the run spec of the wrapper. It does not exist, if we had to
+        pickle the extension.
+    """
+    from benchbuild.utils import run_spec
+
+    blob_f = name + PROJECT_BLOB_F_EXT
+    spec_f = name + run_spec.SPEC_F_EXT
+    spec = run_spec.describe(runner)
+    if spec is not None:
+        run_spec.store(spec_f, spec)
+        rm("-f", blob_f)
+    else:
+        import dill
+        with open(blob_f, 'wb') as blob:
+            dill.dump(runner, blob, protocol=-1, recurse=True)
+        rm("-f", spec_f)
+    return spec_f
+
+
 def strip_path_prefix(ipath, prefix):
     """
     Strip prefix from path.
@@ -393,6 +482,9 @@ def wrap(name, runner, sprefix=None):
     perform the serialization, make sure :runner: can be serialized
     with it and you're fine.
 
+    Runners that only measure the execution time are replaced by the
+    native exec shim, if enabled (see benchbuild.utils.shim).
+
     Args:
         name: Binary we want to wrap
         runner: Function that should run instead of :name:
@@ -400,12 +492,16 @@ def wrap(name, runner, sprefix=None):
     Returns:
         A plumbum command, ready to launch.
     """
-    import dill
+    from benchbuild.utils import shim
     from benchbuild.utils.run import run
 
     name_absolute = path.abspath(name)
     real_f = name_absolute + PROJECT_BIN_F_EXT
-    if sprefix:
+    if path.exists(real_f):
+        # We wrapped this binary before, e.g., for another run variant.
+        # Only the runner needs to be replaced.
+        pass
+    elif sprefix:
         from benchbuild.utils.run import uchroot_no_llvm as uchroot
         run(uchroot()["/bin/mv", strip_path_prefix(name_absolute, sprefix),
                                strip_path_prefix(real_f, sprefix)])
@@ -413,8 +509,7 @@ def wrap(name, runner, sprefix=None):
         run(mv[name_absolute, real_f])
 
     blob_f = name_absolute + PROJECT_BLOB_F_EXT
-    with open(blob_f, 'wb') as blob:
-        dill.dump(runner, blob, protocol=-1, recurse=True)
+    spec_f = store_runner(name_absolute, runner)
 
     bin_path = list_to_path(CFG["env"]["binary_path"].value())
     bin_path = list_to_path([bin_path, os.environ["PATH"]])
@@ -422,30 +517,46 @@ def wrap(name, runner, sprefix=None):
     bin_lib_path = list_to_path(CFG["env"]["binary_ld_library_path"].value())
     bin_lib_path = list_to_path([bin_lib_path, os.environ["LD_LIBRARY_PATH"]])
 
+    shim_spec = None if sprefix else shim.supports(runner)
+    shim_f = shim.build() if shim_spec else None
+    if shim_f:
+        shim.print_wrapper(name_absolute, real_f, shim_f, shim_spec, bin_path,
+                           bin_lib_path)
+        return local[name_absolute]
+
     with open(name_absolute, 'w') as wrapper:
         lines = '''#!/usr/bin/env python3
 #
+import os
+os.environ["BB_CONFIG_SNAPSHOT"] = "{config_snapshot}"
 
 from plumbum import cli, local
 from os import path, getenv
 import sys
-import dill
 
 run_f = "{runf}"
 args = sys.argv[1:]
 f = None
-if path.exists("{blobf}"):
-    with local.env(BB_DB_HOST="{db_host}",
+if path.exists("{specf}") or path.exists("{blobf}"):
+    with local.env(BB_DB_CONNECT_STRING="{db_connect_string}",
+               BB_DB_HOST="{db_host}",
                BB_DB_PORT="{db_port}",
                BB_DB_NAME="{db_name}",
                BB_DB_USER="{db_user}",
                BB_DB_PASS="{db_pass}",
+               BB_SPOOL_ENABLE="{spool_enable}",
+               BB_SPOOL_DIR="{spool_dir}",
                BB_LIKWID_DIR="{likwiddir}",
                PATH="{path}",
                LD_LIBRARY_PATH="{ld_lib_path}",
                BB_CMD=run_f + " ".join(args)):
-        with open("{blobf}", "rb") as p:
-            f = dill.load(p)
+        if path.exists("{specf}"):
+            from benchbuild.utils.run_spec import load
+            f = load("{specf}")
+        else:
+            import dill
+            with open("{blobf}", "rb") as p:
+                f = dill.load(p)
         if f is not None:
             if not sys.stdin.isatty():
                 f(run_f, args, has_stdin = True)
@@ -454,15 +565,20 @@ if path.exists("{blobf}"):
         else:
             sys.exit(1)
 
-'''.format(db_host=str(CFG["db"]["host"]),
+'''.format(db_connect_string=str(CFG["db"]["connect_string"]),
+           db_host=str(CFG["db"]["host"]),
            db_port=str(CFG["db"]["port"]),
            db_name=str(CFG["db"]["name"]),
            db_user=str(CFG["db"]["user"]),
            db_pass=str(CFG["db"]["pass"]),
+           spool_enable=json.dumps(CFG["spool"]["enable"].value()),
+           spool_dir=str(CFG["spool"]["dir"]),
            likwiddir=str(CFG["likwid"]["prefix"]),
            path=bin_path,
            ld_lib_path=bin_lib_path,
            blobf=strip_path_prefix(blob_f, sprefix),
+           specf=strip_path_prefix(spec_f, sprefix),
+           config_snapshot=CFG.snapshot_file(str(CFG["build_dir"])),
            runf=strip_path_prefix(real_f, sprefix))
         wrapper.write(lines)
     run(chmod["+x", name_absolute])
@@ -13,19 +13,26 @@ class Crafty(BenchBuildGroup):
     src_dir = "crafty-23.4"
     src_file = src_dir + ".zip"
     src_uri = "http://www.craftychess.com/crafty-23.4.zip"
+    book_file = "book.bin"
+    book_uri = "http://www.craftychess.com/" + book_file
+
+    def sources(self):
+        from benchbuild.utils.downloader import Wget
+
+        return super(Crafty, self).sources() + [
+            (Wget, self.book_uri, self.book_file)
+        ]
 
     def download(self):
         from benchbuild.utils.downloader import Wget
         from plumbum.cmd import unzip, mv
 
-        book_file = "book.bin"
-        book_bin = "http://www.craftychess.com/" + book_file
         with local.cwd(self.builddir):
             Wget(self.src_uri, self.src_file)
-            Wget(book_bin, "book.bin")
+            Wget(self.book_uri, self.book_file)
 
             unzip(self.src_file)
-            mv(book_file, self.src_dir)
+            mv(self.book_file, self.src_dir)
 
     def configure(self):
         pass
@@ -26,6 +26,13 @@ class LibAV(BenchBuildGroup):
         with local.cwd(self.src_dir):
             run(make["V=1", "-i", "fate"])
 
+    def sources(self):
+        from benchbuild.utils.downloader import Rsync
+
+        return super(LibAV, self).sources() + [
+            (Rsync, self.fate_uri, self.fate_dir)
+        ]
+
     def download(self):
         from benchbuild.utils.downloader import Wget, Rsync
         from plumbum.cmd import tar
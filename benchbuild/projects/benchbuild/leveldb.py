@@ -9,6 +9,11 @@ class LevelDB(BenchBuildGroup):
 
     src_uri = "https://github.com/google/leveldb"
 
+    def sources(self):
+        from benchbuild.utils.downloader import Git
+
+        return [(Git, self.src_uri, "leveldb.src")]
+
     def download(self):
         from benchbuild.utils.downloader import Git
 
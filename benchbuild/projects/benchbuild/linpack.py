@@ -11,6 +11,11 @@ class Linpack(BenchBuildGroup):
 
     src_uri = "http://www.netlib.org/benchmark/linpackc.new"
 
+    def sources(self):
+        from benchbuild.utils.downloader import Wget
+
+        return [(Wget, self.src_uri, "linpackc.new")]
+
     def download(self):
         from benchbuild.utils.downloader import Wget
         from plumbum.cmd import patch, cp
@@ -25,6 +25,14 @@ class MCrypt(BenchBuildGroup):
     mhash_uri = "http://sourceforge.net/projects/mhash/files/mhash/0.9.9.9/" + \
         mhash_file
 
+    def sources(self):
+        from benchbuild.utils.downloader import Wget
+
+        return super(MCrypt, self).sources() + [
+            (Wget, self.libmcrypt_uri, self.libmcrypt_file),
+            (Wget, self.mhash_uri, self.mhash_file)
+        ]
+
     def download(self):
         from benchbuild.utils.downloader import Wget
         from plumbum.cmd import tar
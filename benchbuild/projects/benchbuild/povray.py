@@ -17,6 +17,12 @@ class Povray(BenchBuildGroup):
     boost_src_uri = "http://sourceforge.net/projects/boost/files/boost/1.59.0/" + \
         boost_src_file
 
+    def sources(self):
+        from benchbuild.utils.downloader import Wget
+
+        return [(Wget, self.boost_src_uri, self.boost_src_file)] + \
+            super(Povray, self).sources()
+
     def download(self):
         from benchbuild.utils.downloader import Git, Wget
         from plumbum.cmd import tar
@@ -16,6 +16,12 @@ class Rasdaman(BenchBuildGroup):
     gdal_dir = "gdal"
     gdal_uri = "https://github.com/OSGeo/gdal"
 
+    def sources(self):
+        from benchbuild.utils.downloader import Git
+
+        return [(Git, self.gdal_uri, self.gdal_dir)] + \
+            super(Rasdaman, self).sources()
+
     def download(self):
         from benchbuild.utils.downloader import Git
 
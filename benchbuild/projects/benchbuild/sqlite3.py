@@ -42,12 +42,20 @@ class SQLite3(BenchBuildGroup):
         with local.cwd(self.builddir):
             self.build_leveldb()
 
-    def fetch_leveldb(self):
-        src_uri = "https://github.com/google/leveldb"
+    leveldb_uri = "https://github.com/google/leveldb"
+    leveldb_dir = "leveldb.src"
+
+    def sources(self):
+        from benchbuild.utils.downloader import Git
 
+        return super(SQLite3, self).sources() + [
+            (Git, self.leveldb_uri, self.leveldb_dir)
+        ]
+
+    def fetch_leveldb(self):
         with local.cwd(self.builddir):
             from benchbuild.utils.downloader import Git
-            Git(src_uri, "leveldb.src")
+            Git(self.leveldb_uri, self.leveldb_dir)
 
     def build_leveldb(self):
         from benchbuild.utils.compiler import lt_clang, lt_clang_cxx
@@ -16,13 +16,19 @@ class Crafty(GentooGroup):
     NAME = "gentoo-crafty"
     DOMAIN = "games-board"
 
+    book_file = "book.bin"
+    book_uri = "http://www.craftychess.com/" + book_file
+
+    def sources(self):
+        return super(Crafty, self).sources() + [
+            (Wget, self.book_uri, self.book_file)
+        ]
+
     def download(self):
         super(Crafty, self).download()
 
-        book_file = "book.bin"
-        book_bin = "http://www.craftychess.com/" + book_file
         with local.cwd(self.builddir):
-            Wget(book_bin, book_file)
+            Wget(self.book_uri, self.book_file)
 
     def build(self):
         with local.cwd(self.builddir):
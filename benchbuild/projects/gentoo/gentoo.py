@@ -192,6 +192,11 @@ class PrepareStage3(GentooGroup):
                     "gentoo/snapshots/portage-latest.tar.bz2"
     src_file_portage = "portage_snap.tar.bz2"
 
+    def sources(self):
+        return super(PrepareStage3, self).sources() + [
+            (Wget, self.src_uri_portage, self.src_file_portage)
+        ]
+
     def download(self):
         super(PrepareStage3, self).download()
 
@@ -21,6 +21,12 @@ class LNTGroup(Project):
     test_suite_dir = "test-suite"
     test_suite_uri = "http://llvm.org/git/test-suite"
 
+    def sources(self):
+        from benchbuild.utils.downloader import Git
+
+        return [(Git, self.src_uri, self.src_dir),
+                (Git, self.test_suite_uri, self.test_suite_dir)]
+
     def download(self):
         from benchbuild.utils.downloader import Git
         from plumbum.cmd import virtualenv
@@ -160,6 +166,13 @@ class Povray(LNTGroup):
     povray_url = "https://github.com/POV-Ray/povray"
     povray_src_dir = "Povray"
 
+    def sources(self):
+        from benchbuild.utils.downloader import Git
+
+        return super(Povray, self).sources() + [
+            (Git, self.povray_url, self.povray_src_dir)
+        ]
+
     def download(self):
 
         from benchbuild.utils.downloader import Git
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+""" Remove records of completed steps and the build directories they keep. """
+from plumbum import cli
+
+
+class BenchBuildPrune(cli.Application):
+    """ Remove stale step records and, optionally, old build directories. """
+
+    trees = cli.Flag(["--trees"],
+                     help="Remove the build directories of all records, "
+                     "not only records whose build directory is gone")
+
+    older_than = cli.SwitchAttr(
+        ["--older-than"], float, default=None,
+        help="Only remove build directories not used for DAYS days")
+
+    def main(self):
+        from benchbuild.utils.actions import prune_step_cache
+
+        older_than = None
+        if self.older_than is not None:
+            older_than = self.older_than * 24 * 60 * 60
+        removed = prune_step_cache(self.trees, older_than)
+        if not removed:
+            print("Nothing to prune.")
+        for builddir in removed:
+            print("Removed: {0}".format(builddir))
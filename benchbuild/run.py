@@ -38,6 +38,14 @@ class BenchBuildRun(cli.Application):
     def experiment_tag(self, description):
         CFG["experiment_description"] = description
 
+    @cli.switch(["--resume"],
+                str,
+                help="Resume the experiment with the given UUID and skip "
+                     "all projects that completed before")
+    def resume(self, experiment_id):
+        CFG["experiment_id"] = experiment_id
+        CFG["resume"] = True
+
     @cli.switch(["-P", "--project"],
                 str,
                 list=True,
@@ -71,6 +79,37 @@ class BenchBuildRun(cli.Application):
     def group(self, group):
         self._group_name = group
 
+    @cli.switch(["-j", "--parallel-projects"],
+                int,
+                help="Number of projects to process in parallel")
+    def parallel_projects(self, num):
+        CFG["parallel"]["projects"] = num
+
+    @cli.switch(["--parallel-runs"],
+                help="Do not serialize the run-time steps of parallel projects")
+    def parallel_runs(self):
+        CFG["parallel"]["serialize_runs"] = False
+
+    @cli.switch(["--force"],
+                str,
+                list=True,
+                help="Execute the given step (e.g. BUILD), even if its "
+                     "inputs did not change. Use ALL for every step")
+    def force(self, steps):
+        CFG["steps"]["force"] = [step.upper() for step in steps]
+
+    @cli.switch(["--no-prefetch"],
+                help="Do not fetch the sources of all projects, before the "
+                     "experiment starts")
+    def no_prefetch(self):
+        CFG["download"]["prefetch"] = False
+
+    @cli.switch(["--verify-cache"],
+                help="Verify the contents of all cached downloads, not only "
+                     "their metadata")
+    def verify_cache(self):
+        CFG["download"]["verify"] = True
+
     pretend = cli.Flag(['p', 'pretend'], default = False)
 
     def main(self):
@@ -122,24 +161,34 @@ class BenchBuildRun(cli.Application):
                     print("Created directory {0}.".format(builddir))
 
         actns = []
+        projects = []
         for exp_name in self._experiment_names:
             if exp_name in exps:
                 exp_cls = exps[exp_name]
                 exp = exp_cls(project_names, group_name)
                 eactn = Experiment(exp, exp.actions())
                 actns.append(eactn)
+                projects.extend(exp.projects.values())
             else:
                 from logging import error
                 error("Could not find {} in the experiment registry.",
                       exp_name)
 
         num_actions = sum([len(x) for x in actns])
+        print("Experiment id: {} (see --resume)".format(
+            CFG["experiment_id"].value()))
         print("Number of actions to execute: {}".format(num_actions))
+        num_parallel = CFG["parallel"]["projects"].value()
+        if num_parallel > 1:
+            print("Projects processed in parallel: {}".format(num_parallel))
         for a in actns:
             print(a)
         print()
 
         if not self.pretend:
+            if CFG["download"]["prefetch"].value():
+                from benchbuild.utils.downloader import prefetch
+                prefetch(projects)
             for a in actns:
                 a()
 
@@ -11,7 +11,7 @@ import re
 import warnings
 import logging
 from datetime import datetime
-from plumbum import local
+from types import MappingProxyType
 
 
 def available_cpu_count():
@@ -120,7 +120,10 @@ class Configuration():
         CFG["build_dir"] becomes BB_BUILD_DIR
         CFG["llvm"]["dir"] becomes BB_LLVM_DIR
 
-    The configuration can be stored/loaded as JSON.
+    The configuration can be stored/loaded as JSON. A flat, read-only copy
+    of all values is available as snapshot(). Wrapper scripts load it from
+    the file given in BB_CONFIG_SNAPSHOT instead of searching and loading
+    the config file (see snapshot_file).
 
     Examples:
         >>> from benchbuild import settings as s
@@ -134,13 +137,29 @@ class Configuration():
         <class 'benchbuild.settings.Configuration'>
     """
 
+    __generation = 0
+
     def __init__(self, parent_key, node=None, parent=None, init=True):
         self.parent = parent
         self.parent_key = parent_key
         self.node = node if node is not None else {}
+        self.__children = {}
+        self.__cache = {}
         if init:
             self.init_from_env()
 
+    @classmethod
+    def __changed(cls):
+        """Invalidate the cached representations of all configurations."""
+        cls.__generation += 1
+
+    def __cached(self, key, func):
+        generation, value = self.__cache.get(key, (None, None))
+        if generation != Configuration.__generation:
+            value = func()
+            self.__cache[key] = (Configuration.__generation, value)
+        return value
+
     def store(self, config_file):
         """ Store the configuration dictionary to a file."""
         with open(config_file, 'w') as outf:
@@ -167,6 +186,119 @@ class Configuration():
             with open(_from, 'r') as inf:
                 load_rec(self.node, json.load(inf))
                 self['config_file'] = os.path.abspath(_from)
+            self.__changed()
+
+    def snapshot(self):
+        """
+        Get a flat, read-only copy of all values below this node.
+
+        The snapshot is computed once and reused until the configuration
+        changes.
+
+        Returns (Mapping):
+            Dotted path of every setting to its value.
+
+        Examples:
+            >>> from benchbuild import settings as s
+            >>> c = s.Configuration("test")
+            >>> c['x'] = { "y" : { "default" : 1 }, "z" : { "value" : 2 }}
+            >>> snapshot = c.snapshot()
+            >>> sorted(snapshot.items())
+            [('x.y', 1), ('x.z', 2)]
+            >>> c['x']['y'] = 3
+            >>> c.snapshot()['x.y']
+            3
+        """
+
+        def flatten():
+            values = {}
+            pending = [("", self.node)]
+            while pending:
+                prefix, node = pending.pop()
+                if 'value' in node:
+                    values[prefix] = node['value']
+                elif 'default' in node:
+                    values[prefix] = node['default']
+                else:
+                    for key, child in node.items():
+                        if isinstance(child, dict):
+                            pending.append((prefix + "." + key if prefix
+                                            else key, child))
+            return MappingProxyType(values)
+
+        return self.__cached("snapshot", flatten)
+
+    def snapshot_file(self, directory):
+        """
+        Store the snapshot of this configuration in :directory:.
+
+        The file is named after its contents, so a snapshot that did not
+        change is written only once. Only the current user may read it.
+        Secrets (see SNAPSHOT_SECRETS) are not written. We export them to
+        the environment instead, a process that loads the snapshot reads
+        them from there.
+        Snapshots in :directory: that were not written for
+        SNAPSHOT_MAX_AGE seconds are removed.
+
+        Args:
+            directory (str): Where we store the snapshot.
+
+        Returns (str):
+            Path to the snapshot file.
+        """
+        import hashlib
+
+        def store():
+            values = dict(self.snapshot())
+            for key in SNAPSHOT_SECRETS:
+                secret = values.pop(key, None)
+                if secret:
+                    self.__export(key, secret)
+            data = json.dumps(values, cls=UUIDEncoder, sort_keys=True)
+            snapshot_dir = os.path.abspath(directory)
+            snapshot_f = os.path.join(
+                snapshot_dir, ".benchbuild-{0}.json".format(
+                    hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]))
+            if not os.path.exists(snapshot_f):
+                os.makedirs(snapshot_dir, exist_ok=True)
+                tmp_f = "{0}.{1}.tmp".format(snapshot_f, os.getpid())
+                with os.fdopen(os.open(tmp_f, os.O_WRONLY | os.O_CREAT |
+                                       os.O_TRUNC, 0o600), 'w') as outf:
+                    outf.write(data)
+                os.replace(tmp_f, snapshot_f)
+            else:
+                os.utime(snapshot_f)
+            remove_snapshots(snapshot_dir, SNAPSHOT_MAX_AGE)
+            return snapshot_f
+
+        return self.__cached(("snapshot_file", directory), store)
+
+    def __export(self, key, value):
+        """Make :key: available to child processes in the environment."""
+        from plumbum import local
+
+        env_var = "_".join([self.__to_env_var__()] +
+                           key.upper().split("."))
+        env_val = json.dumps(value, cls=UUIDEncoder)
+        os.environ[env_var] = env_val
+        local.env[env_var] = env_val
+
+    def load_snapshot(self, snapshot_f):
+        """
+        Restore all values of a snapshot written by snapshot_file.
+
+        Args:
+            snapshot_f (str): Path to the snapshot file.
+        """
+        with open(snapshot_f, 'r') as inf:
+            values = json.load(inf)
+
+        for dotted_key, value in values.items():
+            node = self.node
+            for key in dotted_key.split("."):
+                node = node.setdefault(key, {})
+            node['value'] = value
+        self.__changed()
 
     def init_from_env(self):
         """
@@ -178,20 +310,27 @@ class Configuration():
         Otherwise, init our children.
         """
 
-        if 'default' in self.node:
-            env_var = self.__to_env_var__().upper()
-            if 'value' in self.node:
-                env_val = os.getenv(env_var, self.node['value'])
+        environ = os.environ
+        pending = [(self.__to_env_var__().upper(), self.node)]
+        while pending:
+            env_var, node = pending.pop()
+            if 'default' in node:
+                if env_var in environ:
+                    env_val = environ[env_var]
+                else:
+                    env_val = node.get('value', node['default'])
+                # Only strings can hold JSON, everything else is parsed.
+                if isinstance(env_val, str):
+                    try:
+                        env_val = json.loads(env_val)
+                    except ValueError:
+                        pass
+                node['value'] = env_val
             else:
-                env_val = os.getenv(env_var, self.node['default'])
-            try:
-                self.node['value'] = json.loads(str(env_val))
-            except ValueError:
-                self.node['value'] = env_val
-        else:
-            if isinstance(self.node, dict):
-                for k in self.node:
-                    self[k].init_from_env()
+                for key, child in node.items():
+                    if isinstance(child, dict):
+                        pending.append((env_var + "_" + key.upper(), child))
+        self.__changed()
 
     def update(self, cfg_dict):
         """
@@ -205,6 +344,13 @@ class Configuration():
 
         """
         self.node.update(cfg_dict.node)
+        self.__changed()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_Configuration__children"] = {}
+        state["_Configuration__cache"] = {}
+        return state
 
     def value(self):
         """
@@ -235,7 +381,12 @@ class Configuration():
                 category=InvalidConfigKey,
                 stacklevel=2)
             return Configuration(key, init=False)
-        return Configuration(key, parent=self, node=self.node[key], init=False)
+        node = self.node[key]
+        child = self.__children.get(key)
+        if child is None or child.node is not node:
+            child = Configuration(key, parent=self, node=node, init=False)
+            self.__children[key] = child
+        return child
 
     def __setitem__(self, key, val):
         if key in self.node:
@@ -245,6 +396,7 @@ class Configuration():
                 self.node[key] = val
             else:
                 self.node[key] = {'value': val}
+        self.__changed()
 
     def __contains__(self, key):
         return key in self.node
@@ -258,18 +410,21 @@ class Configuration():
             return str(self.node)
 
     def __repr__(self):
-        _repr = []
-        if 'value' in self.node:
-            return self.__to_env_var__() + "=" + escape_json(json.dumps(
-                self.node['value']))
-        if 'default' in self.node:
-            return self.__to_env_var__() + "=" + escape_json(json.dumps(
-                self.node['default']))
+        def to_repr():
+            _repr = []
+            if 'value' in self.node:
+                return self.__to_env_var__() + "=" + escape_json(json.dumps(
+                    self.node['value']))
+            if 'default' in self.node:
+                return self.__to_env_var__() + "=" + escape_json(json.dumps(
+                    self.node['default']))
+
+            for k in self.node:
+                _repr.append(repr(self[k]))
 
-        for k in self.node:
-            _repr.append(repr(self[k]))
+            return "\n".join(sorted(_repr))
 
-        return "\n".join(sorted(_repr))
+        return self.__cached("repr", to_repr)
 
     def __to_env_var__(self):
         if self.parent:
@@ -277,6 +432,37 @@ class Configuration():
                 self.parent.__to_env_var__() + "_" + self.parent_key).upper()
         return self.parent_key.upper()
 
+SNAPSHOT_SECRETS = ("db.pass", "db.connect_string")
+"""Settings that snapshot_file keeps out of the snapshot."""
+
+SNAPSHOT_MAX_AGE = 7 * 24 * 60 * 60
+"""Snapshots not written for this many seconds are removed."""
+
+
+def remove_snapshots(directory, max_age):
+    """
+    Remove old configuration snapshots.
+
+    A process that still refers to a removed snapshot loads the
+    configuration file instead.
+
+    Args:
+        directory (str): The directory snapshot_file stores snapshots in.
+        max_age (float): Remove snapshots not written for this many seconds.
+    """
+    import glob
+    import time
+
+    now = time.time()
+    for snapshot_f in glob.glob(os.path.join(directory, ".benchbuild-*.json")):
+        try:
+            if now - os.path.getmtime(snapshot_f) > max_age:
+                os.unlink(snapshot_f)
+        except OSError:
+            # Someone else removed it first.
+            pass
+
+
 # Initialize the global configuration once.
 CFG = Configuration(
     "bb",
@@ -334,6 +520,12 @@ CFG = Configuration(
             "desc": "The experiment name we run everything under.",
             "default": "empty"
         },
+        "resume": {
+            "desc":
+            "Resume the experiment given by experiment_id and skip all "
+            "projects that completed before.",
+            "default": False
+        },
         "local_build": {
             "desc": "Perform a local build on the cluster nodes.",
             "default": False
@@ -360,6 +552,164 @@ CFG = Configuration(
         }
     })
 
+CFG["parallel"] = {
+    "projects": {
+        "desc": "Number of projects of an experiment that are processed "
+                "concurrently.",
+        "default": 1
+    },
+    "serialize_runs": {
+        "desc":
+        "Execute all run-time steps in a single measurement lane, even if "
+        "projects are processed concurrently.",
+        "default": True
+    }
+}
+
+CFG["steps"] = {
+    "cache": {
+        "desc": "Skip steps that completed with identical inputs before. "
+                "This needs the build directory of the earlier run, "
+                "i.e., BB_CLEAN=false. 'benchbuild prune' removes old "
+                "records and build directories.",
+        "default": True
+    },
+    "force": {
+        "desc": "List of step names (or ALL) that are never skipped.",
+        "default": []
+    }
+}
+
+CFG["download"] = {
+    "verify": {
+        "desc":
+        "Hash all files of cached downloads, instead of only those whose "
+        "size, mtime or inode changed.",
+        "default": False
+    },
+    "materialize": {
+        "desc":
+        "How cached downloads get into the build directory: 'copy' or "
+        "'link' (hard links to a read-only, content-addressed store).",
+        "default": "copy"
+    },
+    "prefetch": {
+        "desc":
+        "Fetch the sources of all projects into the cache, before the "
+        "experiment starts.",
+        "default": True
+    },
+    "jobs": {
+        "desc": "Number of concurrent downloads during the prefetch.",
+        "default": 4
+    },
+    "git_reference": {
+        "desc":
+        "A local git repository (e.g., a shared mirror) that shallow clones "
+        "borrow objects from, if possible.",
+        "default": ""
+    },
+    "git_worktree": {
+        "desc":
+        "Materialize cached git repositories as worktrees of the cache "
+        "entry, instead of copying them.",
+        "default": False
+    },
+    "mirrors": {
+        "desc":
+        "Local directories with the layout of BB_TMP_DIR we copy missing "
+        "downloads from, before we go to the network. Entries without a "
+        ".hash file, or copies that do not match it, are ignored.",
+        "default": []
+    },
+    "bundles": {
+        "desc":
+        "Offline source bundles (see benchbuild bundle) we extract missing "
+        "downloads from, before we go to the network.",
+        "default": []
+    }
+}
+
+CFG["repeat"] = {
+    "min_reps": {
+        "desc": "Minimal number of measurements of a run-time test.",
+        "default": 1
+    },
+    "max_reps": {
+        "desc": "Maximal number of measurements of a run-time test.",
+        "default": 1
+    },
+    "warmup": {
+        "desc": "Number of unmeasured warm-up runs before the measurements.",
+        "default": 0
+    },
+    "precision": {
+        "desc":
+        "Stop repeating a measurement, if the confidence interval of its "
+        "median lies within this fraction of the median.",
+        "default": 0.05
+    },
+    "confidence": {
+        "desc": "Confidence level of the confidence interval of the median.",
+        "default": 0.95
+    }
+}
+
+CFG["cgroup"] = {
+    "enable": {
+        "desc":
+        "Run every command of a run in a transient cgroup (v2) and store "
+        "its cpu, memory, io and pressure accounting as metrics.",
+        "default": False
+    },
+    "path": {
+        "desc":
+        "The cgroup we create transient cgroups in. Defaults to the cgroup "
+        "of the current process.",
+        "default": ""
+    }
+}
+
+CFG["placement"] = {
+    "enable": {
+        "desc":
+        "Pin measured runs to disjoint sets of CPUs, chosen from as few NUMA "
+        "nodes as possible.",
+        "default": False
+    },
+    "smt": {
+        "desc":
+        "Place measured runs on SMT siblings, if there are not enough idle "
+        "physical cores.",
+        "default": False
+    },
+    "timeout": {
+        "desc":
+        "Seconds we wait for enough free CPUs before we give up (0: wait "
+        "forever).",
+        "default": 3600
+    },
+    "reserve": {
+        "desc":
+        "A cpu list, e.g., '4-7', reserved for measured runs. Configure and "
+        "build steps run on the other CPUs. Empty: no reserve.",
+        "default": ""
+    }
+}
+
+CFG["shim"] = {
+    "enable": {
+        "desc":
+        "Run binaries whose runtime extension only measures the execution "
+        "time through a compiled exec shim, instead of a python wrapper.",
+        "default": False
+    },
+    "cc": {
+        "desc": "The C compiler we build the exec shim with.",
+        "default": "cc"
+    }
+}
+
 CFG["env"] = {
     "compiler_ld_library_path": {
         "desc":
@@ -401,6 +751,27 @@ CFG["llvm"] = {
     },
 }
 
+CFG["compiler"] = {
+    "server": {
+        "desc":
+        "Route compiler wrapper calls through a long-lived compile server, "
+        "instead of starting a new python interpreter for every call.",
+        "default": False
+    },
+    "server_idle": {
+        "desc": "Seconds a compile server waits for requests before it exits.",
+        "default": 60
+    },
+    "cache": {
+        "desc":
+        "Serve repeated compilations of the same preprocessed source with the "
+        "same flags from a cache in BB_TMP_DIR/cc-cache. Unchanged sources "
+        "and headers are recognized without running the preprocessor. The "
+        "output of compiler extensions (e.g., -stats) is replayed on a hit.",
+        "default": False
+    },
+}
+
 CFG["papi"] = {
     "include": {
         "desc": "libpapi include path.",
@@ -448,6 +819,13 @@ CFG["repo"] = {
 }
 
 CFG['db'] = {
+    "connect_string": {
+        "desc":
+        "SQLAlchemy connect string of the result database, e.g., "
+        "sqlite:////path/to/results.db. If empty, we connect to the "
+        "PostgreSQL server given by host, port, name, user and pass.",
+        "default": ""
+    },
     "host": {
         "desc": "host name of our db.",
         "default": "localhost"
@@ -473,6 +851,29 @@ CFG['db'] = {
     "rollback": {
         "desc": "Rollback all operations after benchbuild completes.",
         "default": False
+    },
+    "batch_size": {
+        "desc": "Number of buffered measurement rows that trigger a bulk "
+                "insert.",
+        "default": 1000
+    },
+    "batch_interval": {
+        "desc": "Seconds after which buffered measurement rows are inserted, "
+                "regardless of their number.",
+        "default": 5
+    }
+}
+
+CFG["spool"] = {
+    "enable": {
+        "desc":
+        "Append all results to a spool file of this node instead of writing "
+        "them to the database. Load the spool with 'benchbuild ingest'.",
+        "default": False
+    },
+    "dir": {
+        "desc": "Directory of the spool files, one per node.",
+        "default": os.path.join(os.getcwd(), "spool")
     }
 }
 
@@ -568,6 +969,12 @@ CFG["perf"] = {
     "config": {
         "default": None,
         "desc": "A configuration for the pollyperformance experiment."
+    },
+    "events": {
+        "default":
+        "cycles,instructions,cache-references,cache-misses,branches,"
+        "branch-misses",
+        "desc": "The events the perf-stat experiment counts (perf stat -e)."
     }
 }
 
@@ -602,6 +1009,7 @@ CFG["plugins"] = {
             "benchbuild.experiments.empty",
             "benchbuild.experiments.papi",
             "benchbuild.experiments.compilestats_ewpt",
+            "benchbuild.experiments.perf_stat",
         ],
         "desc": "The experiment plugins we know about."
     },
@@ -699,6 +1107,12 @@ def __init_config(cfg):
              file right now. (init_from_env will refuse to update the
              value, if there is already one.)
     """
+    snapshot_f = os.getenv("BB_CONFIG_SNAPSHOT", None)
+    if snapshot_f and os.path.exists(snapshot_f):
+        cfg.load_snapshot(snapshot_f)
+        cfg.init_from_env()
+        return
+
     config_path = os.getenv("BB_CONFIG_FILE", None)
     if not config_path:
         config_path = find_config()
@@ -710,6 +1124,8 @@ def __init_config(cfg):
     cfg.init_from_env()
 
 def update_env():
+    from plumbum import local
+
     lookup_path = CFG["env"]["lookup_path"].value()
     lookup_path = os.path.pathsep.join(lookup_path)
     lookup_path = os.path.pathsep.join([lookup_path, os.environ["PATH"]])
@@ -0,0 +1,20 @@
+"""
+Shared fixtures of the benchbuild tests.
+"""
+import pytest
+
+
+@pytest.fixture
+def sqlite_db(tmpdir):
+    """Point benchbuild to a fresh SQLite database."""
+    from benchbuild.settings import CFG
+    from benchbuild.utils import schema
+
+    old_connect = CFG["db"]["connect_string"].value()
+    CFG["db"]["connect_string"] = "sqlite:///" + str(tmpdir.join("test.db"))
+    schema.reconnect()
+    try:
+        yield
+    finally:
+        CFG["db"]["connect_string"] = old_connect
+        schema.reconnect()
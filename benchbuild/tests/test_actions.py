@@ -1,8 +1,17 @@
 """
 Test the actions module.
 """
+import json
+import os
+import tempfile
 import unittest
+import pytest
+from types import SimpleNamespace
+from benchbuild.settings import CFG
 from benchbuild.utils import actions as a
+from benchbuild.utils import schema, journal
+from benchbuild.utils.db import persist_experiment
+from benchbuild.utils.run import GuardedRunException
 from benchbuild.project import Project
 from benchbuild.experiment import Experiment
 from plumbum import ProcessExecutionError
@@ -12,6 +21,29 @@ class EmptyProject(Project):
     DOMAIN = "debug"
     GROUP = "debug"
 
+class FailingRunProject(Project):
+    NAME = "test_failing_run"
+    DOMAIN = "debug"
+    GROUP = "debug"
+    src_uri = "none"
+
+    def run_tests(self, experiment):
+        raise GuardedRunException(RuntimeError("failed"), None, None)
+
+class FailingShimProject(Project):
+    NAME = "test_failing_shim"
+    DOMAIN = "debug"
+    GROUP = "debug"
+    src_uri = "none"
+
+    def run_tests(self, experiment):
+        from plumbum import local
+        record = {"argv": ["test"], "begin": 0.0, "real_s": 1.0,
+                  "user_s": 0.5, "system_s": 0.5, "maxrss_kb": 1,
+                  "retcode": 1, "signal": 0}
+        with open(local.env["BB_SHIM_RECORDS"], 'w') as records_f:
+            records_f.write(json.dumps(record) + "\n")
+
 class EmptyExperiment(Experiment):
     NAME = "test_empty"
 
@@ -23,6 +55,40 @@ class PassAlways(a.Step):
     def __call__(self):
         return a.StepResult.OK
 
+class CountCalls(a.Step):
+    NAME = "COUNT"
+
+    def __init__(self, obj):
+        super(CountCalls, self).__init__(obj)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+
+    def fingerprint(self):
+        return "count"
+
+class CountRuns(a.Step):
+    NAME = "COUNT"
+    calls = 0
+
+    def __call__(self):
+        CountRuns.calls += 1
+
+    def fingerprint(self):
+        return a.project_inputs(self.NAME, self._obj)
+
+class CachedExperiment(Experiment):
+    NAME = "test_cached"
+
+    def actions_for_project(self, project):
+        return [a.MakeBuildDir(project), CountRuns(project),
+                a.Clean(project)]
+
+def fake_project(builddir):
+    return SimpleNamespace(name="test", builddir=builddir,
+                           experiment=SimpleNamespace(name="test"))
+
 class ActionsTestCase(unittest.TestCase):
     def test_for_all_pass(self):
         ep = EmptyProject(EmptyExperiment())
@@ -33,3 +99,196 @@ class ActionsTestCase(unittest.TestCase):
         ep = EmptyProject(EmptyExperiment())
         actn = a.RequireAll([ FailAlways(ep) ])
         self.assertEqual(actn(), a.StepResult.ERROR)
+
+    def test_parallel_chains(self):
+        chains = [a.RequireAll([PassAlways(None)]),
+                  a.RequireAll([FailAlways(None)]),
+                  a.RequireAll([PassAlways(None)])]
+        self.assertEqual(a.run_parallel(chains, 2),
+                         [a.StepResult.OK, a.StepResult.ERROR,
+                          a.StepResult.OK])
+
+    def test_cached_step(self):
+        with tempfile.TemporaryDirectory() as builddir:
+            old_builddir = CFG["build_dir"].value()
+            CFG["build_dir"] = builddir
+            try:
+                step = CountCalls(fake_project(builddir))
+                actn = a.RequireAll([step])
+                actn()
+                actn()
+                self.assertEqual(step.calls, 1)
+
+                CFG["steps"]["force"] = ["COUNT"]
+                actn()
+                self.assertEqual(step.calls, 2)
+            finally:
+                CFG["steps"]["force"] = []
+                CFG["build_dir"] = old_builddir
+
+    def run_cached_experiment(self, clean):
+        CFG["clean"] = clean
+        exp = CachedExperiment(projects=["test_empty"])
+        for actn in exp.actions():
+            actn()
+        return exp
+
+    def test_clean_drops_cached_chain(self):
+        with tempfile.TemporaryDirectory() as builddir:
+            old_builddir = CFG["build_dir"].value()
+            old_connect = CFG["db"]["connect_string"].value()
+            CFG["build_dir"] = builddir
+            CFG["db"]["connect_string"] = "sqlite:///" + os.path.join(
+                builddir, "test.db")
+            schema.reconnect()
+            CountRuns.calls = 0
+            try:
+                # Only BB_CLEAN=false keeps the tree of completed steps.
+                self.run_cached_experiment(False)
+                exp = self.run_cached_experiment(False)
+                self.assertEqual(CountRuns.calls, 1)
+                self.assertTrue(
+                    os.path.isdir(exp.projects["test_empty"].builddir))
+
+                # BB_CLEAN=true starts from scratch and leaves nothing behind.
+                exp = self.run_cached_experiment(True)
+                self.assertEqual(CountRuns.calls, 2)
+                self.assertFalse(os.path.exists(exp.builddir))
+                self.assertEqual(
+                    os.listdir(os.path.join(builddir, ".steps",
+                                            "test_cached")), [])
+            finally:
+                CFG["clean"] = True
+                CFG["build_dir"] = old_builddir
+                CFG["db"]["connect_string"] = old_connect
+                schema.reconnect()
+
+    def test_prune(self):
+        with tempfile.TemporaryDirectory() as builddir:
+            old_builddir = CFG["build_dir"].value()
+            CFG["build_dir"] = builddir
+            try:
+                prjs = []
+                for name in ["gone", "old", "new"]:
+                    prj = fake_project(os.path.join(builddir, name))
+                    prj.name = name
+                    os.makedirs(prj.builddir)
+                    a.store_step_cache(prj, "COUNT", "count")
+                    prjs.append(prj)
+                gone, old, new = [prj.builddir for prj in prjs]
+                os.rmdir(gone)
+                os.utime(a.step_cache_path(prjs[1]), (0, 0))
+
+                self.assertEqual(a.prune_step_cache(), [gone])
+                self.assertEqual(a.prune_step_cache(True, 24 * 60 * 60),
+                                 [old])
+                self.assertFalse(os.path.exists(old))
+                self.assertTrue(os.path.isdir(new))
+                self.assertEqual(a.prune_step_cache(True), [new])
+                self.assertFalse(os.path.exists(new))
+            finally:
+                CFG["build_dir"] = old_builddir
+
+    def test_resume_completed_chain(self):
+        with tempfile.TemporaryDirectory() as builddir:
+            old_builddir = CFG["build_dir"].value()
+            CFG["build_dir"] = builddir
+            try:
+                step = CountCalls(fake_project(builddir))
+                CFG["steps"]["force"] = ["ALL"]
+                a.RequireAll([step], key="test/chain")()
+
+                CFG["resume"] = True
+                a.RequireAll([step], key="test/chain")()
+                a.RequireAll([step], key="test/other")()
+            finally:
+                CFG["resume"] = False
+                CFG["steps"]["force"] = []
+                CFG["build_dir"] = old_builddir
+            self.assertEqual(step.calls, 2)
+
+
+class VersionedProject(Project):
+    NAME = "test_versioned"
+    DOMAIN = "debug"
+    GROUP = "debug"
+    VERSION = "1.0"
+
+
+class ChangedProject(VersionedProject):
+    def build(self):
+        pass
+
+
+@pytest.mark.usefixtures("sqlite_db")
+class ProjectInputsTestCase(unittest.TestCase):
+    def inputs(self, cls):
+        return a.project_inputs(
+            "BUILD", cls(EmptyExperiment(projects=["test_empty"])))
+
+    def test_version(self):
+        before = self.inputs(VersionedProject)
+        VersionedProject.VERSION = "2.0"
+        try:
+            self.assertNotEqual(self.inputs(VersionedProject), before)
+        finally:
+            VersionedProject.VERSION = "1.0"
+        self.assertEqual(self.inputs(VersionedProject), before)
+
+    def test_definition(self):
+        self.assertNotEqual(self.inputs(ChangedProject),
+                            self.inputs(VersionedProject))
+        self.assertNotEqual(a.definition_digest(VersionedProject), "")
+
+
+@pytest.mark.usefixtures("sqlite_db")
+class ResumeFailedRunTestCase(unittest.TestCase):
+    def test_resume_after_failed_run(self):
+        with tempfile.TemporaryDirectory() as builddir:
+            old_builddir = CFG["build_dir"].value()
+            CFG["build_dir"] = builddir
+            try:
+                exp = EmptyExperiment(projects=["test_failing_run"])
+                persist_experiment(exp)
+                a.MakeBuildDir(exp)()
+                prj = exp.projects["test_failing_run"]
+
+                def chain():
+                    return a.RequireAll([a.MakeBuildDir(prj), a.Run(prj)],
+                                        key="test/failing_run")
+
+                self.assertEqual(chain()(), a.StepResult.ERROR)
+                self.assertNotIn("test/failing_run", journal.entries())
+
+                CFG["resume"] = True
+                self.assertFalse(chain().completed())
+            finally:
+                CFG["resume"] = False
+                CFG["build_dir"] = old_builddir
+
+
+@pytest.mark.usefixtures("sqlite_db")
+class FailedShimRunTestCase(unittest.TestCase):
+    def test_failed_shim_record_fails_group(self):
+        with tempfile.TemporaryDirectory() as builddir:
+            old_builddir = CFG["build_dir"].value()
+            CFG["build_dir"] = builddir
+            try:
+                exp = EmptyExperiment(projects=["test_failing_shim"])
+                persist_experiment(exp)
+                a.MakeBuildDir(exp)()
+                prj = exp.projects["test_failing_shim"]
+                a.MakeBuildDir(prj)()
+
+                self.assertEqual(prj.run(exp), a.StepResult.ERROR)
+            finally:
+                CFG["build_dir"] = old_builddir
+
+        session = schema.Session()
+        group = session.query(schema.RunGroup).filter(
+            schema.RunGroup.id == prj.run_uuid).one()
+        self.assertEqual(group.status, "failed")
+        run = session.query(schema.Run).filter(
+            schema.Run.run_group == prj.run_uuid).one()
+        self.assertEqual(run.status, "failed")
+
@@ -0,0 +1,128 @@
+"""
+Test when the write buffer inserts measurement rows.
+"""
+import os
+import subprocess
+import sys
+import textwrap
+import unittest
+import uuid
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from benchbuild.settings import CFG
+from benchbuild.utils import db, run, schema
+
+
+@pytest.mark.usefixtures("sqlite_db")
+class FlushTestCase(unittest.TestCase):
+    def setUp(self):
+        CFG["db"]["batch_size"] = 1000
+        CFG["db"]["batch_interval"] = 3600
+        self.prj = SimpleNamespace(name="test_buffer", domain="debug",
+                                   group_name=None, src_uri="none",
+                                   run_uuid=uuid.uuid4())
+        db.persist_experiment(SimpleNamespace(name="test-buffer"))
+        db.persist_project(self.prj)
+        self.group, self.session = run.begin_run_group(self.prj)
+        db_run, run_session = db.create_run("cmd", self.prj.name,
+                                            "test-buffer", self.prj.run_uuid)
+        run_session.commit()
+        self.run_id = db_run.id
+
+    def tearDown(self):
+        db.flush()
+        self.session.close()
+        CFG["db"]["batch_size"] = 1000
+        CFG["db"]["batch_interval"] = 5
+
+    def metrics(self):
+        session = schema.Session()
+        try:
+            return sorted(session.query(schema.Metric.name,
+                                        schema.Metric.value).all())
+        finally:
+            session.close()
+
+    def add(self, name, value):
+        db.BUFFER.add(schema.Metric(name=name, value=value,
+                                    run_id=self.run_id))
+
+    def test_buffers_rows(self):
+        self.add("m", 1.0)
+        self.assertEqual(self.metrics(), [])
+
+    def test_batch_size(self):
+        CFG["db"]["batch_size"] = 2
+        self.add("m", 1.0)
+        self.assertEqual(self.metrics(), [])
+        self.add("n", 2.0)
+        self.assertEqual(self.metrics(), [("m", 1.0), ("n", 2.0)])
+
+    def test_end_run_group(self):
+        self.add("m", 1.0)
+        run.end_run_group(self.group, self.session)
+        self.assertEqual(self.metrics(), [("m", 1.0)])
+        self.assertEqual(self.group.status, "completed")
+
+    def test_fail_run_group(self):
+        self.add("m", 1.0)
+        run.fail_run_group(self.group, self.session)
+        self.assertEqual(self.metrics(), [("m", 1.0)])
+        self.assertEqual(self.group.status, "failed")
+
+    def test_exit(self):
+        script = textwrap.dedent("""
+            from benchbuild.utils import db, schema
+            db.BUFFER.add(schema.Metric(name="m", value=1.0, run_id={0}))
+            session = schema.Session()
+            assert not session.query(schema.Metric).all()
+            session.close()
+        """).format(self.run_id)
+        env = dict(os.environ)
+        env.update({
+            "BB_DB_CONNECT_STRING": str(CFG["db"]["connect_string"]),
+            "BB_DB_BATCH_SIZE": "1000",
+            "BB_DB_BATCH_INTERVAL": "3600",
+            "PYTHONPATH": os.pathsep.join(sys.path)
+        })
+        subprocess.check_call([sys.executable, "-c", script], env=env)
+        self.assertEqual(self.metrics(), [("m", 1.0)])
+
+    def test_likwid_columns(self):
+        from sqlalchemy.engine import Connection
+        from benchbuild.likwid import LikwidColumns
+
+        measurements = LikwidColumns()
+        measurements.append("main", "CPI", "Core 0", 1.5)
+        measurements.append("main", "CPI", "Core 1", 0.5)
+        measurements.append("loop", "CPI", "Core 0", 2.0)
+        db.persist_likwid(SimpleNamespace(id=self.run_id), None,
+                          measurements)
+
+        execute = Connection.execute
+        with mock.patch.object(Connection, "execute", autospec=True,
+                               side_effect=execute) as spy:
+            db.flush()
+        inserts = [
+            call[0][2] for call in spy.call_args_list
+            if "likwid" in str(call[0][1])
+        ]
+        # A single executemany, with the rows as zipped columns.
+        self.assertEqual(inserts, [[
+            ("main", "CPI", "Core 0", 1.5, self.run_id),
+            ("main", "CPI", "Core 1", 0.5, self.run_id),
+            ("loop", "CPI", "Core 0", 2.0, self.run_id)
+        ]])
+
+        session = schema.Session()
+        try:
+            rows = session.query(schema.Likwid.region, schema.Likwid.core,
+                                 schema.Likwid.value).all()
+        finally:
+            session.close()
+        self.assertEqual(sorted(rows), [("loop", "Core 0", 2.0),
+                                        ("main", "Core 0", 1.5),
+                                        ("main", "Core 1", 0.5)])
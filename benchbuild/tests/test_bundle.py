@@ -0,0 +1,145 @@
+"""
+Test creating and extracting offline source bundles.
+"""
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from unittest import mock
+
+from benchbuild.bundle import BundleExtract
+from benchbuild.settings import CFG
+from benchbuild.utils import bundle, downloader
+
+
+def Fake(url, name, fetch_only=False):
+    """Stands in for a downloader function."""
+
+
+class BundleTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = os.path.join(self.tmp_dir, "cache")
+        self.node = os.path.join(self.tmp_dir, "node")
+        os.makedirs(self.node)
+        self.write("cache/a/main.c", "int main() { return 0; }\n")
+        self.write("cache/a/sub/util.h", "#pragma once\n")
+        os.symlink("sub/util.h", os.path.join(self.cache, "a", "util.h"))
+        self.write("cache/b.tar.gz", "not really a tarball\n")
+        self.bundle_f = os.path.join(self.tmp_dir, "sources.tar")
+        self.assertEqual(
+            bundle.create(self.bundle_f,
+                          [(Fake, "http://a", "a"),
+                           (Fake, "http://b", "b.tar.gz"),
+                           (Fake, "http://c", "c")], self.cache), ["c"])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, relpath, content):
+        path = os.path.join(self.tmp_dir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as out_f:
+            out_f.write(content)
+
+    def manifest(self, root, name):
+        return downloader.build_manifest(os.path.join(root, name))
+
+    def forged_bundle(self, *members):
+        """A bundle whose entry 'x' consists of the given members."""
+        forged_f = os.path.join(self.tmp_dir, "forged.tar")
+        index = json.dumps({
+            "format": bundle.FORMAT,
+            "entries": {"x": {"url": "", "method": "", "digest": ""}}
+        }).encode("utf-8")
+        with tarfile.open(forged_f, "w") as forged:
+            info = tarfile.TarInfo(bundle.INDEX_F)
+            info.size = len(index)
+            forged.addfile(info, io.BytesIO(index))
+            for member in members:
+                if isinstance(member, tuple):
+                    forged.addfile(*member)
+                else:
+                    forged.addfile(member)
+        return forged_f
+
+    def test_index(self):
+        index = bundle.read_index(self.bundle_f)
+        self.assertEqual(sorted(index), ["a", "b.tar.gz"])
+        self.assertEqual(index["a"]["method"], "Fake")
+        self.assertEqual(
+            index["a"]["digest"],
+            downloader.manifest_digest(self.manifest(self.cache, "a")))
+
+    def test_extract_in_one_pass(self):
+        with mock.patch.object(bundle.tarfile, "open",
+                               wraps=tarfile.open) as tar_open:
+            self.assertEqual(
+                bundle.extract_all(self.bundle_f, ["a", "b.tar.gz", "c"],
+                                   self.node), ["a", "b.tar.gz"])
+        self.assertEqual(tar_open.call_count, 1)
+        for name in ["a", "b.tar.gz"]:
+            self.assertEqual(
+                downloader.manifest_digest(self.manifest(self.node, name)),
+                downloader.manifest_digest(self.manifest(self.cache, name)))
+        self.assertEqual(os.readlink(os.path.join(self.node, "a", "util.h")),
+                         "sub/util.h")
+        self.assertEqual(sorted(os.listdir(self.node)), ["a", "b.tar.gz"])
+
+    def test_extract(self):
+        self.assertTrue(bundle.extract(self.bundle_f, "b.tar.gz", self.node))
+        self.assertFalse(bundle.extract(self.bundle_f, "c", self.node))
+        self.assertEqual(os.listdir(self.node), ["b.tar.gz"])
+
+    def test_digest_mismatch(self):
+        content = b"changed\n"
+        changed = tarfile.TarInfo("entries/x")
+        changed.size = len(content)
+        forged_f = self.forged_bundle((changed, io.BytesIO(content)))
+        self.assertEqual(bundle.extract_all(forged_f, ["x"], self.node), [])
+        self.assertEqual(os.listdir(self.node), [])
+
+    def test_reject_links_out_of_entry(self):
+        outside = [("entries/x/up", "../y"), ("entries/x/abs", "/etc"),
+                   ("entries/x/sub/up", "../../../etc")]
+        for name, target in outside:
+            link = tarfile.TarInfo(name)
+            link.type = tarfile.SYMTYPE
+            link.linkname = target
+            self.assertFalse(bundle.is_safe(link, "x"))
+
+        link = tarfile.TarInfo("entries/x/hard")
+        link.type = tarfile.LNKTYPE
+        link.linkname = "entries/y/secret"
+        self.assertFalse(bundle.is_safe(link, "x"))
+
+        with self.assertLogs(bundle.LOG, "ERROR") as logs:
+            self.assertEqual(
+                bundle.extract_all(self.forged_bundle(link), ["x"],
+                                   self.node), [])
+        self.assertIn("Refusing to extract entries/x/hard", logs.output[0])
+        self.assertEqual(os.listdir(self.node), [])
+
+    def test_links_inside_entry(self):
+        inner = tarfile.TarInfo("entries/x/sub/up")
+        inner.type = tarfile.SYMTYPE
+        inner.linkname = "../other"
+        self.assertTrue(bundle.is_safe(inner, "x"))
+        device = tarfile.TarInfo("entries/x/null")
+        device.type = tarfile.CHRTYPE
+        self.assertFalse(bundle.is_safe(device, "x"))
+
+    def test_extract_command(self):
+        old_tmp_dir = CFG["tmp_dir"].value()
+        CFG["tmp_dir"] = self.node
+        try:
+            self.assertEqual(
+                BundleExtract("extract").main(self.bundle_f), 0)
+            self.assertFalse(downloader.source_required("a", self.node))
+            self.assertFalse(downloader.source_required("b.tar.gz",
+                                                        self.node))
+        finally:
+            CFG["tmp_dir"] = old_tmp_dir
@@ -0,0 +1,112 @@
+"""
+Test parsing the accounting files of cgroups v2.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchbuild.utils import cgroup
+
+CPU_STAT = """usage_usec 2412345
+user_usec 2000000
+system_usec 412345
+core_sched.force_idle_usec 0
+nr_periods 0
+nr_throttled 0
+throttled_usec 0
+nr_bursts 0
+burst_usec 0
+"""
+
+IO_STAT = """259:0 rbytes=4096 wbytes=8192 rios=1 wios=2 dbytes=0 dios=0
+8:0 rbytes=1024 wbytes=0 rios=3 wios=0 dbytes=0 dios=0
+"""
+
+CPU_PRESSURE = """some avg10=0.00 avg60=0.00 avg300=0.00 total=1500
+full avg10=0.00 avg60=0.00 avg300=0.00 total=250
+"""
+
+MEMORY_PRESSURE_OLD = """some avg10=1.50 avg60=0.25 avg300=0.05 total=900
+"""
+
+
+class ParseTestCase(unittest.TestCase):
+    def test_cpu_stat(self):
+        values = cgroup.parse_flat_keyed(CPU_STAT)
+        self.assertEqual(values["usage_usec"], 2412345)
+        self.assertEqual(values["user_usec"], 2000000)
+        self.assertEqual(values["system_usec"], 412345)
+        self.assertEqual(values["core_sched.force_idle_usec"], 0)
+
+    def test_flat_keyed_skips_malformed_lines(self):
+        self.assertEqual(cgroup.parse_flat_keyed("\nusage_usec 1 2\nx 3\n"),
+                         {"x": 3})
+
+    def test_io_stat_sums_devices(self):
+        totals = cgroup.parse_io_stat(IO_STAT)
+        self.assertEqual(totals["rbytes"], 5120)
+        self.assertEqual(totals["wbytes"], 8192)
+        self.assertEqual(totals["rios"], 4)
+        self.assertEqual(totals["wios"], 2)
+
+    def test_io_stat_without_io(self):
+        self.assertEqual(cgroup.parse_io_stat(""), {})
+
+    def test_pressure(self):
+        self.assertEqual(cgroup.parse_pressure(CPU_PRESSURE),
+                         {"some": 1500.0, "full": 250.0})
+
+    def test_pressure_without_full(self):
+        self.assertEqual(cgroup.parse_pressure(MEMORY_PRESSURE_OLD),
+                         {"some": 900.0})
+
+
+class CollectTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cg_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cg_path)
+
+    def write(self, name, content):
+        with open(os.path.join(self.cg_path, name), 'w') as cg_file:
+            cg_file.write(content)
+
+    def test_all_controllers(self):
+        self.write("cpu.stat", CPU_STAT)
+        self.write("memory.peak", "10485760\n")
+        self.write("io.stat", IO_STAT)
+        self.write("cpu.pressure", CPU_PRESSURE)
+        self.write("memory.pressure", MEMORY_PRESSURE_OLD)
+        self.write("io.pressure", CPU_PRESSURE)
+
+        self.assertEqual(cgroup.collect(self.cg_path), {
+            "cgroup.cpu.usage_usec": 2412345,
+            "cgroup.cpu.user_usec": 2000000,
+            "cgroup.cpu.system_usec": 412345,
+            "cgroup.memory.peak": 10485760,
+            "cgroup.io.rbytes": 5120,
+            "cgroup.io.wbytes": 8192,
+            "cgroup.io.rios": 4,
+            "cgroup.io.wios": 2,
+            "cgroup.cpu.pressure.some": 1500.0,
+            "cgroup.cpu.pressure.full": 250.0,
+            "cgroup.memory.pressure.some": 900.0,
+            "cgroup.io.pressure.some": 1500.0,
+            "cgroup.io.pressure.full": 250.0,
+        })
+
+    def test_without_controllers(self):
+        self.write("cpu.stat", CPU_STAT)
+        self.assertEqual(cgroup.collect(self.cg_path), {
+            "cgroup.cpu.usage_usec": 2412345,
+            "cgroup.cpu.user_usec": 2000000,
+            "cgroup.cpu.system_usec": 412345,
+        })
+
+    def test_idle_io(self):
+        self.write("io.stat", "")
+        metrics = cgroup.collect(self.cg_path)
+        self.assertEqual(metrics["cgroup.io.rbytes"], 0)
+        self.assertEqual(metrics["cgroup.io.wios"], 0)
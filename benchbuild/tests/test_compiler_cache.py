@@ -0,0 +1,124 @@
+"""
+Test the compilation result cache.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from plumbum import local
+
+from benchbuild.utils import compiler_cache as cc_cache
+from benchbuild.utils.compiler_server import invoke
+
+BENCHBUILD_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+FAKE_CC = """#!/bin/sh
+# Log every call, preprocess by concatenating includes, 'compile' by copying.
+echo "$*" >> "{calls}"
+pre=0; dep=""; out=""; src=""
+while [ $# -gt 0 ]; do
+  case "$1" in
+    -E) pre=1;;
+    -MF) dep=$2; shift;;
+    -o) out=$2; shift;;
+    -*) ;;
+    *) src=$1;;
+  esac
+  shift
+done
+headers=$(sed -n 's/^#include "\\(.*\\)"/\\1/p' "$src")
+if [ $pre = 1 ]; then
+  for h in $headers; do cat "$h"; done
+  grep -v '^#include' "$src"
+  [ -n "$dep" ] && echo "x.o: $src $headers" > "$dep"
+  exit 0
+fi
+echo "stats of $src" >&2
+cp "$src" "${{out:-${{src%.c}}.o}}"
+"""
+
+
+class CompilerCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.calls_f = os.path.join(self.tmp_dir, "calls")
+        cc_f = os.path.join(self.tmp_dir, "fake-cc")
+        with open(cc_f, 'w') as fake_cc:
+            fake_cc.write(FAKE_CC.format(calls=self.calls_f))
+        os.chmod(cc_f, 0o755)
+        self.cc = local[cc_f].with_env(LC_ALL="C")
+        self.cache_dir = os.path.join(self.tmp_dir, "cache")
+
+        self.write("a.c", '#include "a.h"\nint a;\n')
+        self.write("b.c", '#include "a.h"\nint b;\n')
+        self.write("a.h", 'int h;\n')
+        self.cwd = local.cwd(self.tmp_dir)
+        self.cwd.__enter__()
+
+    def tearDown(self):
+        self.cwd.__exit__(None, None, None)
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, content):
+        with open(os.path.join(self.tmp_dir, name), 'w') as src:
+            src.write(content)
+
+    def calls(self, flag=""):
+        if not os.path.exists(self.calls_f):
+            return []
+        with open(self.calls_f, 'r') as calls:
+            return [line for line in calls if flag in line.split()]
+
+    def lookup(self, cflags, src):
+        return cc_cache.lookup(self.cache_dir, self.cc, cflags, [],
+                               ["-c", src, "-o", "out.o"])
+
+    def test_key_covers_flags(self):
+        self.assertNotEqual(self.lookup(["-O2"], "a.c").path,
+                            self.lookup(["-O3"], "a.c").path)
+
+    def test_key_covers_source(self):
+        self.assertNotEqual(self.lookup(["-O3"], "a.c").path,
+                            self.lookup(["-O3"], "b.c").path)
+
+    def test_key_covers_headers(self):
+        first = self.lookup(["-O3"], "a.c").path
+        self.write("a.h", 'int changed;\n')
+        self.assertNotEqual(first, self.lookup(["-O3"], "a.c").path)
+
+    def test_direct_lookup_skips_preprocessor(self):
+        first = self.lookup(["-O3"], "a.c").path
+        self.assertEqual(len(self.calls("-E")), 1)
+        self.assertEqual(first, self.lookup(["-O3"], "a.c").path)
+        self.assertEqual(len(self.calls("-E")), 1)
+
+    def test_time_macros_are_not_direct(self):
+        self.write("a.h", 'const char *t = __TIME__;\n')
+        self.lookup(["-O3"], "a.c")
+        self.lookup(["-O3"], "a.c")
+        self.assertEqual(len(self.calls("-E")), 2)
+
+    def test_replay_on_hit(self):
+        outputs = []
+
+        def extension(cmd, has_stdin=False):
+            outputs.append(cmd["-mllvm", "-stats"].run(retcode=None))
+
+        def compile_a():
+            with local.env(PYTHONPATH=BENCHBUILD_ROOT):
+                return invoke(self.cc, ["-O3"], [], extension,
+                              ["-c", "a.c", "-o", "a.o"],
+                              cache_dir=self.cache_dir)
+
+        self.assertEqual(compile_a()[0], 0)
+        compiles = len(self.calls("-c"))
+        os.unlink(os.path.join(self.tmp_dir, "a.o"))
+
+        self.assertEqual(compile_a()[0], 0)
+        self.assertEqual(len(self.calls("-c")), compiles)
+        self.assertEqual(len(self.calls("-E")), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, "a.o")))
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(outputs[1][2], "stats of a.c\n")
@@ -0,0 +1,120 @@
+"""
+Test the compile server and its client.
+"""
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import dill
+from plumbum import local
+
+from benchbuild.settings import CFG
+from benchbuild.utils import compiler_server as cs
+
+BENCHBUILD_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+
+class FramingTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        messages = [{"argv": ["-c", "a.c"]}, {"stdout": "x" * 200000},
+                    {"stderr": "warning: über"}, {"retcode": 1}]
+        left, right = socket.socketpair()
+        try:
+            for message in messages:
+                cs.send(left, message)
+            left.close()
+            received = [cs.receive(right) for _ in messages]
+            self.assertEqual(received, messages)
+            self.assertIsNone(cs.receive(right))
+        finally:
+            right.close()
+
+    def test_truncated_message(self):
+        left, right = socket.socketpair()
+        try:
+            left.sendall(b"\x00\x00\x00\x10{}")
+            left.close()
+            self.assertIsNone(cs.receive(right))
+        finally:
+            right.close()
+
+
+class CompileServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="bb-")
+        self.old_tmp_dir = CFG["tmp_dir"].value()
+        CFG["tmp_dir"] = self.tmp_dir
+        self.sock_dir = cs.server_dir()
+
+        self.cc_f = os.path.join(self.tmp_dir, "cc.benchbuild.cc")
+        with open(self.cc_f, 'wb') as cc_f:
+            cc_f.write(dill.dumps(local["echo"].with_env(LC_ALL="C")))
+
+        self.fallback = os.path.join(self.tmp_dir, "fallback")
+        with open(self.fallback, 'w') as fallback:
+            fallback.write("#!/bin/sh\necho fallback \"$@\"\n")
+        os.chmod(self.fallback, 0o755)
+
+    def tearDown(self):
+        CFG["tmp_dir"] = self.old_tmp_dir
+        shutil.rmtree(self.tmp_dir)
+
+    def client(self, sock_path):
+        config = {
+            "cc_f": self.cc_f,
+            "blob_f": os.path.join(self.tmp_dir, "missing.postproc"),
+            "cflags": ["-O3"],
+            "ldflags": [],
+            "cache_dir": None,
+            "config_file": None,
+            "db": {},
+            "spool": {},
+            "socket": sock_path
+        }
+        config_f = os.path.join(self.tmp_dir, "cc.benchbuild.json")
+        with open(config_f, 'w') as config_file:
+            json.dump(config, config_file)
+        client_f = os.path.join(self.tmp_dir, "cc")
+        cs.print_client(client_f, config_f, sock_path, self.fallback)
+        return client_f
+
+    def call(self, client_f, *args):
+        env = dict(os.environ,
+                   PYTHONPATH=BENCHBUILD_ROOT,
+                   BB_JOBS="2",
+                   BB_COMPILER_SERVER_IDLE="1")
+        return subprocess.check_output([client_f] + list(args), env=env,
+                                       cwd=self.tmp_dir).decode("utf-8")
+
+    def test_server_dir_is_private(self):
+        self.assertIsNotNone(self.sock_dir)
+        self.assertTrue(cs.is_private(self.sock_dir))
+        os.chmod(self.sock_dir, 0o755)
+        self.assertIsNone(cs.server_dir())
+
+    def test_compile_through_server(self):
+        client_f = self.client(os.path.join(self.sock_dir, "test.sock"))
+        self.assertEqual(self.call(client_f, "a.c"),
+                         "-Qunused-arguments -O3 a.c\n")
+        # The second call is served by the running server.
+        self.assertEqual(self.call(client_f, "-c", "b.c"),
+                         "-Qunused-arguments -O3 -c b.c\n")
+
+    def test_fallback_on_stdin(self):
+        client_f = self.client(os.path.join(self.sock_dir, "test.sock"))
+        self.assertEqual(self.call(client_f, "-x", "c", "-"),
+                         "fallback -x c -\n")
+
+    def test_fallback_on_shared_dir(self):
+        shared = os.path.join(self.tmp_dir, "shared")
+        os.mkdir(shared, 0o777)
+        os.chmod(shared, 0o777)
+        client_f = self.client(os.path.join(shared, "test.sock"))
+        self.assertEqual(self.call(client_f, "a.c"), "fallback a.c\n")
+        self.assertFalse(os.path.exists(os.path.join(shared, "test.sock")))
@@ -0,0 +1,262 @@
+"""
+Test prefetching downloads, fetching single git commits, verifying cache
+entries and mirror copies, and materializing them from the content-addressed
+store.
+"""
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from benchbuild.run import BenchBuildRun
+from benchbuild.settings import CFG
+from benchbuild.utils import downloader
+
+
+class MaterializeLinkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.old_tmp_dir = CFG["tmp_dir"].value()
+        self.old_materialize = CFG["download"]["materialize"].value()
+        CFG["tmp_dir"] = self.tmp_dir
+        CFG["download"]["materialize"] = "link"
+
+        self.src_dir = os.path.join(self.tmp_dir, "test-src")
+        os.makedirs(self.src_dir)
+        with open(os.path.join(self.src_dir, "main.c"), 'w') as src_f:
+            src_f.write("int main() { return 0; }\n")
+        downloader.update_hash("test-src", self.tmp_dir)
+
+    def tearDown(self):
+        CFG["tmp_dir"] = self.old_tmp_dir
+        CFG["download"]["materialize"] = self.old_materialize
+        for dirpath, dirs, files in os.walk(self.tmp_dir):
+            for name in dirs + files:
+                os.chmod(os.path.join(dirpath, name), 0o700)
+        shutil.rmtree(self.tmp_dir)
+
+    def materialize(self, name):
+        to = os.path.join(self.tmp_dir, name)
+        os.makedirs(to)
+        downloader.materialize("test-src", self.tmp_dir, to)
+        return os.path.join(to, "test-src", "main.c")
+
+    def test_cache_entry_stays_writable(self):
+        linked = self.materialize("a")
+        cached = os.path.join(self.src_dir, "main.c")
+
+        self.assertFalse(os.stat(linked).st_mode & stat.S_IWUSR)
+        self.assertTrue(os.stat(cached).st_mode & stat.S_IWUSR)
+        self.assertNotEqual(os.stat(linked).st_ino, os.stat(cached).st_ino)
+
+    def test_in_place_write_is_repaired(self):
+        linked = self.materialize("a")
+        os.chmod(linked, 0o644)
+        with open(linked, 'w') as linked_f:
+            linked_f.write("patched\n")
+
+        fresh = self.materialize("b")
+        with open(fresh, 'r') as fresh_f:
+            self.assertEqual(fresh_f.read(), "int main() { return 0; }\n")
+        self.assertFalse(os.stat(fresh).st_mode & stat.S_IWUSR)
+        self.assertFalse(downloader.source_required("test-src",
+                                                     self.tmp_dir))
+
+
+class SourceRequiredTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.tmp_dir, "test-src")
+        os.makedirs(self.src_dir)
+        self.main_c = os.path.join(self.src_dir, "main.c")
+        with open(self.main_c, 'w') as src_f:
+            src_f.write("int main() { return 0; }\n")
+
+    def tearDown(self):
+        CFG["download"]["verify"] = False
+        shutil.rmtree(self.tmp_dir)
+
+    def tamper(self):
+        """Change main.c, but keep its size, mtime and inode."""
+        old = os.stat(self.main_c)
+        with open(self.main_c, 'r+') as src_f:
+            src_f.write("INT")
+        os.utime(self.main_c, ns=(old.st_atime_ns, old.st_mtime_ns))
+
+    def source_required(self):
+        with mock.patch.object(downloader, "hash_file",
+                               wraps=downloader.hash_file) as hash_file:
+            required = downloader.source_required("test-src", self.tmp_dir)
+        return required, hash_file.call_count
+
+    def test_unchanged_entry_is_not_hashed(self):
+        downloader.update_hash("test-src", self.tmp_dir)
+        self.assertEqual(self.source_required(), (False, 0))
+
+    def test_changed_metadata_is_hashed(self):
+        downloader.update_hash("test-src", self.tmp_dir)
+        os.utime(self.main_c, ns=(0, 0))
+        self.assertEqual(self.source_required(), (False, 1))
+        # The manifest knows the new mtime now.
+        self.assertEqual(self.source_required(), (False, 0))
+
+    def test_stat_only_misses_tampering(self):
+        downloader.update_hash("test-src", self.tmp_dir)
+        self.tamper()
+        self.assertEqual(self.source_required(), (False, 0))
+
+    def test_verify_cache_rehashes(self):
+        downloader.update_hash("test-src", self.tmp_dir)
+        self.tamper()
+        BenchBuildRun("run").verify_cache()
+        self.assertEqual(self.source_required(), (True, 1))
+        self.assertFalse(os.path.exists(self.src_dir))
+        self.assertFalse(os.path.exists(self.src_dir + ".hash"))
+        self.assertFalse(
+            os.path.exists(self.src_dir + downloader.MANIFEST_EXT))
+
+    def test_upgrade_legacy_hash(self):
+        with open(self.src_dir + ".hash", 'w') as h_file:
+            h_file.write(downloader.get_hash_of_dirs(self.src_dir))
+
+        self.assertFalse(downloader.source_required("test-src",
+                                                    self.tmp_dir))
+        manifest = downloader.load_manifest("test-src", self.tmp_dir)
+        self.assertEqual(list(manifest), ["main.c"])
+        with open(self.src_dir + ".hash", 'r') as h_file:
+            self.assertEqual(h_file.read(),
+                             downloader.manifest_digest(manifest))
+        self.assertEqual(self.source_required(), (False, 0))
+
+    def test_legacy_hash_mismatch(self):
+        with open(self.src_dir + ".hash", 'w') as h_file:
+            h_file.write("0" * 128)
+        self.assertTrue(downloader.source_required("test-src",
+                                                   self.tmp_dir))
+        self.assertFalse(os.path.exists(self.src_dir))
+
+
+class PrefetchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.fetched = []
+
+    def fetch(self, url, name, fetch_only=False):
+        self.assertTrue(fetch_only)
+        self.fetched.append((url, name))
+        if url.startswith("broken://"):
+            raise OSError("cannot fetch " + url)
+
+    def project(self, *sources):
+        return SimpleNamespace(
+            sources=lambda: [(self.fetch, url, name) for url, name in sources])
+
+    def test_shared_downloads_are_fetched_once(self):
+        projects = [self.project(("http://a", "a.tar"), ("http://b", "b")),
+                    self.project(("http://a", "a.tar"))]
+        self.assertEqual(downloader.prefetch(projects, jobs=2), 0)
+        self.assertEqual(sorted(self.fetched),
+                         [("http://a", "a.tar"), ("http://b", "b")])
+
+    def test_count_failures(self):
+        projects = [self.project(("broken://a", "a"), ("http://b", "b")),
+                    self.project(("broken://c", "c"), ("broken://a", "a"))]
+        self.assertEqual(downloader.prefetch(projects, jobs=3), 2)
+        self.assertEqual(len(self.fetched), 3)
+
+    def test_nothing_to_fetch(self):
+        self.assertEqual(downloader.prefetch([self.project()], jobs=1), 0)
+        self.assertEqual(self.fetched, [])
+
+
+class FetchMirrorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.mirror = os.path.join(self.tmp_dir, "mirror")
+        self.root = os.path.join(self.tmp_dir, "cache")
+        os.makedirs(os.path.join(self.mirror, "test-src"))
+        os.makedirs(self.root)
+        self.main_c = os.path.join(self.mirror, "test-src", "main.c")
+        with open(self.main_c, 'w') as src_f:
+            src_f.write("int main() { return 0; }\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_intact_copy(self):
+        downloader.update_hash("test-src", self.mirror)
+        self.assertTrue(downloader.fetch_mirror("test-src", self.root,
+                                                self.mirror))
+        self.assertEqual(os.listdir(self.root), ["test-src"])
+        downloader.update_hash("test-src", self.root)
+        with open(os.path.join(self.root, "test-src.hash")) as copied, \
+                open(os.path.join(self.mirror, "test-src.hash")) as mirrored:
+            self.assertEqual(copied.read(), mirrored.read())
+
+    def test_legacy_hash(self):
+        with open(os.path.join(self.mirror, "test-src.hash"), 'w') as h_f:
+            h_f.write(downloader.get_hash_of_dirs(
+                os.path.join(self.mirror, "test-src")))
+        self.assertTrue(downloader.fetch_mirror("test-src", self.root,
+                                                self.mirror))
+
+    def test_reject_modified_entry(self):
+        downloader.update_hash("test-src", self.mirror)
+        with open(self.main_c, 'a') as src_f:
+            src_f.write("/* changed */\n")
+        self.assertFalse(downloader.fetch_mirror("test-src", self.root,
+                                                 self.mirror))
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_entry_without_hash(self):
+        self.assertFalse(downloader.fetch_mirror("test-src", self.root,
+                                                 self.mirror))
+        self.assertEqual(os.listdir(self.root), [])
+
+
+class GitFetchCommitTestCase(unittest.TestCase):
+    def setUp(self):
+        from plumbum.cmd import git
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.upstream = os.path.join(self.tmp_dir, "upstream")
+        self.clone = os.path.join(self.tmp_dir, "clone")
+        self.git = git["-c", "user.name=test", "-c", "user.email=test@test"]
+        self.git("init", "-q", self.upstream)
+        self.commits = []
+        for i in range(3):
+            with open(os.path.join(self.upstream, "file"), 'w') as out_f:
+                out_f.write(str(i))
+            self.git("-C", self.upstream, "add", "file")
+            self.git("-C", self.upstream, "commit", "-q", "-m", str(i))
+            self.commits.append(
+                self.git("-C", self.upstream, "rev-parse", "HEAD").strip())
+        self.git("clone", "-q", "--depth", "1", "file://" + self.upstream,
+                 self.clone)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def fetch_commit(self, commit):
+        from plumbum import local
+
+        with local.cwd(self.clone):
+            downloader.git_fetch_commit(commit)
+        return self.git("-C", self.clone, "rev-parse", "HEAD").strip()
+
+    def shallow(self):
+        return os.path.exists(os.path.join(self.clone, ".git", "shallow"))
+
+    def test_fetch_single_commit(self):
+        self.assertEqual(self.fetch_commit(self.commits[0]), self.commits[0])
+        self.assertTrue(self.shallow())
+
+    def test_unshallow_fallback(self):
+        # Protocol v0 servers refuse to send commits they do not advertise.
+        self.git("-C", self.clone, "config", "protocol.version", "0")
+        self.git("-C", self.upstream, "config",
+                 "uploadpack.allowReachableSHA1InWant", "false")
+        self.assertEqual(self.fetch_commit(self.commits[0]), self.commits[0])
+        self.assertFalse(self.shallow())
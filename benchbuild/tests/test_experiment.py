@@ -0,0 +1,89 @@
+"""
+Test expanding the run step of a project along a variant axis.
+"""
+import os
+import tempfile
+import unittest
+
+import pytest
+
+from benchbuild.experiment import RuntimeExperiment
+from benchbuild.project import Project
+from benchbuild.settings import CFG
+from benchbuild.utils import actions as a
+from benchbuild.utils import schema
+from benchbuild.utils.db import persist_experiment
+
+
+class VariantProject(Project):
+    NAME = "test_variants"
+    DOMAIN = "debug"
+    GROUP = "debug"
+    src_uri = "none"
+
+    builds = 0
+    runs = []
+
+    def build(self):
+        VariantProject.builds += 1
+        with open(os.path.join(self.builddir, "data.in"), 'w') as data_f:
+            data_f.write("input\n")
+
+    def run_tests(self, experiment):
+        # :experiment: is the runtime extension, the value of the variant.
+        seen = sorted(os.listdir(self.builddir))
+        VariantProject.runs.append((experiment, seen))
+        # Like wrap(), every run leaves a wrapped binary behind.
+        for name in ["prog", "prog.bin", "prog.spec.json"]:
+            with open(os.path.join(self.builddir, name), 'w') as prog_f:
+                prog_f.write(name)
+        with open(os.path.join(self.builddir, "out.txt"), 'w') as out_f:
+            out_f.write(str(experiment))
+        os.makedirs(os.path.join(self.builddir, "results"))
+
+
+class VariantExperiment(RuntimeExperiment):
+    NAME = "test_variants"
+
+    def actions_for_project(self, project):
+        actns = [a.MakeBuildDir(project), a.Build(project)]
+        actns.extend(self.run_variants(project, lambda prj, value: value,
+                                       axis=[1, 2, 4]))
+        actns.append(a.Clean(project))
+        return actns
+
+
+@pytest.mark.usefixtures("sqlite_db")
+class RunVariantsTestCase(unittest.TestCase):
+    def test_build_once_run_per_value(self):
+        VariantProject.builds = 0
+        VariantProject.runs = []
+        with tempfile.TemporaryDirectory() as builddir:
+            old_builddir = CFG["build_dir"].value()
+            CFG["build_dir"] = builddir
+            try:
+                exp = VariantExperiment(projects=["test_variants"])
+                persist_experiment(exp)
+                a.MakeBuildDir(exp)()
+                prj = exp.projects["test_variants"]
+                actns = exp.actions_for_project(prj)
+
+                self.assertEqual(
+                    len([x for x in actns if isinstance(x, a.Build)]), 1)
+                self.assertEqual(a.RequireAll(actns)(), a.StepResult.OK)
+            finally:
+                CFG["build_dir"] = old_builddir
+
+        self.assertEqual(VariantProject.builds, 1)
+        # Every variant sees the build and the wrapped binary, but none of
+        # the earlier outputs.
+        wrapped = ["data.in", "prog", "prog.bin", "prog.spec.json"]
+        self.assertEqual(VariantProject.runs,
+                         [(1, ["data.in"]), (2, wrapped), (4, wrapped)])
+
+        session = schema.Session()
+        groups = session.query(schema.RunGroup).filter(
+            schema.RunGroup.project == "test_variants").all()
+        self.assertEqual(len(groups), 3)
+        self.assertEqual(len({group.id for group in groups}), 3)
+        self.assertTrue(all(group.status == "completed" for group in groups))
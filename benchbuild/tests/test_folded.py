@@ -0,0 +1,101 @@
+"""
+Test sampling call stacks with perf and loading them from the database.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from plumbum import local
+
+from benchbuild.settings import CFG
+from benchbuild.utils import db, folded, schema
+
+# Stands in for perf record -q -F FREQ -g -o FILE CMD... and
+# perf script -i FILE. The "recording" already is the output of perf script.
+PERF = """#!/bin/sh
+if [ "$1" = "script" ]; then
+    exec cat "$3"
+fi
+out=$7
+shift 7
+cat > "$out" <<EOF
+prog 4711 12345.678: 250000 cycles:
+	    7f00 leaf+0x1a (/usr/lib/libc.so.6)
+	    4000 main+0x10 (/tmp/prog)
+
+prog 4711 12345.679: 250000 cycles:
+	    4000 main+0x10 (/tmp/prog)
+
+prog 4711 12345.680: 250000 cycles:
+	    7f00 leaf+0x1a (/usr/lib/libc.so.6)
+	    4000 main+0x10 (/tmp/prog)
+
+EOF
+exec "$@"
+"""
+
+
+@pytest.mark.usefixtures("sqlite_db")
+class PerfProfileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.bin_dir = os.path.join(self.tmp_dir, "bin")
+        self.write("bin/perf", PERF)
+        # The polyjit module needs time, at import.
+        self.write("bin/time", "#!/bin/sh\nexec \"$@\"\n")
+        self.write("prog", "#!/bin/sh\nexit 0\n")
+
+        self.project = SimpleNamespace(name="test_folded", domain="debug",
+                                       group_name=None, src_uri="none",
+                                       run_uuid=uuid.uuid4())
+        self.experiment = SimpleNamespace(name="pj-perf")
+        db.persist_experiment(self.experiment)
+        db.persist_project(self.project)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, relpath, content):
+        path = os.path.join(self.tmp_dir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as out_f:
+            out_f.write(content)
+        os.chmod(path, 0o755)
+
+    def run_prog(self, jobs):
+        with local.env(PATH=self.bin_dir + os.pathsep + local.env["PATH"]):
+            from benchbuild.experiments.polyjit import run_with_perf
+            run_with_perf(self.project, self.experiment, CFG, jobs,
+                          os.path.join(self.tmp_dir, "prog"), [])
+        db.flush()
+
+    def test_round_trip(self):
+        self.run_prog(1)
+        self.run_prog(2)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ["bin", "prog"])
+
+        session = schema.Session()
+        try:
+            all_runs = folded.select_runs(session, "pj-perf", "test_folded")
+            one_core = folded.select_runs(session, "pj-perf", "test_folded",
+                                          cores="1")
+            other = folded.select_runs(session, "raw", "test_folded")
+            self.assertEqual(len(all_runs), 2)
+            self.assertEqual(len(one_core), 1)
+            self.assertEqual(other, [])
+
+            profile = folded.load(session, one_core)
+            self.assertEqual(profile.counts(), {
+                "prog;main;leaf": 2,
+                "prog;main": 1
+            })
+            merged = folded.load(session, all_runs)
+            self.assertEqual(merged.samples, 6)
+            self.assertEqual(list(merged.lines()),
+                             ["prog;main 2\n", "prog;main;leaf 4\n"])
+        finally:
+            session.close()
@@ -0,0 +1,154 @@
+"""
+Test the interned metrics, compilestats and config tables on SQLite.
+"""
+import unittest
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+
+from benchbuild.utils import db, interning, schema
+
+LEGACY_TABLES = [
+    "CREATE TABLE metrics (name VARCHAR NOT NULL, value FLOAT, "
+    "run_id INTEGER NOT NULL, PRIMARY KEY (name, run_id))",
+    "CREATE TABLE compilestats (id INTEGER PRIMARY KEY, name VARCHAR, "
+    "component VARCHAR, value NUMERIC, run_id INTEGER)",
+    "CREATE TABLE config (run_id INTEGER NOT NULL, name VARCHAR NOT NULL, "
+    "value VARCHAR, PRIMARY KEY (run_id, name))",
+]
+
+
+def create_run():
+    """Create a run we can attach rows to."""
+    prj = SimpleNamespace(name="test_interning", domain="debug",
+                          group_name=None, src_uri="none",
+                          run_uuid=uuid.uuid4())
+    db.persist_experiment(SimpleNamespace(name="test-interning"))
+    db.persist_project(prj)
+    run, session = db.create_run("cmd", prj.name, "test-interning",
+                                 prj.run_uuid)
+    session.commit()
+    return run.id
+
+
+class InterningTestCase(unittest.TestCase):
+    def setUp(self):
+        self.session = schema.Session()
+
+    def tearDown(self):
+        self.session.close()
+
+    def insert(self, table_name, rows):
+        interning.insert(self.session, table_name, rows)
+        self.session.commit()
+
+    def query(self, *columns):
+        return sorted(self.session.query(*columns).all())
+
+
+@pytest.mark.usefixtures("sqlite_db")
+class InsertTestCase(InterningTestCase):
+    def test_intern(self):
+        dimension = schema.MetricName.__table__
+        ids = interning.intern(self.session, dimension, ("name", ),
+                               {("a", ), ("b", )})
+        self.assertNotEqual(ids[("a", )], ids[("b", )])
+
+        again = interning.intern(self.session, dimension, ("name", ),
+                                 {("a", ), ("c", )})
+        self.assertEqual(again[("a", )], ids[("a", )])
+        self.assertEqual(
+            len(self.session.execute(dimension.select()).fetchall()), 3)
+
+    def test_views(self):
+        run_id = create_run()
+        self.insert("metrics", [
+            {"name": "time.real_s", "value": 1.5, "run_id": run_id}])
+        self.insert("compilestats", [
+            {"component": "licm", "name": "hoisted", "value": 3,
+             "run_id": run_id}])
+        self.insert("config", [
+            {"name": "cores", "value": "2", "run_id": run_id}])
+
+        self.assertEqual(
+            self.query(schema.Metric.name, schema.Metric.value,
+                       schema.Metric.run_id), [("time.real_s", 1.5, run_id)])
+        self.assertEqual(
+            self.query(schema.CompileStat.component, schema.CompileStat.name,
+                       schema.CompileStat.value),
+            [("licm", "hoisted", 3)])
+        self.assertEqual(
+            self.query(schema.Config.name, schema.Config.value),
+            [("cores", "2")])
+
+    def test_repeated_key_updates_value(self):
+        run_id = create_run()
+        self.insert("metrics", [
+            {"name": "m", "value": 1.0, "run_id": run_id},
+            {"name": "m", "value": 2.0, "run_id": run_id}])
+        # A later flush with the same (run_id, name).
+        self.insert("metrics", [{"name": "m", "value": 3.0,
+                                 "run_id": run_id}])
+
+        self.assertEqual(self.query(schema.Metric.name, schema.Metric.value),
+                         [("m", 3.0)])
+
+
+@pytest.mark.usefixtures("sqlite_db")
+class LegacyTestCase(InterningTestCase):
+    def setUp(self):
+        engine = create_engine(schema.connect_string())
+        for statement in LEGACY_TABLES:
+            engine.execute(statement)
+        engine.dispose()
+        super(LegacyTestCase, self).setUp()
+
+    def test_writes_to_legacy_tables(self):
+        run_id = create_run()
+        self.insert("metrics", [{"name": "m", "value": 1.0,
+                                 "run_id": run_id}])
+        self.insert("metrics", [{"name": "m", "value": 2.0,
+                                 "run_id": run_id}])
+        self.insert("config", [{"name": "cores", "value": "2",
+                                "run_id": run_id}])
+
+        self.assertEqual(self.query(schema.Metric.name, schema.Metric.value),
+                         [("m", 2.0)])
+        self.assertEqual(self.query(schema.Config.name, schema.Config.value),
+                         [("cores", "2")])
+        self.assertEqual(
+            self.session.execute(
+                schema.MetricValue.__table__.select()).fetchall(), [])
+
+    def test_migrate(self):
+        run_id = create_run()
+        self.insert("metrics", [{"name": "m", "value": 1.0,
+                                 "run_id": run_id}])
+        self.insert("compilestats", [
+            {"component": "licm", "name": "hoisted", "value": 3,
+             "run_id": run_id}])
+        self.insert("config", [{"name": "cores", "value": "2",
+                                "run_id": run_id}])
+
+        migrated = interning.migrate(self.session.connection())
+        self.session.commit()
+        self.assertEqual(migrated,
+                         {"metrics": 1, "compilestats": 1, "config": 1})
+
+        # New rows go to the interned tables and show up in the views.
+        self.insert("metrics", [{"name": "n", "value": 2.0,
+                                 "run_id": run_id}])
+        self.assertEqual(self.query(schema.Metric.name, schema.Metric.value),
+                         [("m", 1.0), ("n", 2.0)])
+        self.assertEqual(
+            self.query(schema.CompileStat.component, schema.CompileStat.name,
+                       schema.CompileStat.value),
+            [("licm", "hoisted", 3)])
+        self.assertEqual(self.query(schema.Config.name, schema.Config.value),
+                         [("cores", "2")])
+        self.assertEqual(
+            self.session.execute(
+                "SELECT name, value FROM metrics_legacy").fetchall(),
+            [("m", 1.0)])
@@ -0,0 +1,87 @@
+"""
+Test measuring hardware counters with perf stat.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from plumbum import local, ProcessExecutionError
+
+from benchbuild.experiments.perf_stat import run_with_perf_stat
+from benchbuild.settings import CFG
+from benchbuild.utils import db, schema
+
+# Stands in for perf stat -x, -o FILE -e EVENTS -- CMD...
+PERF = """#!/bin/sh
+out=$4
+shift 7
+printf '# started on Mon Jan  1 00:00:00 2018\\n\\n' > "$out"
+printf '2000,,cycles,1000,100.00,,\\n' >> "$out"
+printf '500,,instructions,500,50.00,0.25,insn per cycle\\n' >> "$out"
+printf '<not counted>,,cache-misses,0,0.00,,\\n' >> "$out"
+exec "$@"
+"""
+
+
+@pytest.mark.usefixtures("sqlite_db")
+class PerfStatTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.write("bin/perf", PERF)
+        self.write("prog", "#!/bin/sh\nexit $1\n")
+
+        self.project = SimpleNamespace(name="test_perf", domain="debug",
+                                       group_name=None, src_uri="none",
+                                       run_uuid=uuid.uuid4())
+        self.experiment = SimpleNamespace(name="perf-stat")
+        db.persist_experiment(self.experiment)
+        db.persist_project(self.project)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, relpath, content):
+        path = os.path.join(self.tmp_dir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as out_f:
+            out_f.write(content)
+        os.chmod(path, 0o755)
+
+    def run_prog(self, retcode):
+        path = os.path.join(self.tmp_dir, "bin") + os.pathsep + \
+            local.env["PATH"]
+        with local.env(PATH=path):
+            run_with_perf_stat(self.project, self.experiment, CFG, 1,
+                               os.path.join(self.tmp_dir, "prog"),
+                               [str(retcode)])
+        db.flush()
+
+    def query(self, *columns):
+        session = schema.Session()
+        try:
+            return sorted(session.query(*columns).all())
+        finally:
+            session.close()
+
+    def test_persist_counts(self):
+        self.run_prog(0)
+        self.assertEqual(
+            self.query(schema.Metric.name, schema.Metric.value),
+            [("perf.cycles", 2000.0), ("perf.cycles.ratio", 1.0),
+             ("perf.instructions", 500.0),
+             ("perf.instructions.ratio", 0.5)])
+        self.assertIn(("cores", "1"),
+                      self.query(schema.Config.name, schema.Config.value))
+        self.assertEqual(self.query(schema.Run.status), [("completed", )])
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ["bin", "prog"])
+
+    def test_failed_run(self):
+        with self.assertRaises(ProcessExecutionError):
+            self.run_prog(1)
+        self.assertEqual(self.query(schema.Metric.name), [])
+        self.assertEqual(self.query(schema.Config.name), [])
+        self.assertEqual(self.query(schema.Run.status), [("failed", )])
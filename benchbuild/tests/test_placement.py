@@ -0,0 +1,142 @@
+"""
+Test locking CPUs for measured runs.
+"""
+import fcntl
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from benchbuild.settings import CFG
+from benchbuild.utils import placement
+from benchbuild.utils.actions import Build
+from benchbuild.utils.placement import Cpu
+
+TOPOLOGY = [Cpu(0, 0, 0), Cpu(1, 1, 0), Cpu(2, 0, 0), Cpu(3, 1, 0),
+            Cpu(4, 4, 1), Cpu(5, 5, 1), Cpu(6, 4, 1), Cpu(7, 5, 1)]
+
+
+class PlaceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.old_tmp_dir = CFG["tmp_dir"].value()
+        CFG["tmp_dir"] = self.tmp_dir
+        CFG["placement"]["enable"] = True
+        self.lock_dir = os.path.join(self.tmp_dir, "placement")
+        os.makedirs(self.lock_dir)
+        self.held = []
+
+        patches = [
+            mock.patch.object(placement, "topology",
+                              return_value=TOPOLOGY),
+            mock.patch.object(placement.os, "sched_getaffinity",
+                              return_value={0}),
+            mock.patch.object(placement.os, "sched_setaffinity")
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        for lock_f in self.held:
+            lock_f.close()
+        CFG["placement"]["enable"] = False
+        CFG["tmp_dir"] = self.old_tmp_dir
+        shutil.rmtree(self.tmp_dir)
+
+    def lock(self, cpu):
+        """Lock :cpu: from another open file, like a second process."""
+        lock_f = open(os.path.join(self.lock_dir,
+                                   "cpu{0}.lock".format(cpu)), 'a')
+        try:
+            fcntl.flock(lock_f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_f.close()
+            return False
+        self.held.append(lock_f)
+        return True
+
+    def test_locks_only_chosen_cpus(self):
+        with placement.place(2) as placed:
+            self.assertEqual(placed.cpus, [0, 1])
+            self.assertEqual(placed.nodes, [0])
+            free = [cpu.id for cpu in TOPOLOGY if self.lock(cpu.id)]
+        # The chosen CPUs and their SMT siblings stay locked.
+        self.assertEqual(free, [4, 5, 6, 7])
+
+    def test_avoids_busy_cpus(self):
+        self.lock(0)
+        with placement.place(2) as placed:
+            self.assertEqual(placed.cpus, [4, 5])
+
+    def test_concurrent_placements_are_disjoint(self):
+        with placement.place(2) as first:
+            with placement.place(2) as second:
+                self.assertEqual(first.cpus, [0, 1])
+                self.assertEqual(second.cpus, [4, 5])
+
+    def test_retries_on_conflict(self):
+        choose = placement.choose
+        calls = []
+
+        def choose_and_race(*args):
+            calls.append(args[2])
+            chosen = choose(*args)
+            if len(calls) == 1:
+                # Another measurement locks CPU 0 after we found it free.
+                self.lock(0)
+            return chosen
+
+        with mock.patch.object(placement, "choose",
+                               side_effect=choose_and_race):
+            with placement.place(2) as placed:
+                self.assertEqual(placed.cpus, [4, 5])
+        self.assertEqual(calls, [set(), {0}])
+        # Nothing we tried to lock first stayed locked.
+        self.assertTrue(self.lock(1))
+
+    def test_timeout(self):
+        for cpu in [0, 1, 4, 5]:
+            self.lock(cpu)
+        CFG["placement"]["timeout"] = 0.01
+        try:
+            with mock.patch("time.sleep"):
+                with self.assertLogs(placement.LOG, "WARNING") as logs:
+                    with self.assertRaises(RuntimeError) as ctx:
+                        with placement.place(1):
+                            pass
+        finally:
+            CFG["placement"]["timeout"] = 3600
+        self.assertIn("Waiting for 1 free CPUs", logs.output[0])
+        self.assertIn("CPUs 0-1,4-5 are busy", str(ctx.exception))
+
+    def test_reserve(self):
+        CFG["placement"]["reserve"] = "4-7"
+        try:
+            with placement.place(2) as placed:
+                self.assertEqual(placed.cpus, [4, 5])
+
+            placement.os.sched_getaffinity.return_value = set(range(8))
+            with placement.unreserved():
+                placement.os.sched_setaffinity.assert_called_with(
+                    0, {0, 1, 2, 3})
+            placement.os.sched_setaffinity.assert_called_with(
+                0, set(range(8)))
+        finally:
+            CFG["placement"]["reserve"] = ""
+
+    def test_build_off_reserve(self):
+        affinity = []
+        project = mock.Mock()
+        project.name = "test"
+        project.build = lambda: affinity.append(
+            placement.os.sched_setaffinity.call_args)
+
+        placement.os.sched_getaffinity.return_value = set(range(8))
+        CFG["placement"]["reserve"] = "0-3"
+        try:
+            Build(project)()
+        finally:
+            CFG["placement"]["reserve"] = ""
+        self.assertEqual(affinity, [mock.call(0, {4, 5, 6, 7})])
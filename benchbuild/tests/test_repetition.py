@@ -0,0 +1,96 @@
+"""
+Test repeated run-time measurements and their persistence.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from plumbum import local
+
+from benchbuild.settings import CFG
+from benchbuild.utils import db, repetition, schema
+
+TIMING_TAG = "BB-TIME: "
+
+
+@pytest.mark.usefixtures("sqlite_db")
+class RunTimedTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.old_repeat = {
+            key: CFG["repeat"][key].value()
+            for key in ["min_reps", "max_reps", "warmup"]
+        }
+        CFG["repeat"]["min_reps"] = 3
+        CFG["repeat"]["max_reps"] = 3
+        CFG["repeat"]["warmup"] = 2
+
+        self.calls_f = os.path.join(self.tmp_dir, "calls")
+        # Stands in for time, the timing line goes to stderr.
+        self.cmd = local["sh"]["-c", 'echo x >> "$0"; echo "{0}1-0.5-2" >&2'
+                               .format(TIMING_TAG), self.calls_f]
+
+        self.project = SimpleNamespace(name="test_repeat", domain="debug",
+                                       group_name=None, src_uri="none",
+                                       run_uuid=uuid.uuid4())
+        self.experiment = SimpleNamespace(name="test-repeat")
+        db.persist_experiment(self.experiment)
+        db.persist_project(self.project)
+
+    def tearDown(self):
+        for key, value in self.old_repeat.items():
+            CFG["repeat"][key] = value
+        shutil.rmtree(self.tmp_dir)
+
+    def calls(self):
+        with open(self.calls_f) as calls_f:
+            return len(calls_f.readlines())
+
+    def test_persist_samples(self):
+        samples = repetition.run_timed(self.cmd, TIMING_TAG, self.project,
+                                       self.experiment, 4, {})
+        db.flush()
+        self.assertEqual([tuple(t) for _, t in samples],
+                         [(1.0, 0.5, 2.0)] * 3)
+        self.assertEqual(self.calls(), 5)
+
+        session = schema.Session()
+        try:
+            run_ids = [r.id for r in session.query(schema.Run.id).order_by(
+                schema.Run.id)]
+            configs = dict(
+                session.query(schema.Config.run_id, schema.Config.value)
+                .filter(schema.Config.name == "repeat.sample"))
+            summary = session.query(schema.Metric.run_id,
+                                    schema.Metric.value).filter(
+                                        schema.Metric.name ==
+                                        "time.repetitions").all()
+            real = session.query(schema.Metric.value).filter(
+                schema.Metric.name == "time.real_s").count()
+        finally:
+            session.close()
+
+        # Warm-up runs are executed, but not stored.
+        self.assertEqual(run_ids, [ri.db_run.id for ri, _ in samples])
+        self.assertEqual([configs[run_id] for run_id in run_ids],
+                         ["0", "1", "2"])
+        self.assertEqual(real, 3)
+        self.assertEqual(summary, [(run_ids[-1], 3.0)])
+
+    def test_missing_timings(self):
+        cmd = local["sh"]["-c", 'echo x >> "$0"', self.calls_f]
+        self.assertEqual(
+            repetition.run_timed(cmd, TIMING_TAG, self.project,
+                                 self.experiment, 1, {}), [])
+        db.flush()
+        self.assertEqual(self.calls(), 3)
+
+        session = schema.Session()
+        try:
+            self.assertEqual(session.query(schema.Metric).count(), 0)
+        finally:
+            session.close()
@@ -0,0 +1,65 @@
+"""
+Test describing runtime extensions by run specs.
+"""
+import os
+import tempfile
+import unittest
+
+import pytest
+
+from benchbuild.experiment import Experiment
+from benchbuild.project import Project
+from benchbuild.settings import CFG
+from benchbuild.utils import run_spec
+from benchbuild.utils.run import partial
+
+
+class SpecProject(Project):
+    NAME = "test_run_spec"
+    DOMAIN = "debug"
+    GROUP = "debug"
+    src_uri = "none"
+
+
+class SpecExperiment(Experiment):
+    NAME = "test_run_spec"
+
+    def actions_for_project(self, project):
+        return []
+
+
+@run_spec.runtime_handler
+def run_handler(project, experiment, config, jobs, run_f, args):
+    return (project.name, project.cflags, experiment.name, jobs, run_f, args)
+
+
+@pytest.mark.usefixtures("sqlite_db")
+class DescribeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.exp = SpecExperiment(projects=["test_run_spec"])
+        self.prj = self.exp.projects["test_run_spec"]
+        self.prj.cflags = ["-O2"]
+
+    def test_round_trip(self):
+        spec = run_spec.describe(partial(run_handler, self.prj, self.exp,
+                                         CFG, 4))
+        self.assertIsNotNone(spec)
+
+        spec_fd, spec_f = tempfile.mkstemp(suffix=run_spec.SPEC_F_EXT)
+        os.close(spec_fd)
+        try:
+            run_spec.store(spec_f, spec)
+            runner = run_spec.load(spec_f)
+        finally:
+            os.remove(spec_f)
+        self.assertEqual(
+            runner("bin", ["-x"]),
+            ("test_run_spec", ["-O2"], "test_run_spec", 4, "bin", ["-x"]))
+
+    def test_unserializable_attribute_is_pickled(self):
+        self.prj.handle = object()
+        with self.assertLogs("benchbuild.utils.run_spec", "WARNING") as logs:
+            spec = run_spec.describe(partial(run_handler, self.prj, self.exp,
+                                             CFG, 4))
+        self.assertIsNone(spec)
+        self.assertIn("SpecProject.handle", logs.output[0])
@@ -0,0 +1,128 @@
+"""
+Test the SQLite backend and the lazy connection to the result database.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+import uuid
+from types import SimpleNamespace
+from unittest import mock
+
+from benchbuild.settings import CFG
+from benchbuild.utils import db, schema
+
+
+class SQLiteTestCase(unittest.TestCase):
+    def connect(self, connect_string):
+        old_connect = CFG["db"]["connect_string"].value()
+        CFG["db"]["connect_string"] = connect_string
+        schema.reconnect()
+
+        def restore():
+            CFG["db"]["connect_string"] = old_connect
+            schema.reconnect()
+
+        self.addCleanup(restore)
+
+    def test_in_memory(self):
+        self.connect("sqlite://")
+        prj = SimpleNamespace(name="test_schema", domain="debug",
+                              group_name=None, src_uri="none",
+                              run_uuid=uuid.uuid4())
+        db.persist_experiment(SimpleNamespace(name="test-schema"))
+        db.persist_project(prj)
+        run, session = db.create_run("cmd", prj.name, "test-schema",
+                                     prj.run_uuid)
+        session.commit()
+
+        session = schema.Session()
+        try:
+            stored = session.query(schema.Run).filter(
+                schema.Run.id == run.id).one()
+            self.assertEqual(str(stored.run_group), str(prj.run_uuid))
+            experiment = session.query(schema.Experiment).one()
+            self.assertIsInstance(experiment.id, uuid.UUID)
+            self.assertEqual(str(experiment.id),
+                             str(CFG["experiment_id"].value()))
+        finally:
+            session.close()
+
+    def test_file_uses_wal(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_f = os.path.join(tmp_dir, "results.db")
+            self.connect("sqlite:///" + db_f)
+            session = schema.Session()
+            try:
+                self.assertEqual(
+                    session.execute("PRAGMA journal_mode").scalar(), "wal")
+                self.assertEqual(
+                    session.execute("PRAGMA foreign_keys").scalar(), 1)
+            finally:
+                session.close()
+            self.assertTrue(os.path.exists(db_f))
+
+
+class LazyConnectTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.old_connect = CFG["db"]["connect_string"].value()
+        self.old_marker = os.environ.pop(schema.SCHEMA_VERIFIED_ENV, None)
+        CFG["db"]["connect_string"] = "sqlite:///" + os.path.join(
+            self.tmp_dir, "results.db")
+        schema.reconnect()
+
+    def tearDown(self):
+        CFG["db"]["connect_string"] = self.old_connect
+        schema.reconnect()
+        os.environ.pop(schema.SCHEMA_VERIFIED_ENV, None)
+        if self.old_marker is not None:
+            os.environ[schema.SCHEMA_VERIFIED_ENV] = self.old_marker
+        shutil.rmtree(self.tmp_dir)
+
+    def test_import_does_not_connect(self):
+        script = textwrap.dedent("""
+            from benchbuild.utils import db, schema
+            assert schema.CONNECTION_MANAGER is None
+        """)
+        env = dict(os.environ)
+        # Nothing listens there, connecting would fail.
+        env.update({"BB_DB_CONNECT_STRING": "",
+                    "BB_DB_HOST": "localhost",
+                    "BB_DB_PORT": "1",
+                    "PYTHONPATH": os.pathsep.join(sys.path)})
+        subprocess.check_call([sys.executable, "-c", script], env=env)
+
+    def test_connect_on_first_session(self):
+        self.assertIsNone(schema.CONNECTION_MANAGER)
+        schema.Session().close()
+        self.assertIsNotNone(schema.CONNECTION_MANAGER)
+
+    def test_verify_schema_once(self):
+        with mock.patch.object(schema.BASE.metadata, "create_all",
+                               wraps=schema.BASE.metadata.create_all) as \
+                create_all:
+            schema.Session().close()
+            self.assertIn(schema.SCHEMA_VERIFIED_ENV, os.environ)
+
+            # A process of the same experiment inherits the marker.
+            schema.reconnect()
+            schema.Session().close()
+            self.assertEqual(create_all.call_count, 1)
+
+    def test_reconnect(self):
+        session = schema.Session()
+        manager = schema.CONNECTION_MANAGER
+        schema.reconnect()
+        self.assertIsNone(schema.CONNECTION_MANAGER)
+
+        other = schema.Session()
+        self.assertIsNot(schema.CONNECTION_MANAGER, manager)
+        self.assertIsNot(other.bind, session.bind)
+        # The old connection still works for whoever holds it.
+        self.assertEqual(session.execute("SELECT 1").scalar(), 1)
+        session.close()
+        other.close()
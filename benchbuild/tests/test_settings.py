@@ -0,0 +1,157 @@
+"""
+Test the cached lookups and the snapshot files of the configuration.
+"""
+import json
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+from plumbum import local
+
+from benchbuild.settings import Configuration
+
+
+class ConfigurationCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cfg = Configuration("test", init=False)
+        self.cfg["a"] = {
+            "b": {"default": 1},
+            "c": {"x": {"default": "x"}}
+        }
+
+    def test_snapshot_is_reused(self):
+        self.assertIs(self.cfg.snapshot(), self.cfg.snapshot())
+        self.assertIs(self.cfg["a"].snapshot(), self.cfg["a"].snapshot())
+
+    def test_set_in_child_invalidates_parent(self):
+        parent_snapshot = self.cfg.snapshot()
+        parent_repr = repr(self.cfg)
+        child = self.cfg["a"]["c"]
+
+        child["x"] = "y"
+
+        self.assertEqual(parent_snapshot["a.c.x"], "x")
+        self.assertEqual(self.cfg.snapshot()["a.c.x"], "y")
+        self.assertEqual(self.cfg["a"].snapshot()["c.x"], "y")
+        self.assertNotEqual(repr(self.cfg), parent_repr)
+        self.assertIn('TEST_A_C_X="y"', repr(self.cfg))
+
+    def test_set_in_parent_invalidates_child(self):
+        child = self.cfg["a"]["c"]
+        child_snapshot = child.snapshot()
+        child_repr = repr(child)
+
+        self.cfg["a"]["c"]["x"] = "z"
+
+        self.assertEqual(child_snapshot["x"], "x")
+        self.assertEqual(child.snapshot()["x"], "z")
+        self.assertEqual(repr(child), 'TEST_A_C_X="z"')
+        self.assertNotEqual(repr(child), child_repr)
+
+    def test_set_in_sibling_invalidates(self):
+        node = self.cfg["a"]
+        self.assertIn("TEST_A_B=1", repr(node))
+
+        self.cfg["a"]["b"] = 2
+
+        self.assertIn("TEST_A_B=2", repr(node))
+        self.assertEqual(node.snapshot()["b"], 2)
+
+    def test_update_invalidates(self):
+        self.cfg.snapshot()
+        self.cfg.update(Configuration("other", node={"d": {"default": 4}},
+                                      init=False))
+        self.assertEqual(self.cfg.snapshot()["d"], 4)
+
+    def test_load_snapshot_invalidates(self):
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            other = Configuration("test", init=False)
+            other["a"] = {"b": {"default": 5}}
+            snapshot_f = other.snapshot_file(snapshot_dir)
+
+            self.assertEqual(self.cfg.snapshot()["a.b"], 1)
+            self.cfg.load_snapshot(snapshot_f)
+            self.assertEqual(self.cfg.snapshot()["a.b"], 5)
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+    def test_snapshot_file_follows_changes(self):
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            first = self.cfg.snapshot_file(snapshot_dir)
+            self.assertEqual(first, self.cfg.snapshot_file(snapshot_dir))
+
+            self.cfg["a"]["b"] = 2
+            second = self.cfg.snapshot_file(snapshot_dir)
+            self.assertNotEqual(first, second)
+            self.assertTrue(os.path.exists(second))
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+
+class SnapshotFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.cfg = Configuration("test", init=False)
+        self.cfg["db"] = {
+            "host": {"default": "localhost"},
+            "pass": {"default": "secret"},
+            "connect_string": {"default": ""}
+        }
+        self.env = mock.patch.dict(os.environ)
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        local.env.pop("TEST_DB_PASS", None)
+        shutil.rmtree(self.snapshot_dir)
+
+    def test_only_user_may_read(self):
+        snapshot_f = self.cfg.snapshot_file(self.snapshot_dir)
+        self.assertEqual(stat.S_IMODE(os.stat(snapshot_f).st_mode), 0o600)
+
+    def test_secrets_stay_in_environment(self):
+        snapshot_f = self.cfg.snapshot_file(self.snapshot_dir)
+        with open(snapshot_f, 'r') as snapshot:
+            self.assertEqual(json.load(snapshot), {"db.host": "localhost"})
+        self.assertEqual(os.environ["TEST_DB_PASS"], '"secret"')
+        self.assertEqual(local.env["TEST_DB_PASS"], '"secret"')
+        self.assertNotIn("TEST_DB_CONNECT_STRING", os.environ)
+
+        # This is what a wrapper does with BB_CONFIG_SNAPSHOT.
+        child = Configuration("test", init=False)
+        child["db"] = {
+            "host": {"default": "other"},
+            "pass": {"default": ""},
+            "connect_string": {"default": ""}
+        }
+        child.load_snapshot(snapshot_f)
+        child.init_from_env()
+        self.assertEqual(child["db"]["host"].value(), "localhost")
+        self.assertEqual(child["db"]["pass"].value(), "secret")
+
+    def test_remove_old_snapshots(self):
+        old_f = os.path.join(self.snapshot_dir, ".benchbuild-old.json")
+        recent_f = os.path.join(self.snapshot_dir, ".benchbuild-recent.json")
+        for snapshot_f in [old_f, recent_f]:
+            with open(snapshot_f, 'w') as snapshot:
+                snapshot.write("{}")
+        os.utime(old_f, (0, 0))
+
+        snapshot_f = self.cfg.snapshot_file(self.snapshot_dir)
+        self.assertEqual(
+            sorted(os.listdir(self.snapshot_dir)),
+            sorted([".benchbuild-recent.json",
+                    os.path.basename(snapshot_f)]))
+
+    def test_reuse_keeps_snapshot_fresh(self):
+        snapshot_f = self.cfg.snapshot_file(self.snapshot_dir)
+        os.utime(snapshot_f, (0, 0))
+        self.cfg["db"]["host"] = "localhost"
+        self.assertEqual(self.cfg.snapshot_file(self.snapshot_dir),
+                         snapshot_f)
+        self.assertTrue(os.path.exists(snapshot_f))
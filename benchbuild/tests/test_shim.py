@@ -0,0 +1,95 @@
+"""
+Test running wrapped binaries through the native exec shim.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from benchbuild.settings import CFG
+from benchbuild.utils import db, schema, shim
+
+PROGRAM = """#!/bin/sh
+echo "out $*"
+echo err >&2
+exit 3
+"""
+
+
+@pytest.mark.usefixtures("sqlite_db")
+class ShimTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.old_tmp_dir = CFG["tmp_dir"].value()
+        self.old_cc = CFG["shim"]["cc"].value()
+        CFG["tmp_dir"] = self.tmp_dir
+        CFG["shim"]["cc"] = shutil.which("cc") or shutil.which("gcc") or "cc"
+        self.shim_f = shim.build()
+        if self.shim_f is None:
+            self.skipTest("Cannot compile the exec shim.")
+
+        # Everything a shell would expand inside double quotes.
+        self.bin_dir = os.path.join(self.tmp_dir, 'my "$HOME" `id` \\ dir')
+        os.makedirs(self.bin_dir)
+        self.wrapper_f = os.path.join(self.bin_dir, "prog")
+        self.real_f = self.wrapper_f + ".bin"
+        with open(self.real_f, 'w') as real:
+            real.write(PROGRAM)
+        os.chmod(self.real_f, 0o755)
+        spec = {"handler": shim.TIMING_HANDLERS[0], "args": [1]}
+        shim.print_wrapper(self.wrapper_f, self.real_f, self.shim_f, spec,
+                           os.environ["PATH"], "")
+
+    def tearDown(self):
+        CFG["tmp_dir"] = self.old_tmp_dir
+        CFG["shim"]["cc"] = self.old_cc
+        shutil.rmtree(self.tmp_dir)
+
+    def run_wrapper(self, *args):
+        env = dict(os.environ)
+        env.pop("BB_SHIM_RECORDS", None)
+        return subprocess.run([self.wrapper_f] + list(args), env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              universal_newlines=True)
+
+    def test_records_next_to_wrapper(self):
+        proc = self.run_wrapper("a b", "c")
+        self.assertEqual(proc.returncode, 3)
+        self.assertEqual(proc.stdout, "out a b c\n")
+        self.assertEqual(proc.stderr, "err\n")
+
+        records_f = self.wrapper_f + shim.RECORDS_EXT
+        records = list(shim.records(records_f))
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["argv"], [self.real_f, "a b", "c"])
+        self.assertEqual(records[0]["retcode"], 3)
+        self.assertEqual(records[0]["stdout"], "out a b c\n")
+        self.assertEqual(records[0]["stderr"], "err\n")
+        self.assertEqual(records[0]["threads"], "1")
+
+    def test_ingest_output(self):
+        self.run_wrapper("x")
+        prj = SimpleNamespace(name="test_shim", domain="debug",
+                              group_name=None, src_uri="none",
+                              run_uuid=uuid.uuid4(),
+                              experiment=SimpleNamespace(name="test-shim"))
+        db.persist_experiment(prj.experiment)
+        db.persist_project(prj)
+
+        records_f = self.wrapper_f + shim.RECORDS_EXT
+        self.assertEqual(shim.ingest(records_f, prj), 1)
+        db.flush()
+        self.assertFalse(os.path.exists(records_f))
+
+        session = schema.Session()
+        try:
+            logs = session.query(schema.RunLog.status, schema.RunLog.stdout,
+                                 schema.RunLog.stderr).all()
+        finally:
+            session.close()
+        self.assertEqual(logs, [(3, "out x\n", "err\n")])
@@ -0,0 +1,124 @@
+"""
+Test spooling results and loading them with benchbuild ingest.
+"""
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from benchbuild.ingest import BenchBuildIngest, Ingestion
+from benchbuild.settings import CFG
+from benchbuild.utils import db, schema, spool
+
+
+@pytest.mark.usefixtures("sqlite_db")
+class SpoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.old_spool_dir = CFG["spool"]["dir"].value()
+        CFG["spool"]["dir"] = self.spool_dir
+        CFG["spool"]["enable"] = True
+
+    def tearDown(self):
+        CFG["spool"]["enable"] = False
+        CFG["spool"]["dir"] = self.old_spool_dir
+        shutil.rmtree(self.spool_dir)
+
+    def spool_run(self, metrics):
+        """Spool a run with metrics, the way a cluster node does."""
+        prj = SimpleNamespace(name="test_spool", domain="debug",
+                              group_name=None, src_uri="none",
+                              run_uuid=uuid.uuid4())
+        db.persist_experiment(SimpleNamespace(name="test-spool"))
+        db.persist_project(prj)
+        run, session = db.create_run("cmd", prj.name, "test-spool",
+                                     prj.run_uuid)
+        run.status = "running"
+        session.commit()
+        db.persist_metrics(run, session, metrics)
+        db.persist_config(run, session, {"cores": "2"})
+        run.status = "completed"
+        session.commit()
+        db.flush()
+        return spool.spool_path()
+
+    def ingest(self, spool_f):
+        CFG["spool"]["enable"] = False
+        session = schema.Session()
+        try:
+            count = Ingestion(session).ingest(spool_f)
+            session.commit()
+        finally:
+            session.close()
+        return count
+
+    def query(self, *columns):
+        session = schema.Session()
+        try:
+            return sorted(session.query(*columns).all())
+        finally:
+            session.close()
+
+    def test_round_trip(self):
+        spool_f = self.spool_run({"time.real_s": 1.5})
+        self.assertGreater(self.ingest(spool_f), 0)
+
+        runs = self.query(schema.Run.id, schema.Run.status)
+        self.assertEqual(len(runs), 1)
+        run_id, status = runs[0]
+        self.assertIsInstance(run_id, int)
+        self.assertEqual(status, "completed")
+        self.assertEqual(
+            self.query(schema.Metric.name, schema.Metric.value,
+                       schema.Metric.run_id), [("time.real_s", 1.5, run_id)])
+        self.assertEqual(
+            self.query(schema.Config.name, schema.Config.value),
+            [("cores", "2")])
+
+    def test_ingest_twice(self):
+        spool_f = self.spool_run({"time.real_s": 1.5})
+        self.ingest(spool_f)
+        self.ingest(spool_f)
+        self.assertEqual(len(self.query(schema.Run.id)), 1)
+        self.assertEqual(len(self.query(schema.Metric.name)), 1)
+        self.assertEqual(len(self.query(schema.Config.name)), 1)
+
+    def test_truncated_record(self):
+        spool_f = self.spool_run({"time.real_s": 1.5})
+        with open(spool_f, 'a') as spool_file:
+            spool_file.write('{"t":"rows","id":"x","table":"metrics","ro')
+        count = self.ingest(spool_f)
+        with open(spool_f, 'r') as spool_file:
+            self.assertEqual(count, len(spool_file.readlines()) - 1)
+        self.assertEqual(len(self.query(schema.Metric.name)), 1)
+
+    def test_later_records_win(self):
+        begin = datetime.datetime(2017, 1, 1, 12, 0, 0)
+        end = datetime.datetime(2017, 1, 1, 13, 0, 0)
+        spool_f = self.spool_run({"time.real_s": 1.5})
+        experiment_id = str(CFG["experiment_id"])
+        for b, e in [(begin, end), (begin + datetime.timedelta(hours=2),
+                                    end + datetime.timedelta(hours=2))]:
+            spool.append({"t": "obj", "table": "experiment",
+                          "values": {"id": experiment_id, "begin": b,
+                                     "end": e}})
+        self.ingest(spool_f)
+        self.assertEqual(
+            self.query(schema.Experiment.begin, schema.Experiment.end),
+            [(begin, end + datetime.timedelta(hours=2))])
+        self.assertEqual(self.query(schema.Run.status), [("completed", )])
+
+    def test_ingest_command(self):
+        spool_f = self.spool_run({"time.real_s": 1.5})
+        CFG["spool"]["enable"] = False
+        BenchBuildIngest.run(["ingest"], exit=False)
+        self.assertFalse(os.path.exists(spool_f))
+        done = [f for f in os.listdir(self.spool_dir)
+                if f.endswith(".ingested")]
+        self.assertEqual(len(done), 1)
+        self.assertEqual(len(self.query(schema.Metric.name)), 1)
@@ -4,13 +4,18 @@ This defines classes that can be used to implement a series of Actions.
 from benchbuild.settings import CFG
 from benchbuild.utils.db import persist_experiment
 from benchbuild.utils.run import GuardedRunException
+from benchbuild.utils import journal, placement
 
 from plumbum import local
 from plumbum.cmd import mkdir, rm
 from plumbum import ProcessExecutionError
-from functools import partial, wraps
+from contextlib import contextmanager
+from functools import partial, wraps, lru_cache
 from datetime import datetime
 from logging import error
+import hashlib
+import json
+import multiprocessing
 import os
 import logging
 import sys
@@ -52,6 +57,93 @@ def log_before_after(name, desc):
     return func_decorator
 
 
+__MEASUREMENT_LANE = None
+__PARALLEL_ACTIONS = []
+
+
+@contextmanager
+def measurement_lane():
+    """
+    Enter the measurement lane.
+
+    While projects are processed concurrently, all run-time steps have to
+    share a single lane, if the user requested serialized measurements.
+    Outside of a parallel schedule, this does nothing.
+    """
+    lane = __MEASUREMENT_LANE
+    if lane is None:
+        yield
+        return
+
+    with lane:
+        yield
+
+
+def _init_worker(lane):
+    """Initialize a worker process of the parallel project scheduler."""
+    global __MEASUREMENT_LANE
+    __MEASUREMENT_LANE = lane
+
+    schema = sys.modules.get("benchbuild.utils.schema")
+    if schema is not None:
+        schema.reconnect()
+
+
+def _run_action(idx):
+    """Execute the action with the given index inside a worker process."""
+    action = __PARALLEL_ACTIONS[idx]
+    try:
+        return action()
+    except Exception:
+        exc_type, exc_value, exc_traceback = sys.exc_info()
+        logging.getLogger('benchbuild').error("".join(
+            traceback.format_exception(exc_type, exc_value, exc_traceback)))
+        return StepResult.ERROR
+    finally:
+        # Workers leave without running atexit handlers.
+        from benchbuild.utils.db import flush
+        flush()
+
+
+def run_parallel(actions, jobs):
+    """
+    Execute independent actions concurrently in a pool of processes.
+
+    Each action runs in its own forked worker, so failures and their cleanup
+    stay local to the action that caused them.
+
+    Args:
+        actions (list): The actions we want to execute.
+        jobs (int): The maximal number of actions that run at the same time.
+
+    Returns (list(StepResult)):
+        The results of all actions, in the order of :actions:.
+    """
+    global __PARALLEL_ACTIONS
+    jobs = min(int(jobs), len(actions))
+    if jobs <= 1:
+        return [action() for action in actions]
+
+    ctx = multiprocessing.get_context("fork")
+    lane = None
+    if CFG["parallel"]["serialize_runs"].value():
+        lane = ctx.Lock()
+
+    __PARALLEL_ACTIONS = actions
+    pool = ctx.Pool(processes=jobs, initializer=_init_worker,
+                    initargs=(lane, ))
+    try:
+        results = pool.map(_run_action, range(len(actions)), chunksize=1)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        __PARALLEL_ACTIONS = []
+    return results
+
+
 class StepClass(ABCMeta):
     def __new__(metacls, name, bases, namespace, **kwds):
         result = ABCMeta.__new__(metacls, name, bases, dict(namespace))
@@ -68,6 +160,226 @@ class StepClass(ABCMeta):
         return result
 
 
+def step_cache_path(obj):
+    """
+    Get the path of the file that records the completed steps of :obj:.
+
+    The records live in BB_BUILD_DIR/.steps/<experiment>/<project>.json,
+    outside of every directory the Clean action removes.
+
+    Args:
+        obj: A project.
+
+    Returns (str):
+        Path to the record file, None if :obj: is not a project.
+    """
+    experiment = getattr(obj, "experiment", None)
+    if experiment is None:
+        return None
+    return os.path.join(str(CFG["build_dir"]), ".steps", experiment.name,
+                        "{0}.json".format(obj.name))
+
+
+def __load_records(cache_f):
+    if cache_f is None or not os.path.exists(cache_f):
+        return {}
+    try:
+        with open(cache_f, 'r') as cache:
+            return json.load(cache)
+    except ValueError:
+        return {}
+
+
+def load_step_cache(obj):
+    """
+    Load the fingerprints of all steps that completed for project :obj:.
+
+    Records are only valid for the build directory they were made in, and
+    only as long as it exists.
+
+    Args:
+        obj: A project.
+
+    Returns (dict(str: str)):
+        Maps step names to the fingerprint they completed with.
+    """
+    records = __load_records(step_cache_path(obj))
+    builddir = os.path.abspath(obj.builddir)
+    if records.get("builddir") != builddir or not os.path.isdir(builddir):
+        return {}
+    return records.get("steps", {})
+
+
+def store_step_cache(obj, name, digest):
+    """
+    Record that the step :name: completed with fingerprint :digest:.
+
+    Args:
+        obj: A project.
+        name (str): The name of the step.
+        digest (str): The fingerprint the step completed with.
+    """
+    cache_f = step_cache_path(obj)
+    if cache_f is None or not os.path.exists(obj.builddir):
+        return
+    steps = load_step_cache(obj)
+    steps[name] = digest
+    os.makedirs(os.path.dirname(cache_f), exist_ok=True)
+    with open(cache_f + ".tmp", 'w') as cache:
+        json.dump({"builddir": os.path.abspath(obj.builddir),
+                   "steps": steps}, cache)
+    os.replace(cache_f + ".tmp", cache_f)
+
+
+def drop_step_cache(obj):
+    """
+    Forget all completed steps of project :obj:.
+
+    Args:
+        obj: A project.
+    """
+    cache_f = step_cache_path(obj)
+    if cache_f is None or not os.path.exists(cache_f):
+        return
+    records = __load_records(cache_f)
+    if records.get("builddir") in (None, os.path.abspath(obj.builddir)):
+        os.unlink(cache_f)
+
+
+def prune_step_cache(trees=False, older_than=None):
+    """
+    Remove records of completed steps.
+
+    Records whose build directory is gone are always removed.
+
+    Args:
+        trees (bool): Remove the build directories of the selected records
+            as well.
+        older_than (float): Only select records that were not updated for
+            this many seconds.
+
+    Returns (list(str)):
+        The build directories of all removed records, or the record itself
+        if it names none.
+    """
+    import time
+
+    steps_dir = os.path.join(str(CFG["build_dir"]), ".steps")
+    now = time.time()
+    removed = []
+    for root, _, files in os.walk(steps_dir):
+        for name in files:
+            if not name.endswith(".json"):
+                continue
+            cache_f = os.path.join(root, name)
+            builddir = __load_records(cache_f).get("builddir")
+            stale = not builddir or not os.path.isdir(builddir)
+            if not stale:
+                if not trees:
+                    continue
+                if older_than is not None and \
+                   now - os.path.getmtime(cache_f) < older_than:
+                    continue
+                rm("-rf", builddir)
+            os.unlink(cache_f)
+            removed.append(builddir or cache_f)
+    return removed
+
+
+def chain_fingerprints(actions):
+    """
+    Compute the fingerprints of a chain of actions.
+
+    The fingerprint of an action covers its own inputs and the inputs of all
+    cacheable actions before it. A change in the configuration therefore
+    invalidates the build as well.
+
+    Args:
+        actions (list): A chain of actions.
+
+    Returns (list(str)):
+        One fingerprint per action, None for actions that cannot be cached.
+    """
+    sha = hashlib.sha256()
+    digests = []
+    for action in actions:
+        inputs = action.fingerprint()
+        if inputs is None:
+            digests.append(None)
+            continue
+        sha.update(inputs.encode("utf-8"))
+        digests.append(sha.hexdigest())
+    return digests
+
+
+@lru_cache(maxsize=None)
+def compiler_digest():
+    """Hash the clang binary we compile all projects with."""
+    from benchbuild.utils.compiler import llvm
+    clang_f = os.path.join(llvm(), "clang")
+    if not os.path.exists(clang_f):
+        return ""
+
+    sha = hashlib.sha256()
+    with open(clang_f, 'rb') as clang:
+        for block in iter(partial(clang.read, 1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def source_digest(project):
+    """Get the hashes of all cached downloads of the given project."""
+    tmp_dir = str(CFG["tmp_dir"])
+    digests = []
+    for attr in ["src_file", "src_dir"]:
+        src = getattr(project, attr, None)
+        if not src:
+            continue
+        hash_f = os.path.join(tmp_dir, str(src) + ".hash")
+        if os.path.exists(hash_f):
+            with open(hash_f, 'r') as h_file:
+                digests.append(h_file.readline().strip())
+    return ",".join(digests)
+
+
+@lru_cache(maxsize=None)
+def definition_digest(cls):
+    """
+    Hash the definition of a project class.
+
+    This covers the source of :cls: and of all its base classes, except for
+    benchbuild.project.Project itself.
+
+    Returns (str):
+        The digest, or an empty string if the source is not available.
+    """
+    import inspect
+    from benchbuild.project import Project
+
+    sha = hashlib.sha256()
+    for base in inspect.getmro(cls):
+        if base in (Project, object):
+            continue
+        try:
+            sha.update(inspect.getsource(base).encode("utf-8"))
+        except (OSError, TypeError):
+            return ""
+    return sha.hexdigest()
+
+
+def project_inputs(name, project, *inputs):
+    """
+    Describe the inputs of step :name: for the given project.
+
+    Every step depends on the version and on the definition of the project.
+    """
+    return "\n".join(
+        [name, project.experiment.name, project.name,
+         str(getattr(project, "version", None)),
+         definition_digest(type(project))] +
+        [str(x) for x in inputs])
+
+
 class Clean:
     pass
 
@@ -93,13 +405,47 @@ class Step(metaclass=StepClass):
             indent * " ")
 
     def onerror(self):
+        drop_step_cache(self._obj)
         Clean(self._obj)()
 
+    def fingerprint(self):
+        """
+        Describe all inputs of this step.
+
+        A step with a fingerprint is skipped, if it completed with the same
+        fingerprint in the build directory of its project before, see
+        :func:`load_step_cache`.
+
+        Returns (str):
+            A description of all inputs, None if the step cannot be cached.
+        """
+        return None
+
+    def is_cached(self, digest):
+        """Check, if this step completed with the given fingerprint."""
+        if digest is None:
+            return False
+        force = [str(x).upper() for x in CFG["steps"]["force"].value()]
+        if self.NAME in force or "ALL" in force:
+            return False
+        return load_step_cache(self._obj).get(self.NAME) == digest
+
+    def store_fingerprint(self, digest):
+        """Remember that this step completed with the given fingerprint."""
+        if digest is not None:
+            store_step_cache(self._obj, self.NAME, digest)
+
 class Clean(Step):
     NAME = "CLEAN"
     DESCRIPTION = "Cleans the build directory"
 
     def __call__(self):
+        """
+        Remove the build directory and forget the steps completed in it.
+
+        Set BB_CLEAN=false to keep the build directory, later runs can skip
+        the steps that completed in it then.
+        """
         if not CFG['clean'].value():
             return
         if not self._obj:
@@ -107,6 +453,7 @@ class Clean(Step):
         obj_builddir = os.path.abspath(self._obj.builddir)
         if os.path.exists(obj_builddir):
             rm("-rf", obj_builddir)
+        prune_step_cache()
 
     def __str__(self, indent = 0):
         return textwrap.indent(
@@ -130,6 +477,102 @@ class MakeBuildDir(Step):
             "* {0}: Create the build directory".format(self._obj.name),
             indent * " ")
 
+def builddir_state(builddir):
+    """
+    Describe all entries below :builddir:.
+
+    Args:
+        builddir (str): The build directory.
+
+    Returns (dict):
+        Relative path of every entry to (size, mtime) for files, or None for
+        directories.
+    """
+    state = {}
+    for root, dirs, files in os.walk(builddir):
+        for name in dirs + files:
+            path = os.path.join(root, name)
+            relpath = os.path.relpath(path, builddir)
+            if os.path.isdir(path) and not os.path.islink(path):
+                state[relpath] = None
+            else:
+                info = os.lstat(path)
+                state[relpath] = (info.st_size, info.st_mtime_ns)
+    return state
+
+
+def is_wrapper_file(path):
+    """Check, if :path: belongs to a wrapped binary (see project.wrap)."""
+    from benchbuild.project import PROJECT_BIN_F_EXT, PROJECT_BLOB_F_EXT
+    from benchbuild.utils.run_spec import SPEC_F_EXT
+
+    if path.endswith((PROJECT_BLOB_F_EXT, SPEC_F_EXT)):
+        return True
+    if path.endswith(PROJECT_BIN_F_EXT):
+        return os.path.exists(path[:-len(PROJECT_BIN_F_EXT)])
+    return os.path.exists(path + PROJECT_BIN_F_EXT)
+
+
+class SnapshotBuildDir(Step):
+    NAME = "SNAPSHOT"
+    DESCRIPTION = "Remember the contents of the build directory"
+
+    def __init__(self, project, state):
+        super(SnapshotBuildDir, self).__init__(project)
+        self._state = state
+
+    def __call__(self):
+        if not self._obj:
+            return
+        self._state.clear()
+        self._state.update(builddir_state(self._obj.builddir))
+
+    def __str__(self, indent = 0):
+        return textwrap.indent(
+            "* {0}: Remember the build directory: {1}".format(
+                self._obj.name, self._obj.builddir),
+            indent * " ")
+
+
+class ResetBuildDir(Step):
+    NAME = "RESET"
+    DESCRIPTION = "Remove the outputs of a run from the build directory"
+
+    def __init__(self, project, state):
+        super(ResetBuildDir, self).__init__(project)
+        self._state = state
+
+    def __call__(self):
+        """
+        Remove everything a run added to the build directory.
+
+        The state was recorded by SnapshotBuildDir after the build. Files of
+        wrapped binaries are left alone, the next run replaces them anyway.
+        We can not restore files a run modified, we only warn about them.
+        """
+        if not self._obj:
+            return
+        builddir = self._obj.builddir
+        log = logging.getLogger('benchbuild')
+        for relpath, meta in sorted(builddir_state(builddir).items()):
+            path = os.path.join(builddir, relpath)
+            if not os.path.lexists(path):
+                # Inside a directory we removed already.
+                continue
+            if relpath not in self._state:
+                if not is_wrapper_file(path):
+                    rm("-rf", path)
+            elif meta != self._state[relpath] and meta is not None and \
+                    not is_wrapper_file(path):
+                log.warning("%s: The run modified %s.", self._obj.name,
+                            relpath)
+
+    def __str__(self, indent = 0):
+        return textwrap.indent(
+            "* {0}: Remove the outputs of the run from: {1}".format(
+                self._obj.name, self._obj.builddir),
+            indent * " ")
+
 class Prepare(Step):
     NAME = "PREPARE"
     DESCRIPTION = "Prepare project build folder"
@@ -137,6 +580,9 @@ class Prepare(Step):
     def __init__(self, project):
         super(Prepare, self).__init__(project, project.prepare)
 
+    def fingerprint(self):
+        return project_inputs(self.NAME, self._obj, self._obj.testdir)
+
     def __str__(self, indent = 0):
         return textwrap.indent(
             "* {0}: Prepare".format(self._obj.name),
@@ -149,6 +595,11 @@ class Download(Step):
     def __init__(self, project):
         super(Download, self).__init__(project, project.download)
 
+    def fingerprint(self):
+        return project_inputs(self.NAME, self._obj,
+                              getattr(self._obj, "src_uri", None),
+                              source_digest(self._obj))
+
     def __str__(self, indent = 0):
         return textwrap.indent(
             "* {0}: Download".format(self._obj.name),
@@ -161,6 +612,18 @@ class Configure(Step):
     def __init__(self, project):
         super(Configure, self).__init__(project, project.configure)
 
+    def __call__(self):
+        if not self._action_fn:
+            return
+
+        with placement.unreserved():
+            return self._action_fn()
+
+    def fingerprint(self):
+        return project_inputs(self.NAME, self._obj,
+                              self._obj.cflags, self._obj.ldflags,
+                              compiler_digest())
+
     def __str__(self, indent = 0):
         return textwrap.indent(
             "* {0}: Configure".format(self._obj.name),
@@ -173,6 +636,16 @@ class Build(Step):
     def __init__(self, project):
         super(Build, self).__init__(project, project.build)
 
+    def __call__(self):
+        if not self._action_fn:
+            return
+
+        with placement.unreserved():
+            return self._action_fn()
+
+    def fingerprint(self):
+        return project_inputs(self.NAME, self._obj)
+
     def __str__(self, indent = 0):
         return textwrap.indent(
             "* {0}: Compile".format(self._obj.name),
@@ -193,8 +666,9 @@ class Run(Step):
         if not self._action_fn:
             return
 
-        with local.env(BB_EXPERIMENT_ID=str(CFG["experiment_id"])):
-            self._action_fn()
+        with measurement_lane():
+            with local.env(BB_EXPERIMENT_ID=str(CFG["experiment_id"])):
+                return self._action_fn()
 
     def __str__(self, indent = 0):
         return textwrap.indent(
@@ -266,14 +740,38 @@ class Experiment(Any):
         session.commit()
 
 
+    def batches(self):
+        """
+        Split our actions into batches that can be scheduled together.
+
+        All consecutive project chains (RequireAll) are independent of each
+        other and end up in the same batch. Every other action forms a
+        batch of its own.
+        """
+        batch = []
+        for a in self._actions:
+            if isinstance(a, RequireAll):
+                batch.append(a)
+                continue
+            if batch:
+                yield batch
+                batch = []
+            yield [a]
+        if batch:
+            yield batch
+
     def __call__(self):
         result = StepResult.OK
+        jobs = int(CFG["parallel"]["projects"].value())
 
         experiment, session = self.begin_transaction()
         try:
-            for a in self._actions:
+            for batch in self.batches():
                 with local.env(BB_EXPERIMENT_ID=str(CFG["experiment_id"])):
-                    result = a()
+                    results = run_parallel(batch, jobs)
+                result = results[-1]
+                if StepResult.ERROR in results:
+                    result = StepResult.ERROR
         except KeyboardInterrupt:
             error("User requested termination.")
         except Exception:
@@ -296,16 +794,40 @@ class Experiment(Any):
 
 class RequireAll(Step):
 
-    def __init__(self, actions):
+    def __init__(self, actions, key=None):
         self._actions = actions
+        self._key = key
         self._exlog = logging.getLogger('benchbuild')
         super(RequireAll, self).__init__(None, None)
 
     def __len__(self):
         return sum([len(x) for x in self._actions])
 
+    def fingerprints(self):
+        """Get the fingerprints of our actions, if caching is enabled."""
+        if not CFG["steps"]["cache"].value():
+            return [None] * len(self._actions)
+        return chain_fingerprints(self._actions)
+
+    def completed(self):
+        """Check, if this chain completed in an earlier, resumed run."""
+        return self._key is not None and journal.completed(self._key)
+
     def __call__(self):
+        if self.completed():
+            self._exlog.info("{0} - completed before".format(self._key))
+            return
+
+        digests = self.fingerprints()
+        dirty = False
         for i, action in enumerate(self._actions):
+            digest = digests[i]
+            if not dirty and action.is_cached(digest):
+                self._exlog.info("{0} - cached".format(action.NAME))
+                continue
+            # Every step after an executed one has to be executed as well.
+            dirty = dirty or digest is not None
+
             try:
                 result = action()
             except ProcessExecutionError as proc_ex:
@@ -319,8 +841,24 @@ class RequireAll(Step):
                     "Execution of #{0}: '{1}' failed.".format(i, str(action)))
                 action.onerror()
                 return result
+            action.store_fingerprint(digest)
+
+        if self._key is not None:
+            journal.record(self._key)
 
     def __str__(self, indent = 0):
-        sub_actns = [a.__str__(indent + 1) for a in self._actions]
+        digests = self.fingerprints()
+        dirty = False
+        sub_actns = []
+        for action, digest in zip(self._actions, digests):
+            sub_actn = action.__str__(indent + 1)
+            if not dirty and action.is_cached(digest):
+                sub_actn += " [cached]"
+            else:
+                dirty = dirty or digest is not None
+            sub_actns.append(sub_actn)
         sub_actns = "\n".join(sub_actns)
-        return textwrap.indent("* All required:\n" + sub_actns, indent * " ")
+        header = "* All required:\n"
+        if self.completed():
+            header = "* All required [completed]:\n"
+        return textwrap.indent(header + sub_actns, indent * " ")
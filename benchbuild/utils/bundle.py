@@ -0,0 +1,208 @@
+"""
+Offline source bundles.
+
+A bundle packages cache entries of the downloader (see
+benchbuild.utils.downloader) into a single tar archive, e.g., to carry the
+sources of an experiment to cluster nodes without network access.
+
+The first member of a bundle is its index, 'index.json':
+
+    {"format": 1,
+     "entries": {NAME: {"url": ..., "method": ..., "digest": ...}, ...}}
+
+NAME is the name of the entry in the cache, "digest" is the hash of its
+manifest. The entry itself is stored below 'entries/NAME'.
+
+Bundles listed in BB_DOWNLOAD_BUNDLES are consulted by the downloader before
+it goes to the network.
+"""
+import json
+import logging
+import os
+import tarfile
+
+FORMAT = 1
+INDEX_F = "index.json"
+ENTRY_PREFIX = "entries/"
+
+LOG = logging.getLogger(__name__)
+
+
+def __read_index(bundle, bundle_f):
+    member = bundle.next()
+    if member is None or member.name != INDEX_F:
+        raise ValueError("{0} is not a benchbuild bundle.".format(bundle_f))
+    index = json.loads(bundle.extractfile(member).read().decode("utf-8"))
+    if index.get("format") != FORMAT:
+        raise ValueError("{0}: Unsupported bundle format {1}".format(
+            bundle_f, index.get("format")))
+    return index["entries"]
+
+
+def read_index(bundle_f):
+    """
+    Read the index of a bundle.
+
+    Args:
+        bundle_f (str): Path to the bundle.
+
+    Returns (dict):
+        Name of the cache entry to its description.
+    """
+    with tarfile.open(bundle_f, 'r:*') as bundle:
+        return __read_index(bundle, bundle_f)
+
+
+def create(bundle_f, sources, root, compression=""):
+    """
+    Package the cache entries of :sources: into a bundle.
+
+    Args:
+        bundle_f (str): Path of the bundle we create.
+        sources (list(tuple)): (downloader function, url, name) of all
+            entries, as returned by Project.sources().
+        root (str): The cache directory.
+        compression (str): The tarfile compression, e.g., "gz" or "xz".
+
+    Returns (list(str)):
+        Names of the entries that are missing in the cache.
+    """
+    import io
+    from benchbuild.utils.downloader import build_manifest, manifest_digest
+
+    entries = {}
+    missing = []
+    for method, url, name in sources:
+        if name in entries or name in missing:
+            continue
+        src_path = os.path.join(root, name)
+        if not os.path.exists(src_path):
+            missing.append(name)
+            continue
+        entries[name] = {
+            "url": url,
+            "method": method.__name__,
+            "digest": manifest_digest(build_manifest(src_path))
+        }
+
+    index = json.dumps({"format": FORMAT, "entries": entries},
+                       indent=2, sort_keys=True).encode("utf-8")
+    with tarfile.open(bundle_f, "w:" + compression) as bundle:
+        info = tarfile.TarInfo(INDEX_F)
+        info.size = len(index)
+        bundle.addfile(info, io.BytesIO(index))
+        for name in sorted(entries):
+            bundle.add(os.path.join(root, name), ENTRY_PREFIX + name)
+    return missing
+
+
+def entry_name(member):
+    """
+    Get the name of the cache entry a bundle member belongs to.
+
+    Returns (str):
+        The name, or None if :member: is not part of an entry.
+    """
+    if not member.name.startswith(ENTRY_PREFIX):
+        return None
+    return member.name[len(ENTRY_PREFIX):].split("/")[0]
+
+
+def is_safe(member, name):
+    """
+    Check, if :member: stays inside the cache entry :name: on extraction.
+
+    Links must point inside the entry as well, otherwise the link or a later
+    member written through it could leave the entry.
+    """
+    import posixpath
+
+    prefix = ENTRY_PREFIX + name
+    parts = member.name.split("/")
+    if member.name.startswith("/") or ".." in parts or \
+       not (member.isfile() or member.isdir() or member.issym() or
+            member.islnk()):
+        return False
+
+    def inside(path):
+        path = posixpath.normpath(path)
+        return path == prefix or path.startswith(prefix + "/")
+
+    if member.issym():
+        return not member.linkname.startswith("/") and inside(
+            posixpath.join(posixpath.dirname(member.name), member.linkname))
+    if member.islnk():
+        return inside(member.linkname)
+    return True
+
+
+def extract_all(bundle_f, names, root):
+    """
+    Extract cache entries from a bundle, in a single pass over it.
+
+    Every entry is extracted next to its final location and renamed into
+    place after its digest has been verified.
+
+    Args:
+        bundle_f (str): Path to the bundle.
+        names (iterable(str)): Names of the cache entries.
+        root (str): The cache directory.
+
+    Returns (list(str)):
+        Names of the entries the bundle provided.
+    """
+    import shutil
+    import tempfile
+    from benchbuild.utils.downloader import build_manifest, manifest_digest
+
+    tmp_root = tempfile.mkdtemp(prefix=".bundle.", dir=root)
+    extracted = []
+    try:
+        with tarfile.open(bundle_f, 'r:*') as bundle:
+            index = __read_index(bundle, bundle_f)
+            wanted = set(names) & set(index)
+            unsafe = set()
+            seen = set()
+            for member in bundle:
+                name = entry_name(member)
+                if name not in wanted:
+                    # Members of an entry are stored together.
+                    if seen == wanted:
+                        break
+                    continue
+                seen.add(name)
+                if name in unsafe:
+                    continue
+                if not is_safe(member, name):
+                    LOG.error("%s: Refusing to extract %s", bundle_f,
+                              member.name)
+                    unsafe.add(name)
+                    continue
+                bundle.extract(member, tmp_root, set_attrs=not member.isdir())
+
+        for name in sorted(seen - unsafe):
+            src_path = os.path.join(tmp_root, ENTRY_PREFIX + name)
+            if manifest_digest(build_manifest(src_path)) != \
+               index[name]["digest"]:
+                LOG.error("%s: %s does not match its digest.", bundle_f, name)
+                continue
+            os.rename(src_path, os.path.join(root, name))
+            extracted.append(name)
+        return extracted
+    finally:
+        shutil.rmtree(tmp_root, ignore_errors=True)
+
+
+def extract(bundle_f, name, root):
+    """
+    Extract a single cache entry from a bundle.
+
+    Args:
+        bundle_f (str): Path to the bundle.
+        name (str): Name of the cache entry.
+        root (str): The cache directory.
+
+    Returns (bool):
+        True, if the bundle provided the entry.
+    """
+    return name in extract_all(bundle_f, [name], root)
@@ -0,0 +1,244 @@
+"""
+Per-run resource accounting with cgroups v2.
+
+With BB_CGROUP_ENABLE set, benchbuild.utils.run.guarded_exec launches every
+command in a transient cgroup below BB_CGROUP_PATH. After the command
+finished, we read the accounting files of the cgroup and store them as
+metrics of the run:
+
+    cgroup.cpu.usage_usec, cgroup.cpu.user_usec, cgroup.cpu.system_usec
+    cgroup.memory.peak - The peak memory footprint in bytes.
+    cgroup.io.rbytes, cgroup.io.wbytes, cgroup.io.rios, cgroup.io.wios
+        - Summed over all devices.
+    cgroup.{cpu,memory,io}.pressure.{some,full} - Total stall time in usec.
+
+The cpu.stat and pressure files exist in every cgroup. memory.peak and
+io.stat require the memory and io controllers, i.e., BB_CGROUP_PATH has to
+be a delegated cgroup that does not contain processes itself, e.g.,
+a subgroup of a scope created by ``systemd-run --user -p Delegate=yes``.
+Without BB_CGROUP_PATH, we use the cgroup of the current process.
+"""
+import logging
+import os
+import uuid
+
+from benchbuild.settings import CFG
+
+LOG = logging.getLogger(__name__)
+
+CONTROLLERS = ["cpu", "memory", "io"]
+
+ENTER_CGROUP = 'echo $$ > "$0/cgroup.procs" && exec "$@"'
+"""Shell snippet that moves itself into the cgroup $0 and executes $@."""
+
+
+def parse_flat_keyed(text):
+    """
+    Parse a flat keyed cgroup file, e.g., cpu.stat.
+
+    >>> parse_flat_keyed("usage_usec 1200\\nuser_usec 1000\\n")
+    {'usage_usec': 1200, 'user_usec': 1000}
+    """
+    values = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) == 2:
+            values[parts[0]] = int(parts[1])
+    return values
+
+
+def parse_io_stat(text):
+    """
+    Parse io.stat and sum up the counters of all devices.
+
+    >>> s = parse_io_stat("8:0 rbytes=10 wbytes=20 rios=1 wios=2 dbytes=0\\n"
+    ...                   "8:16 rbytes=5 wbytes=0 rios=1 wios=0 dbytes=0\\n")
+    >>> s["rbytes"], s["wbytes"], s["rios"], s["wios"]
+    (15, 20, 2, 2)
+    """
+    totals = {}
+    for line in text.splitlines():
+        for field in line.split()[1:]:
+            key, _, value = field.partition("=")
+            totals[key] = totals.get(key, 0) + int(value)
+    return totals
+
+
+def parse_pressure(text):
+    """
+    Parse a pressure stall file, e.g., memory.pressure.
+
+    Returns (dict):
+        The total stall time in usec of the 'some' and 'full' lines.
+
+    >>> parse_pressure("some avg10=0.00 avg60=0.00 avg300=0.00 total=42\\n"
+    ...                "full avg10=0.00 avg60=0.00 avg300=0.00 total=7\\n")
+    {'some': 42.0, 'full': 7.0}
+    """
+    totals = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        for field in parts[1:]:
+            key, _, value = field.partition("=")
+            if key == "total":
+                totals[parts[0]] = float(value)
+    return totals
+
+
+def __read(path):
+    try:
+        with open(path, 'r') as cg_file:
+            return cg_file.read()
+    except OSError:
+        return None
+
+
+def collect(cg_path):
+    """
+    Collect the accounting data of a cgroup.
+
+    Args:
+        cg_path (str): Path of the cgroup.
+
+    Returns (dict):
+        Metric name to value. Files that do not exist are skipped.
+    """
+    metrics = {}
+    cpu_stat = __read(os.path.join(cg_path, "cpu.stat"))
+    if cpu_stat:
+        for key, value in parse_flat_keyed(cpu_stat).items():
+            if key in ("usage_usec", "user_usec", "system_usec"):
+                metrics["cgroup.cpu." + key] = value
+
+    peak = __read(os.path.join(cg_path, "memory.peak"))
+    if peak:
+        metrics["cgroup.memory.peak"] = int(peak)
+
+    io_stat = __read(os.path.join(cg_path, "io.stat"))
+    if io_stat is not None:
+        totals = parse_io_stat(io_stat)
+        for key in ("rbytes", "wbytes", "rios", "wios"):
+            metrics["cgroup.io." + key] = totals.get(key, 0)
+
+    for controller in CONTROLLERS:
+        pressure = __read(os.path.join(cg_path, controller + ".pressure"))
+        if pressure:
+            for kind, total in parse_pressure(pressure).items():
+                metrics["cgroup.{0}.pressure.{1}".format(controller,
+                                                         kind)] = total
+    return metrics
+
+
+def __cgroup2_mount():
+    with open("/proc/self/mounts", 'r') as mounts:
+        for line in mounts:
+            fields = line.split()
+            if len(fields) > 2 and fields[2] == "cgroup2":
+                return fields[1]
+    return None
+
+
+def parent():
+    """
+    The cgroup we create transient cgroups in.
+
+    Returns (str):
+        BB_CGROUP_PATH, or the cgroup v2 of the current process, or None if
+        there is no cgroup v2 hierarchy.
+    """
+    configured = str(CFG["cgroup"]["path"])
+    if configured:
+        return configured
+
+    mount = __cgroup2_mount()
+    if mount is None:
+        return None
+    with open("/proc/self/cgroup", 'r') as cgroups:
+        for line in cgroups:
+            if line.startswith("0::"):
+                return os.path.join(mount, line[3:].strip().lstrip("/"))
+    return None
+
+
+__PREPARED = set()
+
+
+def __prepare(parent_path):
+    """Enable as many controllers for the children of :parent_path:."""
+    if parent_path in __PREPARED:
+        return
+    __PREPARED.add(parent_path)
+    for controller in CONTROLLERS:
+        try:
+            with open(os.path.join(parent_path, "cgroup.subtree_control"),
+                      'w') as subtree_control:
+                subtree_control.write("+" + controller)
+        except OSError as ex:
+            LOG.debug("Could not enable the %s controller in %s: %s",
+                      controller, parent_path, str(ex))
+
+
+def create():
+    """
+    Create a transient cgroup.
+
+    Returns (str):
+        Path of the new cgroup, or None, if we can not create one.
+    """
+    parent_path = parent()
+    if parent_path is None:
+        LOG.warning("No cgroup v2 hierarchy found.")
+        return None
+    __prepare(parent_path)
+    cg_path = os.path.join(parent_path, "bb-" + str(uuid.uuid4()))
+    try:
+        os.mkdir(cg_path)
+    except OSError as ex:
+        LOG.warning("Could not create the cgroup %s: %s", cg_path, str(ex))
+        return None
+    return cg_path
+
+
+def remove(cg_path):
+    """Remove a transient cgroup, if it is empty."""
+    try:
+        os.rmdir(cg_path)
+    except OSError as ex:
+        LOG.warning("Could not remove the cgroup %s: %s", cg_path, str(ex))
+
+
+def wrap(cmd, cg_path):
+    """
+    Wrap a plumbum command, such that it runs inside the cgroup :cg_path:.
+
+    Redirections and pipelines are preserved, all commands of a pipeline
+    run inside the cgroup.
+
+    Args:
+        cmd: The plumbum command.
+        cg_path (str): Path of the cgroup.
+
+    Returns:
+        The wrapped command.
+    """
+    import copy
+    from plumbum import local
+    from plumbum.commands.base import Pipeline
+
+    if isinstance(cmd, Pipeline):
+        wrapped = copy.copy(cmd)
+        wrapped.srccmd = wrap(cmd.srccmd, cg_path)
+        wrapped.dstcmd = wrap(cmd.dstcmd, cg_path)
+        return wrapped
+    if hasattr(cmd, "cmd"):
+        wrapped = copy.copy(cmd)
+        wrapped.cmd = wrap(cmd.cmd, cg_path)
+        return wrapped
+    return local["/bin/sh"]["-c", ENTER_CGROUP, cg_path][cmd.formulate(0)]
+
+
+def enabled():
+    """Check, if we account resources with cgroups."""
+    return bool(CFG["cgroup"]["enable"].value())
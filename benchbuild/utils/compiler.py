@@ -133,11 +133,17 @@ def print_libtool_sucks_wrapper(filepath, cflags, ldflags, compiler, func,
         compiler_ext_name: The name that we should give to the generated
             dill blob for :func:
 
+    If BB_COMPILER_SERVER is enabled, the script at :filepath: is a small
+    client of a compile server (see benchbuild.utils.compiler_server) and
+    the wrapper script is placed next to it. Wrappers that are called from
+    within a uchroot always use the wrapper script.
+
     Returns (plumbum.cmd):
         Command of the new compiler we can call.
     """
     from plumbum.cmd import chmod
     import dill
+    from os import path
     from os.path import abspath
 
     cc_f = abspath(filepath + ".benchbuild.cc")
@@ -158,21 +164,32 @@ def print_libtool_sucks_wrapper(filepath, cflags, ldflags, compiler, func,
     lib_path_list = CFG["env"]["compiler_ld_library_path"].value()
     ldflags = ldflags + ["-L" + pelem for pelem in lib_path_list if pelem]
 
-    with open(filepath, 'w') as wrapper:
+    cache_dir = None
+    if CFG["compiler"]["cache"].value() and compiler_ext_name is None:
+        cache_dir = path.join(str(CFG["tmp_dir"]), "cc-cache")
+
+    wrapper_f = filepath
+    use_server = CFG["compiler"]["server"].value() and \
+        compiler_ext_name is None
+    if use_server:
+        from benchbuild.utils.compiler_server import server_dir
+        sock_dir = server_dir()
+        use_server = sock_dir is not None
+    if use_server:
+        wrapper_f = abspath(filepath + ".benchbuild.py")
+
+    with open(wrapper_f, 'w') as wrapper:
         lines = """#!/usr/bin/env python3
 #
 import os
 import sys
 import logging
 import dill
-import functools
-from plumbum import ProcessExecutionError, local
-from plumbum.commands.modifiers import TEE
-from plumbum.cmd import timeout
-from benchbuild.utils.run import GuardedRunException
 from benchbuild.utils import log
+from benchbuild.utils.compiler_server import invoke
 
 os.environ["BB_CONFIG_FILE"] = "{CFG_FILE}"
+os.environ["BB_CONFIG_SNAPSHOT"] = "{CFG_SNAPSHOT}"
 from benchbuild.settings import CFG
 
 log.configure()
@@ -191,64 +208,29 @@ if not CC:
 CFLAGS={CFLAGS}
 LDFLAGS={LDFLAGS}
 BLOB_F="{BLOB_F}"
+CACHE_DIR={CACHE_DIR!r}
 
+CFG["db"]["connect_string"] = "{db_connect_string}"
 CFG["db"]["host"] = "{db_host}"
 CFG["db"]["port"] = "{db_port}"
 CFG["db"]["name"] = "{db_name}"
 CFG["db"]["user"] = "{db_user}"
 CFG["db"]["pass"] = "{db_pass}"
+CFG["spool"]["enable"] = {spool_enable}
+CFG["spool"]["dir"] = "{spool_dir}"
 
-input_files = [x for x in sys.argv[1:] if not '-' is x[0]]
-flags = sys.argv[1:]
-
-def invoke_external_measurement(cmd):
+def main():
     f = None
     if os.path.exists(BLOB_F):
-        with open(BLOB_F,
-                  "rb") as p:
+        with open(BLOB_F, "rb") as p:
             f = dill.load(p)
 
-    if f is not None:
-        if not sys.stdin.isatty():
-            f(cmd, has_stdin=True)
-        else:
-            f(cmd)
-
-def run(cmd):
-    fc = timeout["2m", cmd]
-    fc = fc.with_env(**cmd.envvars)
-    retcode, stdout, stderr = (fc & TEE)
-    return (retcode, stdout, stderr)
-
-def construct_cc(cc, flags, CFLAGS, LDFLAGS, ifiles):
-    fc = None
-    if len(input_files) > 0:
-        fc = cc["-Qunused-arguments", CFLAGS, LDFLAGS, flags]
-    else:
-        fc = cc["-Qunused-arguments", flags]
-    fc = fc.with_env(**cc.envvars)
-    return fc
-
-def construct_cc_default(cc, flags, ifiles):
-    fc = None
-    fc = cc["-Qunused-arguments", flags]
-    fc = fc.with_env(**cc.envvars)
-    return fc
-
-def main():
-    if 'conftest.c' in input_files:
-        retcode, _, _ = (CC[flags] & TEE)
-        return retcode
-    else:
-        fc = construct_cc(CC, flags, CFLAGS, LDFLAGS, input_files)
-        try:
-            retcode, stdout, stderr = run(fc)
-            invoke_external_measurement(fc)
-            return retcode
-        except ProcessExecutionError:
-            fc = construct_cc_default(CC, flags, input_files)
-            retcode, stdout, stderr = run(fc)
-            return retcode
+    retcode, stdout, stderr = invoke(CC, CFLAGS, LDFLAGS, f, sys.argv[1:],
+                                     has_stdin=not sys.stdin.isatty(),
+                                     cache_dir=CACHE_DIR)
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    return retcode
 
 if __name__ == "__main__":
     retcode = main()
@@ -257,14 +239,74 @@ if __name__ == "__main__":
            CFLAGS=cflags,
            LDFLAGS=ldflags,
            BLOB_F=blob_f,
+           CACHE_DIR=cache_dir,
+           db_connect_string=str(CFG["db"]["connect_string"]),
            db_host=str(CFG["db"]["host"]),
            db_name=str(CFG["db"]["name"]),
            db_port=str(CFG["db"]["port"]),
            db_pass=str(CFG["db"]["pass"]),
            db_user=str(CFG["db"]["user"]),
-           CFG_FILE=CFG["config_file"].value())
+           spool_enable=bool(CFG["spool"]["enable"].value()),
+           spool_dir=str(CFG["spool"]["dir"]),
+           CFG_FILE=CFG["config_file"].value(),
+           CFG_SNAPSHOT=CFG.snapshot_file(str(CFG["build_dir"])))
         wrapper.write(lines)
-        chmod("+x", filepath)
+        chmod("+x", wrapper_f)
+
+    if use_server:
+        __print_compile_server_client(filepath, wrapper_f, cc_f, blob_f,
+                                      cflags, ldflags, cache_dir, sock_dir)
+
+
+def __print_compile_server_client(filepath, wrapper_f, cc_f, blob_f, cflags,
+                                  ldflags, cache_dir, sock_dir):
+    """
+    Put a compile server client in front of the wrapper script.
+
+    The socket is named after the configuration of the server. This way a
+    wrapper never talks to a server that was started with different flags.
+    It lives in :sock_dir:, see benchbuild.utils.compiler_server.server_dir.
+    """
+    import hashlib
+    import json
+    from os.path import abspath, join
+    from benchbuild.utils.compiler_server import print_client
+
+    config = {
+        "cc_f": cc_f,
+        "blob_f": blob_f,
+        "cflags": cflags,
+        "ldflags": ldflags,
+        "cache_dir": cache_dir,
+        "config_file": CFG["config_file"].value(),
+        "db": {
+            "connect_string": str(CFG["db"]["connect_string"]),
+            "host": str(CFG["db"]["host"]),
+            "port": str(CFG["db"]["port"]),
+            "name": str(CFG["db"]["name"]),
+            "user": str(CFG["db"]["user"]),
+            "pass": str(CFG["db"]["pass"])
+        },
+        "spool": {
+            "enable": bool(CFG["spool"]["enable"].value()),
+            "dir": str(CFG["spool"]["dir"])
+        }
+    }
+    digest = hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8"))
+    digest.update(abspath(filepath).encode("utf-8"))
+    for path in [cc_f, blob_f]:
+        try:
+            with open(path, 'rb') as blob:
+                digest.update(blob.read())
+        except IOError:
+            pass
+    config["socket"] = join(sock_dir,
+                            "{0}.sock".format(digest.hexdigest()[:16]))
+
+    config_f = abspath(filepath + ".benchbuild.json")
+    with open(config_f, 'w') as config_file:
+        json.dump(config, config_file)
+    print_client(filepath, config_f, config["socket"], wrapper_f)
 
 
 def llvm():
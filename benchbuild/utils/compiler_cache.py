@@ -0,0 +1,436 @@
+"""
+Compilation result cache for the compiler wrappers.
+
+Experiments that collect compile-time statistics rebuild the same
+translation units with the same flags over and over again. With
+BB_COMPILER_CACHE enabled, the compiler wrappers look up the result of a
+compilation in a content-addressed cache before they call clang.
+
+The key of a compilation is made of:
+    * the preprocessed translation unit,
+    * the hidden CFLAGS and LDFLAGS and all compiler arguments that are not
+      consumed by the preprocessor,
+    * the identity (path, size, mtime and environment) of the compiler.
+
+Running the preprocessor is the expensive part of a lookup. Like ccache's
+direct mode, we therefore remember the headers every lookup pulled in, in a
+manifest keyed on the raw compiler call and the source file. As long as
+none of these headers changed, later lookups take the key from the
+manifest and skip the preprocessor. Headers that are added to the include
+path later and shadow a recorded one are not detected. Sources that use
+__DATE__ or __TIME__ always go through the preprocessor.
+
+An entry stores the object file and the output of the compiler. The command
+we hand to the compiler extension is routed through this module as well
+(see :meth:`CacheEntry.command`). The first call records its output in the
+entry, later calls with the same arguments replay it with a small shell
+script, so e.g. the compilestats extensions still get their '-stats'
+output without a single call to clang or to a python interpreter.
+Extensions that rely on side effects of their compiler call should not be
+used with the cache.
+
+Only compilations of a single source file to an object file ('-c') are
+cached.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from benchbuild.utils.compiler_server import bound_env
+
+SOURCE_EXT = (".c", ".cc", ".cp", ".cpp", ".cxx", ".c++", ".C", ".i", ".ii",
+              ".m")
+"""File extensions of input files we can cache."""
+
+WITH_VALUE = ("-o", "-x", "-I", "-D", "-U", "-include", "-imacros",
+              "-isystem", "-iquote", "-idirafter", "-MF", "-MT", "-MQ",
+              "-arch", "-target", "-mllvm", "-Xclang", "-Xpreprocessor",
+              "-Xassembler", "-Xlinker")
+"""Arguments that take their value as a separate argument."""
+
+PREPROCESSOR_ONLY = ("-I", "-D", "-U", "-include", "-imacros", "-isystem",
+                     "-iquote", "-idirafter")
+"""Arguments that are fully reflected in the preprocessed input."""
+
+
+def cacheable(argv):
+    """
+    Check, if a call of the compiler can be served from the cache.
+
+    Args:
+        argv (list(str)): Arguments of the compiler call.
+
+    Returns (tuple(str, str)):
+        The source file and the object file of the compilation, or None.
+
+    Examples:
+        >>> cacheable(["-c", "-O3", "foo.c"])
+        ('foo.c', 'foo.o')
+        >>> cacheable(["-c", "-I", "inc.c", "foo.cpp", "-o", "obj/foo.o"])
+        ('foo.cpp', 'obj/foo.o')
+        >>> cacheable(["-O3", "foo.c"]) is None
+        True
+        >>> cacheable(["-c", "-MD", "foo.c"]) is None
+        True
+        >>> cacheable(["-c", "foo.c", "bar.c"]) is None
+        True
+    """
+    if "-c" not in argv:
+        return None
+
+    inputs = []
+    output = None
+    args = iter(argv)
+    for arg in args:
+        if arg == "-" or arg.startswith("-M") or \
+           arg.startswith("-save-temps"):
+            return None
+        if arg in WITH_VALUE:
+            value = next(args, None)
+            if arg == "-o":
+                output = value
+        elif not arg.startswith("-"):
+            inputs.append(arg)
+
+    if len(inputs) != 1 or not inputs[0].endswith(SOURCE_EXT):
+        return None
+    src = inputs[0]
+    if output is None:
+        output = os.path.splitext(os.path.basename(src))[0] + ".o"
+    return (src, output)
+
+
+def __key_args(argv, src, output):
+    """Strip everything from argv that is covered by the preprocessed input."""
+    key_args = []
+    args = iter(argv)
+    for arg in args:
+        if arg in PREPROCESSOR_ONLY or arg == "-o":
+            next(args, None)
+        elif arg.startswith(PREPROCESSOR_ONLY) or arg in (src, output):
+            continue
+        else:
+            key_args.append(arg)
+    return key_args
+
+
+def __identity(cc):
+    """Identify a compiler without reading the whole binary."""
+    argv = cc.formulate()
+    identity = {"argv": argv, "env": sorted(bound_env(cc).items())}
+    try:
+        stat = os.stat(argv[0])
+        identity["stat"] = [stat.st_size, stat.st_mtime]
+    except OSError:
+        pass
+    return identity
+
+
+def parse_depfile(text):
+    """
+    Get the prerequisites from a dependency file of the preprocessor.
+
+    >>> parse_depfile("foo.o: foo.c inc/a.h \\\\\\n"
+    ...               "  /usr/include/my\\\\ file.h\\n")
+    ['foo.c', 'inc/a.h', '/usr/include/my file.h']
+    """
+    _, _, deps = text.replace("\\\n", " ").partition(": ")
+    files = []
+    current = ""
+    escaped = False
+    for char in deps:
+        if escaped:
+            current += char
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char.isspace():
+            if current:
+                files.append(current)
+            current = ""
+        else:
+            current += char
+    if current:
+        files.append(current)
+    return files
+
+
+TIME_MACROS = (b"__DATE__", b"__TIME__", b"__TIMESTAMP__")
+
+
+def __hash_file(path):
+    """
+    Hash a file we depend on.
+
+    Returns (str):
+        The hash of the file, None if it is missing or uses a time macro.
+    """
+    try:
+        with open(path, 'rb') as src:
+            content = src.read()
+    except OSError:
+        return None
+    if any(macro in content for macro in TIME_MACROS):
+        return None
+    return hashlib.sha256(content).hexdigest()
+
+
+def __load_manifest(manifest_f):
+    """Get the key a manifest points to, if none of its files changed."""
+    try:
+        with open(manifest_f, 'r') as manifest:
+            data = json.load(manifest)
+    except (OSError, ValueError):
+        return None
+    for path, digest in data["files"].items():
+        if __hash_file(path) != digest:
+            return None
+    return data["key"]
+
+
+def __store_manifest(manifest_f, depfile_f, key):
+    """Remember the files of a compilation, skip it if one is unusable."""
+    try:
+        with open(depfile_f, 'r') as depfile:
+            deps = parse_depfile(depfile.read())
+    except OSError:
+        return
+    files = {}
+    for dep in deps:
+        path = os.path.abspath(dep)
+        files[path] = __hash_file(path)
+        if files[path] is None:
+            return
+
+    os.makedirs(os.path.dirname(manifest_f), exist_ok=True)
+    tmp_f = "{0}.{1}.tmp".format(manifest_f, os.getpid())
+    with open(tmp_f, 'w') as manifest:
+        json.dump({"key": key, "files": files}, manifest)
+    os.replace(tmp_f, manifest_f)
+
+
+def lookup(cache_dir, cc, cflags, ldflags, argv):
+    """
+    Find the cache entry of a compiler call.
+
+    Args:
+        cache_dir (str): Root directory of the cache.
+        cc (plumbum.cmd): The real compiler.
+        cflags (list(str)): The hidden CFLAGS.
+        ldflags (list(str)): The hidden LDFLAGS.
+        argv (list(str)): Arguments of the compiler call.
+
+    Returns (CacheEntry):
+        The entry of this compilation, or None if it can not be cached.
+    """
+    files = cacheable(argv)
+    if files is None:
+        return None
+    src, output = files
+
+    key_args = __key_args(argv, src, output)
+    if any(arg.startswith("-g") for arg in key_args + cflags):
+        # Debug information refers to the location of the source.
+        key_args = key_args + [os.path.abspath(src)]
+    compilation = [__identity(cc), cflags, ldflags, key_args]
+
+    # The raw call, including all preprocessor arguments, selects the
+    # manifest of the headers this compilation used last time.
+    direct = hashlib.sha256()
+    direct.update(json.dumps(compilation + [argv, os.getcwd()]).encode(
+        "utf-8"))
+    direct.update(str(__hash_file(src)).encode("utf-8"))
+    direct = direct.hexdigest()
+    manifest_f = os.path.join(cache_dir, "manifests", direct[:2], direct)
+    key = __load_manifest(manifest_f)
+    if key is not None:
+        return CacheEntry(os.path.join(cache_dir, key[:2], key), output)
+
+    pre_argv = [arg for arg in argv if arg != "-c"]
+    if "-o" in pre_argv:
+        idx = pre_argv.index("-o")
+        del pre_argv[idx:idx + 2]
+    fd, depfile_f = tempfile.mkstemp(suffix=".d")
+    os.close(fd)
+    try:
+        pre = cc["-Qunused-arguments", cflags, pre_argv, "-E", "-P", "-MD",
+                 "-MF", depfile_f]
+        pre = pre.with_env(**bound_env(cc))
+        retcode, stdout, _ = pre.run(retcode=None)
+        if retcode != 0:
+            return None
+
+        digest = hashlib.sha256()
+        digest.update(json.dumps(compilation).encode("utf-8"))
+        digest.update(stdout.encode("utf-8", "replace"))
+        key = digest.hexdigest()
+        __store_manifest(manifest_f, depfile_f, key)
+    finally:
+        os.unlink(depfile_f)
+    return CacheEntry(os.path.join(cache_dir, key[:2], key), output)
+
+
+class CacheEntry(object):
+    """A single compilation inside the cache."""
+
+    RESULT_F = "result.json"
+    OBJECT_F = "object"
+
+    def __init__(self, path, output):
+        self.path = path
+        self.output = output
+
+    def hit(self):
+        """Check, if this compilation is stored in the cache."""
+        return os.path.exists(os.path.join(self.path, self.RESULT_F))
+
+    def restore(self):
+        """
+        Restore the object file of this compilation.
+
+        Returns (tuple(int, str, str)):
+            Exit code, stdout and stderr of the cached compilation.
+        """
+        shutil.copyfile(os.path.join(self.path, self.OBJECT_F), self.output)
+        with open(os.path.join(self.path, self.RESULT_F), 'r') as result_f:
+            result = json.load(result_f)
+        return (0, result["stdout"], result["stderr"])
+
+    def store(self, stdout, stderr):
+        """
+        Store the object file of a successful compilation.
+
+        The entry is prepared in a private directory and renamed into place.
+        If another compiler call stored the same entry in the meantime, we
+        keep theirs.
+        """
+        if not os.path.exists(self.output):
+            return
+        tmp_path = "{0}.{1}.tmp".format(self.path, os.getpid())
+        os.makedirs(tmp_path, exist_ok=True)
+        shutil.copyfile(self.output, os.path.join(tmp_path, self.OBJECT_F))
+        with open(os.path.join(tmp_path, self.RESULT_F), 'w') as result_f:
+            json.dump({"stdout": stdout, "stderr": stderr}, result_f)
+        try:
+            os.rename(tmp_path, self.path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def records(self):
+        """
+        Get the recorded compiler calls of extensions.
+
+        Returns (list(tuple(list(str), str))):
+            The additional arguments of each call and the directory of its
+            record.
+        """
+        records = []
+        if not os.path.isdir(self.path):
+            return records
+        for name in sorted(os.listdir(self.path)):
+            record_d = os.path.join(self.path, name)
+            try:
+                with open(os.path.join(record_d, "args.json"), 'r') as args:
+                    records.append((json.load(args), record_d))
+            except (OSError, ValueError):
+                continue
+        return records
+
+    def command(self, cmd):
+        """
+        Route the compiler command :cmd: of an extension through the cache.
+
+        Additional arguments the extension adds to the returned command
+        select the record that is replayed. If there is no record for them,
+        the command is executed and recorded by :func:`execute`.
+        """
+        from plumbum import local
+
+        argv = cmd.formulate()
+        replay = local["/bin/sh"]["-c", replay_script(self.records()),
+                                  "replay", self.path, str(len(argv)), argv]
+        return replay.with_env(**bound_env(cmd))
+
+
+def replay_script(records):
+    """
+    Write a shell script that replays the recorded compiler calls.
+
+    The script gets the path of the cache entry, the number of arguments
+    of the base command and the full command (with the additional arguments
+    of the extension) as its arguments.
+
+    Args:
+        records: The records of an entry, see :meth:`CacheEntry.records`.
+
+    Returns (str):
+        The shell script.
+    """
+    from shlex import quote
+
+    lines = [
+        'entry=$1; base=$2; shift 2', 'i=0; extra=""', 'for arg in "$@"; do',
+        '  i=$((i + 1))', '  if [ "$i" -gt "$base" ]; then',
+        '    extra="$extra$arg', '"', '  fi', 'done', 'case "$extra" in'
+    ]
+    for args, record_d in records:
+        with open(os.path.join(record_d, "retcode"), 'r') as retcode:
+            retcode = int(retcode.read().strip() or 1)
+        lines.append("{0}) cat {1}; cat {2} >&2; exit {3};;".format(
+            quote("".join(arg + "\n" for arg in args)),
+            quote(os.path.join(record_d, "stdout")),
+            quote(os.path.join(record_d, "stderr")), retcode))
+    lines.extend([
+        'esac', 'exec {0} -m {1} "$entry" "$base" "$@"'.format(
+            quote(sys.executable), __name__)
+    ])
+    return "\n".join(lines) + "\n"
+
+
+def execute(entry_path, base, argv):
+    """
+    Execute and record the compiler call of an extension.
+
+    Args:
+        entry_path (str): Path of the cache entry.
+        base (int): Number of arguments in argv that belong to the command
+            we handed to the extension.
+        argv (list(str)): The full command the extension executes.
+
+    Returns (int):
+        Exit code of the command.
+    """
+    import subprocess
+
+    proc = subprocess.run(argv,
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE)
+    if os.path.isdir(entry_path):
+        extra = json.dumps(argv[base:])
+        record_d = os.path.join(entry_path, "ext-{0}".format(
+            hashlib.sha1(extra.encode("utf-8")).hexdigest()))
+        tmp_d = "{0}.{1}.tmp".format(record_d, os.getpid())
+        os.makedirs(tmp_d, exist_ok=True)
+        with open(os.path.join(tmp_d, "stdout"), 'wb') as stdout:
+            stdout.write(proc.stdout)
+        with open(os.path.join(tmp_d, "stderr"), 'wb') as stderr:
+            stderr.write(proc.stderr)
+        with open(os.path.join(tmp_d, "retcode"), 'w') as retcode:
+            retcode.write(str(proc.returncode))
+        with open(os.path.join(tmp_d, "args.json"), 'w') as args:
+            args.write(extra)
+        try:
+            os.rename(tmp_d, record_d)
+        except OSError:
+            shutil.rmtree(tmp_d, ignore_errors=True)
+
+    sys.stdout.buffer.write(proc.stdout)
+    sys.stderr.buffer.write(proc.stderr)
+    return proc.returncode
+
+
+if __name__ == "__main__":
+    sys.exit(execute(sys.argv[1], int(sys.argv[2]), sys.argv[3:]))
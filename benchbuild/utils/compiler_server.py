@@ -0,0 +1,476 @@
+"""
+A long-lived compile server for the compiler wrappers.
+
+Every call of a wrapped compiler (see :func:`print_libtool_sucks_wrapper`)
+used to start a fresh python interpreter that imports benchbuild, evaluates
+the configuration and unpickles the compiler and the compiler extension.
+For large projects this startup cost dominates the build.
+
+With BB_COMPILER_SERVER enabled, the wrapper is a tiny client that connects
+to a compile server via a unix socket. The server holds the deserialized
+compiler, the hidden flags and the compiler extension and executes the
+compile requests in a pool of forked workers. The client starts the server
+on demand and the server terminates itself after being idle for
+BB_COMPILER_SERVER_IDLE seconds.
+
+Messages are JSON objects, prefixed with their length as a 4 byte unsigned
+integer in network byte order. A client sends exactly one request:
+
+    {"argv": [...], "cwd": "...", "env": {...}}
+
+and receives zero or more {"stdout": ...}/{"stderr": ...} frames followed
+by a final {"retcode": ...} frame.
+
+Sockets and locks live in BB_TMP_DIR/cc-server-<uid>, a directory only the
+current user may enter (see :func:`server_dir`). Clients and servers refuse
+to use a directory that is accessible to anyone else.
+"""
+import json
+import logging
+import os
+import socket
+import stat
+import struct
+import sys
+import threading
+
+__HEADER = struct.Struct("!I")
+__COMPILER = None
+
+MAX_SOCKET_PATH = 107
+"""The longest path a unix socket may have (sun_path, without NUL)."""
+
+SOCKET_NAME_LEN = len("0123456789abcdef.sock.lock")
+
+
+def is_private(path):
+    """
+    Check, if only the current user may access the directory :path:.
+
+    >>> is_private("/")
+    False
+    """
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid() and \
+        not info.st_mode & 0o077
+
+
+def server_dir():
+    """
+    Get the directory for the sockets and locks of our compile servers.
+
+    The directory is created with mode 0700, if it does not exist.
+
+    Returns (str):
+        Path to BB_TMP_DIR/cc-server-<uid>, None if it cannot be used
+        safely.
+    """
+    from benchbuild.settings import CFG
+
+    log = logging.getLogger(__name__)
+    tmp_dir = os.path.abspath(str(CFG["tmp_dir"]))
+    path = os.path.join(tmp_dir, "cc-server-{0}".format(os.getuid()))
+    if len(path) + 1 + SOCKET_NAME_LEN > MAX_SOCKET_PATH:
+        log.warning("%s is too long for a unix socket.", path)
+        return None
+
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    if not is_private(path):
+        log.warning("%s is not private to the current user.", path)
+        return None
+    return path
+
+
+def bound_env(cmd):
+    """
+    Get the environment variables bound to the plumbum command :cmd:.
+
+    plumbum 1.x calls them 'envvars', newer versions 'env'.
+    """
+    env = getattr(cmd, "envvars", None)
+    if env is None:
+        env = getattr(cmd, "env", None)
+    return dict(env or {})
+
+
+def invoke(cc, cflags, ldflags, func, argv, has_stdin=False,
+           cache_dir=None):
+    """
+    Execute a single call of a wrapped compiler.
+
+    The hidden cflags and ldflags are only passed to the compiler, if there
+    are input files. If the compilation fails with our flags, we retry
+    without them. autoconf's conftest programs are compiled as-is.
+
+    Args:
+        cc (plumbum.cmd): The real compiler.
+        cflags (list(str)): The CFLAGS we want to hide.
+        ldflags (list(str)): The LDFLAGS we want to hide.
+        func: The compiler extension that gets called after a successful
+            compilation, or None.
+        argv (list(str)): The arguments given to the wrapper.
+        has_stdin (bool): Signals whether the extension should take care of
+            stdin.
+        cache_dir (str): Root of the compilation result cache, or None.
+            See benchbuild.utils.compiler_cache.
+
+    Returns (tuple(int, str, str)):
+        Exit code, stdout and stderr of the compiler.
+    """
+    from plumbum import ProcessExecutionError
+    from plumbum.cmd import timeout
+
+    def run(cmd, retcode=0):
+        fc = timeout["2m", cmd]
+        fc = fc.with_env(**bound_env(cmd))
+        return fc.run(retcode=retcode)
+
+    input_files = [x for x in argv if x and x[0] != '-']
+    if 'conftest.c' in input_files:
+        return cc[argv].run(retcode=None)
+
+    if len(input_files) > 0:
+        fc = cc["-Qunused-arguments", cflags, ldflags, argv]
+    else:
+        fc = cc["-Qunused-arguments", argv]
+    fc = fc.with_env(**bound_env(cc))
+
+    entry = None
+    if cache_dir is not None:
+        from benchbuild.utils import compiler_cache
+        entry = compiler_cache.lookup(cache_dir, cc, cflags, ldflags, argv)
+        if entry is not None and entry.hit():
+            result = entry.restore()
+            if func is not None:
+                func(entry.command(fc), has_stdin=has_stdin)
+            return result
+
+    try:
+        retcode, stdout, stderr = run(fc)
+        if entry is not None:
+            entry.store(stdout, stderr)
+        if func is not None:
+            ext_cc = fc if entry is None else entry.command(fc)
+            func(ext_cc, has_stdin=has_stdin)
+        return (retcode, stdout, stderr)
+    except ProcessExecutionError:
+        fc = cc["-Qunused-arguments", argv]
+        fc = fc.with_env(**bound_env(cc))
+        return run(fc, retcode=None)
+
+
+def send(conn, message):
+    """Send a single message over the socket :conn:."""
+    data = json.dumps(message).encode("utf-8")
+    conn.sendall(__HEADER.pack(len(data)) + data)
+
+
+def __recv_exactly(conn, size):
+    data = b""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def receive(conn):
+    """
+    Receive a single message from the socket :conn:.
+
+    Returns:
+        The decoded message, or None if the peer closed the connection.
+    """
+    header = __recv_exactly(conn, __HEADER.size)
+    if header is None:
+        return None
+    data = __recv_exactly(conn, __HEADER.unpack(header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+
+def _compile(argv, cwd, env):
+    """Execute a compile request inside a worker of the pool."""
+    import traceback
+    from plumbum import local
+
+    cc, cflags, ldflags, func, cache_dir = __COMPILER
+    os.environ.clear()
+    os.environ.update(env)
+    try:
+        with local.env():
+            local.env.clear()
+            local.env.update(**env)
+            with local.cwd(cwd):
+                return invoke(cc, cflags, ldflags, func, argv,
+                              cache_dir=cache_dir)
+    except Exception:  # pylint: disable=broad-except
+        return (1, "", traceback.format_exc())
+    finally:
+        # Workers of the pool leave without running atexit handlers.
+        db = sys.modules.get("benchbuild.utils.db")
+        if db is not None:
+            db.flush()
+
+
+class Activity(object):
+    """Count the requests a server is working on."""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__active = 0
+
+    def __enter__(self):
+        with self.__lock:
+            self.__active += 1
+
+    def __exit__(self, *args):
+        with self.__lock:
+            self.__active -= 1
+
+    def idle(self):
+        with self.__lock:
+            return self.__active == 0
+
+
+def _handle(conn, pool, activity):
+    log = logging.getLogger(__name__)
+    with activity:
+        try:
+            request = receive(conn)
+            if request is None:
+                return
+            retcode, stdout, stderr = pool.apply(
+                _compile, (request["argv"], request["cwd"], request["env"]))
+            if stdout:
+                send(conn, {"stdout": stdout})
+            if stderr:
+                send(conn, {"stderr": stderr})
+            send(conn, {"retcode": retcode})
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Compile request failed")
+        finally:
+            conn.close()
+
+
+def serve(config_f):
+    """
+    Serve compile requests for a single compiler wrapper.
+
+    Only one server may listen on a socket. If another server holds the lock
+    of our socket already, we exit immediately.
+
+    Args:
+        config_f (str): Path to the JSON configuration written by
+            :func:`print_libtool_sucks_wrapper`.
+
+    Returns (int):
+        Exit code of the server.
+    """
+    import fcntl
+    import multiprocessing
+    import dill
+    from benchbuild.utils import log
+
+    global __COMPILER
+
+    with open(config_f, 'r') as config_file:
+        config = json.load(config_file)
+
+    if config["config_file"]:
+        os.environ["BB_CONFIG_FILE"] = config["config_file"]
+    from benchbuild.settings import CFG
+    for section in ["db", "spool"]:
+        for key, value in config[section].items():
+            CFG[section][key] = value
+
+    log.configure()
+    logger = logging.getLogger(__name__)
+
+    sock_path = config["socket"]
+    if not is_private(os.path.dirname(sock_path)):
+        logger.error("Refusing to serve from %s, it is not private.",
+                     os.path.dirname(sock_path))
+        return 1
+    lock_f = open(sock_path + ".lock", 'w')
+    try:
+        fcntl.flock(lock_f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_f.close()
+        return 0
+
+    with open(config["cc_f"], 'rb') as cc_f:
+        compiler = dill.load(cc_f)
+    func = None
+    if os.path.exists(config["blob_f"]):
+        with open(config["blob_f"], 'rb') as blob_f:
+            func = dill.load(blob_f)
+    __COMPILER = (compiler, config["cflags"], config["ldflags"], func,
+                  config["cache_dir"])
+
+    # We hold the lock, any socket we find belongs to a dead server.
+    if os.path.exists(sock_path):
+        os.unlink(sock_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(sock_path)
+    os.chmod(sock_path, 0o600)
+    server.listen(128)
+    server.settimeout(float(CFG["compiler"]["server_idle"].value()))
+
+    pool = multiprocessing.get_context("fork").Pool(int(CFG["jobs"].value()))
+    activity = Activity()
+    logger.info("Compile server listening on %s", sock_path)
+    try:
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                if activity.idle():
+                    break
+                continue
+            conn.settimeout(None)
+            threading.Thread(target=_handle,
+                             args=(conn, pool, activity),
+                             daemon=True).start()
+    finally:
+        server.close()
+        os.unlink(sock_path)
+        pool.terminate()
+        lock_f.close()
+    return 0
+
+
+def print_client(filepath, config_f, sock_path, fallback):
+    """
+    Write the client script of a compiler wrapper.
+
+    The client only depends on the python standard library and skips the
+    site initialization of the interpreter. Compiles reading from stdin and
+    compiles the server could not answer are handed to the :fallback:
+    wrapper.
+
+    Args:
+        filepath (str): Path to the client script.
+        config_f (str): Path to the configuration of the compile server.
+        sock_path (str): Path to the unix socket of the compile server.
+        fallback (str): Path to the self-contained wrapper script.
+    """
+    from plumbum.cmd import chmod
+
+    with open(filepath, 'w') as client:
+        client.write("""#!{python} -S
+import json
+import os
+import socket
+import struct
+import sys
+import time
+
+CONFIG_F = "{config_f}"
+SOCKET = "{sock_path}"
+FALLBACK = "{fallback}"
+HEADER = struct.Struct("!I")
+
+
+def fallback():
+    os.execv(FALLBACK, [FALLBACK] + sys.argv[1:])
+
+
+def private():
+    try:
+        info = os.lstat(os.path.dirname(SOCKET))
+    except OSError:
+        return False
+    return info.st_uid == os.getuid() and not info.st_mode & 0o077
+
+
+def connect():
+    try:
+        if os.lstat(SOCKET).st_uid != os.getuid():
+            return None
+    except OSError:
+        return None
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(SOCKET)
+    except OSError:
+        conn.close()
+        return None
+    return conn
+
+
+def start_server():
+    import subprocess
+    with open(CONFIG_F + ".log", "ab") as log:
+        subprocess.Popen(
+            [sys.executable, "-m", "benchbuild.utils.compiler_server",
+             CONFIG_F],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+            start_new_session=True)
+    for _ in range(200):
+        time.sleep(0.05)
+        conn = connect()
+        if conn is not None:
+            return conn
+    return None
+
+
+def receive(conn):
+    data = b""
+    size = None
+    while True:
+        want = HEADER.size if size is None else size
+        while len(data) < want:
+            chunk = conn.recv(65536)
+            if not chunk:
+                return
+            data += chunk
+        if size is None:
+            size = HEADER.unpack(data[:HEADER.size])[0]
+            data = data[HEADER.size:]
+        else:
+            yield json.loads(data[:size].decode("utf-8"))
+            data = data[size:]
+            size = None
+
+
+def main():
+    if "-" in sys.argv[1:] or not private():
+        fallback()
+    conn = connect() or start_server()
+    if conn is None:
+        fallback()
+    request = {{"argv": sys.argv[1:], "cwd": os.getcwd(),
+               "env": dict(os.environ)}}
+    data = json.dumps(request).encode("utf-8")
+    conn.sendall(HEADER.pack(len(data)) + data)
+    for message in receive(conn):
+        if "stdout" in message:
+            sys.stdout.write(message["stdout"])
+        if "stderr" in message:
+            sys.stderr.write(message["stderr"])
+        if "retcode" in message:
+            return message["retcode"]
+    fallback()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+""".format(python=sys.executable,
+           config_f=config_f,
+           sock_path=sock_path,
+           fallback=fallback))
+    chmod("+x", filepath)
+
+
+if __name__ == "__main__":
+    sys.exit(serve(sys.argv[1]))
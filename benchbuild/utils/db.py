@@ -1,9 +1,206 @@
 """Database support module for the benchbuild study."""
+import atexit
 import logging
+import os
+import time
+import uuid
 from benchbuild.settings import CFG
+from benchbuild.utils import spool
 
 logger = logging.getLogger(__name__)
 
+
+class WriteBuffer(object):
+    """
+    Accumulate measurement rows and insert them in bulk.
+
+    Rows are grouped by table and by the set of columns they provide. Each
+    group is written with a single multi-row INSERT ... VALUES statement.
+    Columnar batches (see add_columns) are written with executemany.
+    The buffer is flushed when it holds BB_DB_BATCH_SIZE rows, when
+    BB_DB_BATCH_INTERVAL seconds passed since the last flush, at the end of
+    a run group and at exit.
+
+    A forked child inherits the rows of its parent. The parent writes them,
+    so the child drops them before it adds rows of its own.
+    """
+
+    MAX_ROWS_PER_STATEMENT = 1000
+    MAX_EXECUTEMANY = 10000
+
+    def __init__(self):
+        self.__rows = {}
+        self.__columns = []
+        self.__count = 0
+        self.__last_flush = time.time()
+        self.__pid = os.getpid()
+
+    def __own(self):
+        if self.__pid != os.getpid():
+            self.__rows = {}
+            self.__columns = []
+            self.__count = 0
+            self.__last_flush = time.time()
+            self.__pid = os.getpid()
+
+    def add(self, obj):
+        """
+        Buffer a new row.
+
+        Args:
+            obj: An instance of one of our schema classes.
+        """
+        self.__own()
+        table = obj.__table__
+        row = spool.values(obj)
+        key = (table, tuple(sorted(row.keys())))
+        self.__rows.setdefault(key, []).append(row)
+        self.__count += 1
+        self.__check()
+
+    def add_columns(self, table, columns, **constants):
+        """
+        Buffer many rows of the same table, column by column.
+
+        The rows are inserted straight from the columns with executemany,
+        instead of one dict per row.
+
+        Args:
+            table: The table, e.g., schema.Likwid.__table__.
+            columns (dict): Column name to the values of all rows, e.g.,
+                an array. All columns have the same length.
+            **constants: Column name to the value of all rows, e.g., run_id.
+        """
+        self.__own()
+        count = min(len(values) for values in columns.values())
+        if not count:
+            return
+        self.__columns.append((table, columns, constants))
+        self.__count += count
+        self.__check()
+
+    def __check(self):
+        size = int(CFG["db"]["batch_size"].value())
+        interval = float(CFG["db"]["batch_interval"].value())
+        if self.__count >= size or \
+           time.time() - self.__last_flush >= interval:
+            self.flush()
+
+    def flush(self):
+        """Insert all buffered rows in a single transaction."""
+        self.__own()
+        self.__last_flush = time.time()
+        if not self.__count:
+            return
+
+        from benchbuild.utils import schema
+        rows, self.__rows, self.__count = self.__rows, {}, 0
+        columns, self.__columns = self.__columns, []
+        if spool.enabled():
+            for table, table_columns, constants in columns:
+                names, values = self.__column_rows(table_columns, constants)
+                rows.setdefault((table, tuple(sorted(names))), []).extend(
+                    dict(zip(names, row)) for row in values)
+            for (table, _), table_rows in rows.items():
+                spool.append({"t": "rows",
+                              "id": uuid.uuid4().hex,
+                              "table": table.name,
+                              "rows": table_rows})
+            return
+
+        from benchbuild.utils import interning
+
+        session = schema.Session()
+        try:
+            for (table, _), table_rows in rows.items():
+                if interning.is_logical(table.name):
+                    interning.insert(session, table.name, table_rows)
+                    continue
+                chunk = self.MAX_ROWS_PER_STATEMENT
+                for i in range(0, len(table_rows), chunk):
+                    session.execute(table.insert().values(
+                        table_rows[i:i + chunk]))
+            for table, table_columns, constants in columns:
+                self.__insert_columns(session, table, table_columns,
+                                      constants)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    @staticmethod
+    def __column_rows(columns, constants):
+        """The column names and an iterator over the rows of a batch."""
+        import itertools
+
+        names = list(columns) + list(constants)
+        values = [columns[name] for name in columns] + \
+            [itertools.repeat(constants[name]) for name in constants]
+        return names, zip(*values)
+
+    def __insert_columns(self, session, table, columns, constants):
+        """
+        Insert a batch of :meth:`add_columns` with executemany.
+
+        The tuples of the zipped columns go straight to the DBAPI cursor.
+        Drivers with a named parameter style get dicts instead.
+        """
+        import itertools
+
+        names, values = self.__column_rows(columns, constants)
+        connection = session.connection()
+        dialect = connection.dialect
+        marker = {
+            "qmark": "?",
+            "format": "%s",
+            "pyformat": "%s"
+        }.get(dialect.paramstyle)
+        if marker is None:
+            session.execute(table.insert(),
+                            [dict(zip(names, row)) for row in values])
+            return
+
+        preparer = dialect.identifier_preparer
+        sql = "INSERT INTO {0} ({1}) VALUES ({2})".format(
+            preparer.format_table(table),
+            ", ".join(preparer.format_column(table.c[name])
+                      for name in names),
+            ", ".join([marker] * len(names)))
+        while True:
+            chunk = list(itertools.islice(values, self.MAX_EXECUTEMANY))
+            if not chunk:
+                break
+            connection.execute(sql, chunk)
+
+
+BUFFER = WriteBuffer()
+"""Write-behind buffer for all measurement rows of this process."""
+
+
+def flush():
+    """Write all buffered measurement rows to the database."""
+    BUFFER.flush()
+
+
+atexit.register(flush)
+
+
+def open_session():
+    """
+    Open a new session for run & measurement bookkeeping.
+
+    Returns:
+        A database session, or a session on the spool of this node, if
+        BB_SPOOL_ENABLE is set.
+    """
+    if spool.enabled():
+        return spool.Session()
+
+    from benchbuild.utils import schema
+    return schema.Session()
+
 def create_run(cmd, prj, exp, grp):
     """
     Create a new 'run' in the database.
@@ -25,7 +222,7 @@ def create_run(cmd, prj, exp, grp):
     """
     from benchbuild.utils import schema as s
 
-    session = s.Session()
+    session = open_session()
     run = s.Run(command=str(cmd),
                 project_name=prj,
                 experiment_name=exp,
@@ -55,7 +252,7 @@ def create_run_group(prj):
     """
     from benchbuild.utils import schema
 
-    session = schema.Session()
+    session = open_session()
     group = schema.RunGroup(id=prj.run_uuid,
                             project=prj.name,
                             experiment=str(CFG["experiment_id"]))
@@ -73,8 +270,6 @@ def persist_project(project):
         project: The project we want to persist.
     """
     from benchbuild.utils.schema import Project, Session
-    session = Session()
-    projects = session.query(Project).filter(Project.name == project.name)
 
     name = project.name
     desc = project.__doc__
@@ -86,6 +281,19 @@ def persist_project(project):
     except AttributeError:
         src_url = 'unknown'
 
+    if spool.enabled():
+        session = spool.Session()
+        newp = Project(name=name,
+                       description=desc,
+                       src_url=src_url,
+                       domain=domain,
+                       group_name=group_name)
+        session.add(newp)
+        session.commit()
+        return ([newp], session)
+
+    session = Session()
+    projects = session.query(Project).filter(Project.name == project.name)
     if projects.count() == 0:
         newp = Project()
         newp.name = name
@@ -119,13 +327,21 @@ def persist_experiment(experiment):
     """
     from benchbuild.utils.schema import Experiment, Session
 
-    session = Session()
-
     cfg_exp = CFG['experiment_id'].value()
-    exps = session.query(Experiment).filter(Experiment.id == cfg_exp)
     desc = CFG["experiment_description"].value()
     name = experiment.name
 
+    if spool.enabled():
+        session = spool.Session()
+        newe = Experiment(id=cfg_exp, name=name)
+        if not CFG["resume"].value():
+            newe.description = desc
+        session.add(newe)
+        session.commit()
+        return (newe, session)
+
+    session = Session()
+    exps = session.query(Experiment).filter(Experiment.id == cfg_exp)
     if exps.count() == 0:
         newe = Experiment()
         newe.id = cfg_exp
@@ -135,7 +351,10 @@ def persist_experiment(experiment):
         ret = newe
         logger.debug("New experiment: %s", newe)
     else:
-        exps.update({'name': name, 'description': desc})
+        if CFG["resume"].value():
+            exps.update({'name': name})
+        else:
+            exps.update({'name': name, 'description': desc})
         logger.debug("Update experiments: %s", exps)
         ret = exps.first()
     session.commit()
@@ -149,19 +368,22 @@ def persist_likwid(run, session, measurements):
 
     Args:
         run: The run we attach our measurements to.
-        session: The db transaction we belong to.
-        measurements: The likwid measurements we want to store.
+        session: The db transaction we belong to. The rows are written by
+            the write-behind buffer instead.
+        measurements: The likwid measurements we want to store, e.g.,
+            benchbuild.likwid.LikwidColumns, or any iterable of
+            (region, metric, core, value) tuples.
     """
+    from benchbuild.likwid import LikwidColumns
     from benchbuild.utils import schema as s
 
-    for (region, name, core, value) in measurements:
-        db_measurement = s.Likwid(metric=name,
-                                  region=region,
-                                  value=value,
-                                  core=core,
-                                  run_id=run.id)
-        session.add(db_measurement)
-    session.commit()
+    if not isinstance(measurements, LikwidColumns):
+        columns = LikwidColumns()
+        for measurement in measurements:
+            columns.append(*measurement)
+        measurements = columns
+    BUFFER.add_columns(s.Likwid.__table__, measurements.columns(),
+                       run_id=run.id)
 
 
 def persist_time(run, session, timings):
@@ -170,44 +392,56 @@ def persist_time(run, session, timings):
 
     Args:
         run: The run we attach this timing results to.
-        session: The db transaction we belong to.
+        session: The db transaction we belong to. The rows are written by
+            the write-behind buffer instead.
         timings: The timing measurements we want to store.
     """
     from benchbuild.utils import schema as s
 
     for timing in timings:
-        session.add(s.Metric(name="time.user_s",
-                             value=timing[0],
-                             run_id=run.id))
-        session.add(s.Metric(name="time.system_s",
-                             value=timing[1],
-                             run_id=run.id))
-        session.add(s.Metric(name="time.real_s",
-                             value=timing[2],
-                             run_id=run.id))
-    session.commit()
-
+        BUFFER.add(s.Metric(name="time.user_s",
+                            value=timing[0],
+                            run_id=run.id))
+        BUFFER.add(s.Metric(name="time.system_s",
+                            value=timing[1],
+                            run_id=run.id))
+        BUFFER.add(s.Metric(name="time.real_s",
+                            value=timing[2],
+                            run_id=run.id))
+
+
+def persist_metrics(run, session, metrics):
+    """
+    Persist named metrics, e.g., summary statistics.
 
-def persist_perf(run, session, svg_path):
+    Args:
+        run: The run we attach the metrics to.
+        session: The db transaction we belong to. The rows are written by
+            the write-behind buffer instead.
+        metrics (dict): Metric name to value.
     """
-    Persist the flamegraph in the database.
+    from benchbuild.utils import schema as s
 
-    The flamegraph exists as a SVG image on disk until we persist it in the
-    database.
+    for name in metrics:
+        BUFFER.add(s.Metric(name=name, value=metrics[name], run_id=run.id))
+
+
+def persist_folded(run, session, profile):
+    """
+    Persist the sampled call stacks of a run.
 
     Args:
-        run: The run we attach these perf measurements to.
-        session: The db transaction we belong to.
-        svg_path: The path to the SVG file we want to store.
+        run: The run we attach the profile to.
+        session: The db transaction we belong to. The rows are written by
+            the write-behind buffer instead.
+        profile (benchbuild.utils.folded.FoldedProfile): The profile.
     """
     from benchbuild.utils import schema as s
 
-    with open(svg_path, 'r') as svg_file:
-        svg_data = svg_file.read()
-        session.add(s.Metadata(name="perf.flamegraph",
-                               value=svg_data,
-                               run_id=run.id))
-    session.commit()
+    BUFFER.add(s.FoldedStacks(run_id=run.id,
+                              frames=len(profile.frames),
+                              samples=profile.samples,
+                              data=profile.encode()))
 
 
 def persist_compilestats(run, session, stats):
@@ -216,13 +450,13 @@ def persist_compilestats(run, session, stats):
 
     Args:
         run: The run we attach the compilestats to.
-        session: The db transaction we belong to.
+        session: The db transaction we belong to. The rows are written by
+            the write-behind buffer instead.
         stats: The stats we want to store in the database.
     """
     for stat in stats:
         stat.run_id = run.id
-        session.add(stat)
-    session.commit()
+        BUFFER.add(stat)
 
 
 def persist_config(run, session, cfg):
@@ -231,13 +465,13 @@ def persist_config(run, session, cfg):
 
     Args:
         run: The run we attach the config to.
-        session: The db transaction we belong to.
+        session: The db transaction we belong to. The rows are written by
+            the write-behind buffer instead.
         cfg: The configuration we want to persist.
     """
     from benchbuild.utils import schema as s
 
     for cfg_elem in cfg:
-        session.add(s.Config(name=cfg_elem,
-                             value=cfg[cfg_elem],
-                             run_id=run.id))
-    session.commit()
+        BUFFER.add(s.Config(name=cfg_elem,
+                            value=cfg[cfg_elem],
+                            run_id=run.id))
@@ -9,14 +9,31 @@ in BB_TMP_DIR, nothing will be downloaded at all.
 
 Supported methods:
         Copy, CopyNoFail, Wget, Git, Svn, Rsync
+
+Cached downloads are copied into the build directory, or hard linked from
+a content-addressed store (see materialize).
+
+Before we go to the network, we look for missing cache entries in the local
+mirrors (BB_DOWNLOAD_MIRRORS) and offline bundles (BB_DOWNLOAD_BUNDLES) we
+know about (see fetch_local).
 """
 from benchbuild.settings import CFG
 
 
+MANIFEST_EXT = ".manifest"
+"""Extension of the manifest that belongs to a cache entry."""
+
+BLOCK_SIZE = 1 << 20
+"""We read files in blocks of this size for hashing."""
+
+
 def get_hash_of_dirs(directory):
     """
     Recursively hash the contents of the given directory.
 
+    This is the hash of cache entries that have been created before we kept
+    a manifest for them.
+
     Args:
         directory (str): The root directory we want to hash.
 
@@ -33,15 +50,143 @@ def get_hash_of_dirs(directory):
         for names in files:
             filepath = os.path.join(root, names)
             with open(filepath, 'rb') as next_file:
-                for line in next_file:
-                    sha.update(line)
+                for block in iter(lambda: next_file.read(BLOCK_SIZE), b''):
+                    sha.update(block)
+    return sha.hexdigest()
+
+
+def hash_file(filepath):
+    """
+    Hash the contents of a single file.
+
+    Symbolic links are not followed, we hash their target path instead.
+
+    Args:
+        filepath (str): The file we want to hash.
+
+    Returns (str):
+        The SHA-256 of the file.
+    """
+    import hashlib
+    import os
+
+    sha = hashlib.sha256()
+    if os.path.islink(filepath):
+        sha.update(os.readlink(filepath).encode("utf-8", "surrogateescape"))
+        return sha.hexdigest()
+
+    with open(filepath, 'rb') as next_file:
+        for block in iter(lambda: next_file.read(BLOCK_SIZE), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def __files(root):
+    """Yield (relative path, path) of all files in a cache entry."""
+    import os
+
+    if not os.path.isdir(root):
+        yield ("", root)
+        return
+    for dirpath, dirs, files in os.walk(root):
+        if os.path.basename(dirpath) == ".git" and "worktrees" in dirs:
+            # Worktrees of the entry register themselves here.
+            dirs.remove("worktrees")
+        for name in files:
+            filepath = os.path.join(dirpath, name)
+            yield (os.path.relpath(filepath, root), filepath)
+
+
+def build_manifest(root, known=None, rehash=False):
+    """
+    Describe all files of a cache entry.
+
+    Every file is described by [size, mtime, inode, hash]. We only hash files
+    whose metadata differs from the :known: description, unless we are asked
+    to :rehash: everything.
+
+    Args:
+        root (str): The cache entry, a file or a directory.
+        known (dict): A previous result of build_manifest for :root:.
+        rehash (bool): Ignore the hashes in :known:.
+
+    Returns (dict):
+        Relative path to file description.
+    """
+    import os
+
+    if known is None:
+        known = {}
+    manifest = {}
+    for relpath, filepath in __files(root):
+        stat = os.lstat(filepath)
+        meta = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        old = known.get(relpath)
+        if not rehash and old is not None and old[:3] == meta:
+            manifest[relpath] = old
+        else:
+            manifest[relpath] = meta + [hash_file(filepath)]
+    return manifest
+
+
+def manifest_digest(manifest):
+    """
+    Compute the hash of a cache entry from its manifest.
+
+    Args:
+        manifest (dict): The manifest of the cache entry.
+
+    Returns (str):
+        A hash over all paths and contents of the cache entry.
+    """
+    import hashlib
+
+    sha = hashlib.sha256()
+    for relpath in sorted(manifest):
+        sha.update("{0}\0{1}\n".format(relpath,
+                                        manifest[relpath][3]).encode("utf-8"))
     return sha.hexdigest()
 
 
+def load_manifest(src, root):
+    """
+    Load the manifest of a cache entry.
+
+    Returns (dict):
+        The manifest, or None if the entry has none.
+    """
+    import json
+    from os import path
+
+    manifest_f = path.join(root, src + MANIFEST_EXT)
+    if not path.exists(manifest_f):
+        return None
+    try:
+        with open(manifest_f, 'r') as manifest:
+            return json.load(manifest)
+    except ValueError:
+        return None
+
+
+def store_manifest(src, root, manifest):
+    """Store the manifest of a cache entry together with its hash."""
+    import json
+    from os import path
+
+    with open(path.join(root, src + MANIFEST_EXT), 'w') as manifest_f:
+        json.dump(manifest, manifest_f)
+    with open(path.join(root, src + ".hash"), 'w') as h_file:
+        h_file.write(manifest_digest(manifest))
+
+
 def source_required(src_file, src_root):
     """
     Check, if a download is required.
 
+    The cached entry is verified against its manifest. Only files whose
+    size, mtime or inode changed are hashed again. With BB_DOWNLOAD_VERIFY
+    every file is hashed.
+
     Args:
         src_file: The filename to check for.
         src_root: The path we find the file in.
@@ -57,14 +202,23 @@ def source_required(src_file, src_root):
 
     required = True
     if path.exists(src_dir) and path.exists(hash_file):
-        new_hash = get_hash_of_dirs(src_dir)
         with open(hash_file, 'r') as h_file:
             old_hash = h_file.readline()
-        required = not new_hash == old_hash
+        known = load_manifest(src_file, src_root)
+        if known is None:
+            required = not get_hash_of_dirs(src_dir) == old_hash
+            if not required:
+                update_hash(src_file, src_root)
+        else:
+            rehash = CFG["download"]["verify"].value()
+            manifest = build_manifest(src_dir, known, rehash)
+            required = not manifest_digest(manifest) == old_hash
+            if not required and manifest != known:
+                store_manifest(src_file, src_root, manifest)
         if required:
             from plumbum.cmd import rm
             rm("-r", src_dir)
-            rm(hash_file)
+            rm("-f", hash_file, path.join(src_root, src_file + MANIFEST_EXT))
     return required
 
 
@@ -78,11 +232,81 @@ def update_hash(src, root):
     """
     from os import path
 
-    hash_file = path.join(root, src + ".hash")
-    with open(hash_file, 'w') as h_file:
-        src_path = path.join(root, src)
-        new_hash = get_hash_of_dirs(src_path)
-        h_file.write(str(new_hash))
+    src_path = path.join(root, src)
+    store_manifest(src, root, build_manifest(src_path))
+
+
+def fetch_local(src, root):
+    """
+    Get a missing cache entry from a local mirror or bundle.
+
+    Mirrors are directories with the layout of BB_TMP_DIR, e.g., a shared
+    file system. Bundles are created with `benchbuild bundle create`.
+    Like entries of a bundle, a copy from a mirror is verified against the
+    hash of the mirror's entry before it is moved into place.
+
+    Args:
+        src (str): Name of the cache entry.
+        root (str): The cache directory.
+
+    Returns (bool):
+        True, if we found the entry locally.
+    """
+    from os import path
+    from benchbuild.utils import bundle
+
+    for mirror in CFG["download"]["mirrors"].value():
+        if fetch_mirror(src, root, mirror):
+            return True
+
+    for bundle_f in CFG["download"]["bundles"].value():
+        if path.exists(bundle_f) and bundle.extract(bundle_f, src, root):
+            return True
+    return False
+
+
+def fetch_mirror(src, root, mirror):
+    """
+    Copy a cache entry from a local mirror.
+
+    Args:
+        src (str): Name of the cache entry.
+        root (str): The cache directory.
+        mirror (str): A directory with the layout of BB_TMP_DIR.
+
+    Returns (bool):
+        True, if the mirror provided an intact copy of the entry.
+    """
+    import logging
+    import os
+    import shutil
+    import tempfile
+    from plumbum.cmd import cp
+
+    mirror_path = os.path.join(mirror, src)
+    hash_f = mirror_path + ".hash"
+    if not os.path.exists(mirror_path) or not os.path.exists(hash_f):
+        return False
+    with open(hash_f, 'r') as h_file:
+        expected = h_file.readline().strip()
+
+    tmp_root = tempfile.mkdtemp(prefix=".mirror.", dir=root)
+    try:
+        tmp_path = os.path.join(tmp_root, src)
+        cp("-a", mirror_path, tmp_path)
+        if os.path.exists(mirror_path + MANIFEST_EXT):
+            digest = manifest_digest(build_manifest(tmp_path))
+        else:
+            digest = get_hash_of_dirs(tmp_path)
+        if digest != expected:
+            logging.getLogger(__name__).error(
+                "%s does not match its hash, ignoring the mirror.",
+                mirror_path)
+            return False
+        os.rename(tmp_path, os.path.join(root, src))
+        return True
+    finally:
+        shutil.rmtree(tmp_root, ignore_errors=True)
 
 
 def Copy(From, To):
@@ -97,6 +321,155 @@ def Copy(From, To):
     cp("-ar", "--reflink=auto", From, To)
 
 
+def object_path(digest):
+    """
+    Get the path of an object in the content-addressed store.
+
+    Args:
+        digest (str): The SHA-256 of the object.
+    """
+    from os import path
+    return path.join(str(CFG["tmp_dir"]), ".objects", digest[:2], digest)
+
+
+def __object_intact(obj, digest, meta):
+    """
+    Check, if the object :obj: still has the content :digest:.
+
+    An object is read-only, but a build may make one of its links writable
+    and modify it in place. We only hash the object again, if it is
+    writable or its size or mtime differ from the manifest entry :meta:.
+    """
+    import os
+    import stat
+
+    info = os.stat(obj)
+    writable = stat.S_IMODE(info.st_mode) & \
+        (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+    if not writable and meta and \
+       [info.st_size, info.st_mtime_ns] == list(meta[:2]):
+        return True
+    if hash_file(obj) != digest:
+        return False
+    if writable:
+        os.chmod(obj, stat.S_IMODE(info.st_mode) & ~writable)
+    return True
+
+
+def store_object(filepath, digest, meta=None):
+    """
+    Put a file into the content-addressed store.
+
+    Objects are read-only copies of cache entries, a cache entry never
+    shares its inode with the store. An existing object is verified before
+    we hand it out again. If a build modified it through one of its links,
+    it is replaced by a fresh copy of :filepath:.
+
+    Args:
+        filepath (str): The file we want to store.
+        digest (str): The SHA-256 of the file.
+        meta (list): The manifest entry of :filepath:, see build_manifest.
+
+    Returns (str):
+        Path to the object.
+    """
+    import logging
+    import os
+    import shutil
+    import stat
+
+    obj = object_path(digest)
+    if os.path.exists(obj):
+        if __object_intact(obj, digest, meta):
+            return obj
+        logging.getLogger(__name__).warning(
+            "Object %s was modified, restoring it from %s.", obj, filepath)
+
+    os.makedirs(os.path.dirname(obj), exist_ok=True)
+    tmp_obj = "{0}.{1}.tmp".format(obj, os.getpid())
+    shutil.copy2(filepath, tmp_obj)
+    mode = stat.S_IMODE(os.stat(tmp_obj).st_mode)
+    os.chmod(tmp_obj, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+    os.replace(tmp_obj, obj)
+    return obj
+
+
+def __link_or_copy(obj, target):
+    import os
+    import shutil
+
+    if os.path.lexists(target):
+        os.unlink(target)
+    try:
+        os.link(obj, target)
+    except OSError:
+        # Different file system or too many links.
+        shutil.copy2(obj, target)
+
+
+def materialize(src, root, to="."):
+    """
+    Make a cached download available in the directory :to:.
+
+    With BB_DOWNLOAD_MATERIALIZE set to 'link', all files are hard links to
+    read-only objects of a content-addressed store in BB_TMP_DIR/.objects.
+    Build systems replace files they modify, which breaks the link and keeps
+    the store intact. Builds that write to a file in place fail, because it
+    is read-only; use 'copy' for those. If a build makes a file writable
+    and modifies it anyway, the object is restored from the cache entry
+    before it is linked again (see store_object).
+    Otherwise, or if the cache entry has no manifest, we copy (see Copy).
+
+    Args:
+        src (str): Name of the cache entry.
+        root (str): Directory of the cache entry.
+        to (str): The directory we materialize :src: in.
+    """
+    import os
+    import shutil
+
+    src_path = os.path.join(root, src)
+    manifest = None
+    if CFG["download"]["materialize"].value() == "link":
+        manifest = load_manifest(src, root)
+    if manifest is None:
+        Copy(src_path, to)
+        return
+
+    target = os.path.join(to, os.path.basename(src_path))
+    if not os.path.isdir(src_path):
+        __link_or_copy(
+            store_object(src_path, manifest[""][3], manifest[""]), target)
+        return
+
+    for relpath, filepath in __files(src_path):
+        tgt_path = os.path.join(target, relpath)
+        os.makedirs(os.path.dirname(tgt_path), exist_ok=True)
+        if os.path.islink(filepath):
+            if os.path.lexists(tgt_path):
+                os.unlink(tgt_path)
+            os.symlink(os.readlink(filepath), tgt_path)
+        elif relpath in manifest:
+            obj = store_object(filepath, manifest[relpath][3],
+                               manifest[relpath])
+            __link_or_copy(obj, tgt_path)
+        else:
+            # Never share an inode with the cache entry.
+            shutil.copy2(filepath, tgt_path)
+
+    # Empty directories and links to directories are no files.
+    for dirpath, dirs, _ in os.walk(src_path):
+        for name in dirs:
+            dir_path = os.path.join(dirpath, name)
+            tgt_path = os.path.join(target,
+                                    os.path.relpath(dir_path, src_path))
+            if os.path.islink(dir_path):
+                if not os.path.lexists(tgt_path):
+                    os.symlink(os.readlink(dir_path), tgt_path)
+            else:
+                os.makedirs(tgt_path, exist_ok=True)
+
+
 def CopyNoFail(src, root=None):
     """
     Just copy fName into the current working directory, if it exists.
@@ -122,7 +495,7 @@ def CopyNoFail(src, root=None):
     return False
 
 
-def Wget(src_url, tgt_name, tgt_root=None):
+def Wget(src_url, tgt_name, tgt_root=None, fetch_only=False):
     """
     Download url, if required.
 
@@ -131,6 +504,8 @@ def Wget(src_url, tgt_name, tgt_root=None):
         tgt_name (str): The filename we want to have on disk.
         tgt_root (str): The TARGET directory for the download.
             Defaults to ``CFG["tmpdir"]``.
+        fetch_only (bool): Only fetch into the cache, do not copy the
+            download into the current directory.
     """
     if tgt_root is None:
         tgt_root = CFG["tmp_dir"].value()
@@ -140,41 +515,135 @@ def Wget(src_url, tgt_name, tgt_root=None):
 
     src_path = path.join(tgt_root, tgt_name)
     if not source_required(tgt_name, tgt_root):
-        Copy(src_path, ".")
+        if not fetch_only:
+            materialize(tgt_name, tgt_root)
         return
 
-    wget(src_url, "-O", src_path)
+    if not fetch_local(tgt_name, tgt_root):
+        wget(src_url, "-O", src_path)
     update_hash(tgt_name, tgt_root)
-    Copy(src_path, ".")
+    if not fetch_only:
+        materialize(tgt_name, tgt_root)
+
+
+def git_fetch_commit(commit, remote="origin"):
+    """
+    Check out a single commit of the repository in the current directory.
+
+    We only fetch the commit itself. If the server does not allow us to
+    fetch unadvertised commits, we fall back to fetching the history.
+
+    Args:
+        commit (str): The full hash of the commit.
+        remote (str): The remote we fetch from.
+    """
+    from os import path
+    from plumbum import ProcessExecutionError
+    from plumbum.cmd import git
+
+    try:
+        git("fetch", "--depth", "1", remote, commit)
+    except ProcessExecutionError:
+        git_dir = git("rev-parse", "--git-dir").strip()
+        if path.exists(path.join(git_dir, "shallow")):
+            git("fetch", "--unshallow", remote)
+        else:
+            git("fetch", remote)
+    git("checkout", "--detach", commit)
+
 
+def __git_worktree(src, root, to="."):
+    """
+    Materialize a cached repository as a git worktree of the cache entry.
 
-def Git(src_url, tgt_name, tgt_root=None):
+    The worktree shares all objects with the cache entry, only the checkout
+    itself is written to the build directory. Sparse checkouts of the cache
+    entry stay sparse.
+    """
+    from os import path
+    from plumbum import local
+    from plumbum.cmd import git, rm
+
+    target = path.abspath(path.join(to, src))
+    if path.lexists(target):
+        rm("-rf", target)
+
+    with local.cwd(path.join(root, src)):
+        sparse = git("config", "--bool", "core.sparseCheckout", retcode=None)
+        paths = []
+        if sparse.strip() == "true":
+            paths = git("sparse-checkout", "list").split()
+        git("worktree", "prune")
+        git("worktree", "add", "--detach", "--no-checkout", target, "HEAD")
+
+    with local.cwd(target):
+        if paths:
+            git("sparse-checkout", "set", paths)
+        git("checkout", "--detach", "HEAD")
+
+
+def Git(src_url, tgt_name, tgt_root=None, fetch_only=False, commit=None,
+        sparse=None):
     """
     Get a shallow clone of the given respo
 
+    With BB_DOWNLOAD_GIT_REFERENCE set, objects are borrowed from this local
+    repository, if possible. With BB_DOWNLOAD_GIT_WORKTREE set, the clone is
+    materialized as a git worktree of the cache entry instead of a copy.
+
     Args:
         src_url (str): Git URL of the SOURCE repo.
         tgt_name (str): Name of the repo folder on disk.
         tgt_root (str): TARGET folder for the git repo.
             Defaults to ``CFG["tmpdir"]``
+        fetch_only (bool): Only fetch into the cache, do not copy the
+            download into the current directory.
+        commit (str): Pin the clone to this commit. Only the commit itself
+            is fetched, not the history leading to it.
+        sparse (list(str)): Only check out these directories of the repo.
+            The contents of all other directories are not fetched at all.
     """
     if tgt_root is None:
         tgt_root = CFG["tmp_dir"].value()
 
     from os import path
+    from plumbum import local
     from plumbum.cmd import git
 
+    def materialize_git():
+        if CFG["download"]["git_worktree"].value():
+            __git_worktree(tgt_name, tgt_root)
+        else:
+            materialize(tgt_name, tgt_root)
+
     src_dir = path.join(tgt_root, tgt_name)
     if not source_required(tgt_name, tgt_root):
-        Copy(src_dir, ".")
+        if not fetch_only:
+            materialize_git()
         return
 
-    git("clone", "--depth", "1", src_url, src_dir)
+    if not fetch_local(tgt_name, tgt_root):
+        clone = git["clone", "--depth", "1"]
+        reference = CFG["download"]["git_reference"].value()
+        if reference:
+            clone = clone["--reference-if-able", reference]
+        if commit or sparse:
+            clone = clone["--no-checkout", "--filter=blob:none"]
+        clone(src_url, src_dir)
+
+        with local.cwd(src_dir):
+            if sparse:
+                git("sparse-checkout", "set", sparse)
+            if commit:
+                git_fetch_commit(commit)
+            elif sparse:
+                git("checkout")
     update_hash(tgt_name, tgt_root)
-    Copy(src_dir, ".")
+    if not fetch_only:
+        materialize_git()
 
 
-def Svn(url, fname, to=None):
+def Svn(url, fname, to=None, fetch_only=False):
     """
     Checkout the SVN repo.
 
@@ -183,6 +652,8 @@ def Svn(url, fname, to=None):
         fname (str): The name of the repo on disk.
         to (str): The name of the TARGET folder on disk.
             Defaults to ``CFG["tmpdir"]``
+        fetch_only (bool): Only fetch into the cache, do not copy the
+            download into the current directory.
     """
     if to is None:
         to = CFG["tmp_dir"].value()
@@ -192,15 +663,18 @@ def Svn(url, fname, to=None):
 
     src_dir = path.join(to, fname)
     if not source_required(fname, to):
-        Copy(src_dir, ".")
+        if not fetch_only:
+            materialize(fname, to)
         return
 
-    svn("co", url, src_dir)
+    if not fetch_local(fname, to):
+        svn("co", url, src_dir)
     update_hash(fname, to)
-    Copy(src_dir, ".")
+    if not fetch_only:
+        materialize(fname, to)
 
 
-def Rsync(url, tgt_name, tgt_root=None):
+def Rsync(url, tgt_name, tgt_root=None, fetch_only=False):
     """
     RSync a folder.
 
@@ -209,6 +683,8 @@ def Rsync(url, tgt_name, tgt_root=None):
         fname (str): The name of the TARGET.
         to (str): Path of the target location.
             Defaults to ``CFG["tmpdir"]``.
+        fetch_only (bool): Only fetch into the cache, do not copy the
+            download into the current directory.
     """
     if tgt_root is None:
         tgt_root = CFG["tmp_dir"].value()
@@ -218,9 +694,58 @@ def Rsync(url, tgt_name, tgt_root=None):
 
     src_dir = path.join(tgt_root, tgt_name)
     if not source_required(tgt_name, tgt_root):
-        Copy(src_dir, ".")
+        if not fetch_only:
+            materialize(tgt_name, tgt_root)
         return
 
-    rsync("-a", url, src_dir)
+    if not fetch_local(tgt_name, tgt_root):
+        rsync("-a", url, src_dir)
     update_hash(tgt_name, tgt_root)
-    Copy(src_dir, ".")
+    if not fetch_only:
+        materialize(tgt_name, tgt_root)
+
+
+def prefetch(projects, jobs=None):
+    """
+    Fetch the sources of all projects into the cache.
+
+    All downloads are fetched concurrently by a bounded pool of workers.
+    Downloads shared by several projects are fetched only once. A failed
+    download is logged and left to the Download step of its project.
+
+    Args:
+        projects (list): The projects we want to fetch the sources of.
+        jobs (int): Number of concurrent downloads.
+            Defaults to ``CFG["download"]["jobs"]``.
+
+    Returns (int):
+        The number of downloads that failed.
+    """
+    import logging
+    from concurrent.futures import ThreadPoolExecutor
+
+    log = logging.getLogger(__name__)
+    if jobs is None:
+        jobs = int(CFG["download"]["jobs"].value())
+
+    targets = []
+    for project in projects:
+        for source in project.sources():
+            if source not in targets:
+                targets.append(source)
+    if not targets:
+        return 0
+
+    def fetch(source):
+        method, url, name = source
+        try:
+            method(url, name, fetch_only=True)
+            return True
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Prefetching %s failed", url)
+            return False
+
+    log.info("Prefetching %d downloads with %d workers", len(targets), jobs)
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        results = list(pool.map(fetch, targets))
+    return results.count(False)
@@ -0,0 +1,291 @@
+"""
+Folded stack profiles.
+
+The pj-perf experiment samples call stacks with ``perf record``. Instead of
+rendering a flame graph per run, we collapse the samples into folded stacks
+(as stackcollapse-perf.pl does) and store them compactly in the database:
+every frame name is stored once in a frame table, a stack is a list of
+indices into that table, and the whole profile is compressed.
+
+Profiles of many runs can be merged, e.g., all runs of a project with the
+same number of cores, and two profiles can be compared as input for a
+differential flame graph (``flamegraph.pl``/``difffolded.pl`` format)::
+
+    from benchbuild.utils import folded
+    base = folded.load(session, folded.select_runs(session, "pj-perf",
+                                                   "sqlite3", cores="1"))
+    other = folded.load(session, folded.select_runs(session, "pj-perf",
+                                                    "sqlite3", cores="8"))
+    with open("sqlite3.diff.folded", "w") as out:
+        out.writelines(folded.diff_lines(base, other))
+"""
+import json
+import os
+import re
+import zlib
+
+FORMAT = 1
+
+
+class FoldedProfile(object):
+    """
+    A set of call stacks with sample counts.
+
+    Frames are interned, stacks are tuples of frame indices, from the root
+    to the leaf.
+
+    >>> p = FoldedProfile()
+    >>> p.add(["main", "foo"], 3)
+    >>> p.add(["main", "bar"])
+    >>> p.add(["main", "foo"], 2)
+    >>> p.frames
+    ['main', 'foo', 'bar']
+    >>> list(p.lines())
+    ['main;bar 1\\n', 'main;foo 5\\n']
+    >>> p.samples
+    6
+    """
+
+    def __init__(self):
+        self.frames = []
+        self.stacks = {}
+        self.__index = {}
+
+    def intern(self, frame):
+        """The index of :frame: in the frame table."""
+        idx = self.__index.get(frame)
+        if idx is None:
+            idx = self.__index[frame] = len(self.frames)
+            self.frames.append(frame)
+        return idx
+
+    def add(self, frames, count=1):
+        """Add :count: samples of the stack :frames: (root first)."""
+        stack = tuple(self.intern(frame) for frame in frames)
+        self.stacks[stack] = self.stacks.get(stack, 0) + count
+
+    @property
+    def samples(self):
+        """The total number of samples."""
+        return sum(self.stacks.values())
+
+    def counts(self):
+        """
+        Sample counts by the folded stack string.
+
+        Returns (dict):
+            'root;...;leaf' to its count.
+        """
+        return {
+            ";".join(self.frames[i] for i in stack): count
+            for stack, count in self.stacks.items()
+        }
+
+    def lines(self):
+        """Folded stack lines, sorted by stack."""
+        for stack, count in sorted(self.counts().items()):
+            yield "{0} {1}\n".format(stack, count)
+
+    def merge(self, other):
+        """
+        Add all samples of :other: to this profile.
+
+        >>> a = FoldedProfile(); a.add(["main", "foo"], 1)
+        >>> b = FoldedProfile(); b.add(["main", "bar"], 2); b.add(["main"])
+        >>> a.merge(b) is a
+        True
+        >>> a.counts() == {"main;foo": 1, "main;bar": 2, "main": 1}
+        True
+        """
+        for stack, count in other.stacks.items():
+            self.add((other.frames[i] for i in stack), count)
+        return self
+
+    def encode(self):
+        """
+        The compressed representation of this profile.
+
+        >>> p = FoldedProfile(); p.add(["main", "foo"], 7)
+        >>> FoldedProfile.decode(p.encode()).counts()
+        {'main;foo': 7}
+        """
+        data = {
+            "format": FORMAT,
+            "frames": self.frames,
+            "stacks": [list(stack) + [count]
+                       for stack, count in self.stacks.items()]
+        }
+        return zlib.compress(
+            json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+    @classmethod
+    def decode(cls, blob):
+        """Restore a profile from :meth:`encode`."""
+        data = json.loads(zlib.decompress(blob).decode("utf-8"))
+        if data.get("format") != FORMAT:
+            raise ValueError("Unsupported profile format {0}".format(
+                data.get("format")))
+        profile = cls()
+        for frame in data["frames"]:
+            profile.intern(frame)
+        for entry in data["stacks"]:
+            profile.stacks[tuple(entry[:-1])] = entry[-1]
+        return profile
+
+
+def parse_folded(lines):
+    """
+    Parse folded stacks, as written by the stackcollapse scripts.
+
+    Yields:
+        (frames, count) for every line.
+
+    >>> list(parse_folded(["main;foo;bar 12\\n", "", "main 1"]))
+    [(['main', 'foo', 'bar'], 12), (['main'], 1)]
+    """
+    for line in lines:
+        line = line.rstrip("\n")
+        stack, _, count = line.rpartition(" ")
+        if not stack:
+            continue
+        yield stack.split(";"), int(count)
+
+
+SAMPLE_RE = re.compile(r'^(\S.*?)\s+\d+(?:/\d+)?\s')
+
+
+def __frame(line):
+    """The function name of a stack line of perf script."""
+    parts = line.split(None, 1)
+    if len(parts) < 2:
+        return "[unknown]"
+    symbol = parts[1]
+    dso = None
+    if symbol.endswith(")") and " (" in symbol:
+        symbol, _, dso = symbol[:-1].rpartition(" (")
+    symbol = re.sub(r'\+0x[0-9a-f]+$', '', symbol.strip())
+    if symbol == "[unknown]" and dso:
+        return "[{0}]".format(os.path.basename(dso))
+    return symbol
+
+
+def collapse_perf_script(lines):
+    """
+    Collapse the output of ``perf script`` into stacks, sample by sample.
+
+    Args:
+        lines: The lines of ``perf script``, may be a stream.
+
+    Yields:
+        The frames of every sample, from the process name (root) to the
+        leaf.
+
+    >>> out = ["sqlite3 4711 12345.678: 250000 cycles:",
+    ...        "\\t    7f00 leaf+0x1a (/usr/lib/libc.so.6)",
+    ...        "\\t    4000 main+0x10 (/tmp/sqlite3)",
+    ...        "\\t    3000 [unknown] (/tmp/sqlite3)",
+    ...        "",
+    ...        "sqlite3 4711 12345.679: 250000 cycles:",
+    ...        "\\t    4000 main+0x10 (/tmp/sqlite3)",
+    ...        ""]
+    >>> for stack in collapse_perf_script(out):
+    ...     print(stack)
+    ['sqlite3', '[sqlite3]', 'main', 'leaf']
+    ['sqlite3', 'main']
+    """
+    comm = None
+    stack = []
+    for line in lines:
+        line = line.rstrip("\n")
+        if not line.strip():
+            if comm is not None:
+                yield [comm] + stack[::-1]
+            comm, stack = None, []
+        elif line[0].isspace():
+            if comm is not None:
+                stack.append(__frame(line.strip()))
+        elif not line.startswith("#"):
+            match = SAMPLE_RE.match(line)
+            comm = match.group(1) if match else line.split()[0]
+            stack = []
+    if comm is not None:
+        yield [comm] + stack[::-1]
+
+
+def from_perf_script(lines):
+    """Build a profile from the output of ``perf script``."""
+    profile = FoldedProfile()
+    for frames in collapse_perf_script(lines):
+        profile.add(frames)
+    return profile
+
+
+def diff_lines(base, other):
+    """
+    Differential folded stacks of two profiles.
+
+    The counts of :other: are scaled to the total samples of :base:, so
+    that runs of different length can be compared.
+
+    Yields:
+        'stack count_base count_other' lines, as consumed by flamegraph.pl.
+
+    >>> a = FoldedProfile(); a.add(["main", "foo"], 2); a.add(["main"], 2)
+    >>> b = FoldedProfile(); b.add(["main", "foo"], 6); b.add(["main"], 2)
+    >>> list(diff_lines(a, b))
+    ['main 2 1\\n', 'main;foo 2 3\\n']
+    """
+    base_counts = base.counts()
+    other_counts = other.counts()
+    scale = base.samples / other.samples if other.samples else 1.0
+    for stack in sorted(set(base_counts) | set(other_counts)):
+        yield "{0} {1} {2}\n".format(
+            stack, base_counts.get(stack, 0),
+            int(round(other_counts.get(stack, 0) * scale)))
+
+
+def select_runs(session, experiment=None, project=None, **config):
+    """
+    Select the ids of runs that have a profile.
+
+    Args:
+        session: The database session.
+        experiment (str): Only runs of this experiment.
+        project (str): Only runs of this project.
+        **config: Only runs with these config values, e.g., cores="4".
+
+    Returns (list(int)):
+        The ids of the selected runs.
+    """
+    from benchbuild.utils import schema as s
+
+    query = session.query(s.Run.id).join(
+        s.FoldedStacks, s.FoldedStacks.run_id == s.Run.id)
+    if experiment is not None:
+        query = query.filter(s.Run.experiment_name == experiment)
+    if project is not None:
+        query = query.filter(s.Run.project_name == project)
+    for name, value in config.items():
+        cfg = session.query(s.Config.run_id).filter(
+            s.Config.name == name, s.Config.value == str(value))
+        query = query.filter(s.Run.id.in_(cfg.subquery()))
+    return [run_id for (run_id, ) in query]
+
+
+def load(session, run_ids):
+    """
+    Load and merge the profiles of :run_ids:.
+
+    Returns (FoldedProfile):
+        The merged profile of all runs.
+    """
+    from benchbuild.utils import schema as s
+
+    profile = FoldedProfile()
+    if not run_ids:
+        return profile
+    query = session.query(s.FoldedStacks.data).filter(
+        s.FoldedStacks.run_id.in_(list(run_ids)))
+    for (data, ) in query:
+        profile.merge(FoldedProfile.decode(data))
+    return profile
@@ -0,0 +1,321 @@
+"""
+Interned dimension tables for metrics, compilestats and config.
+
+Metric names, compilestat components/names and config keys repeat for
+every row. We store each of them once in a dimension table
+(metric_names, compilestat_keys, config_keys) and reference it by an
+integer id from narrow fact tables (metric_values, compilestat_values,
+config_values).
+
+The old tables 'metrics', 'compilestats' and 'config' are views that join
+both, so existing queries keep working. Benchbuild writes rows in the old
+shape (name strings). They are interned when the write-behind buffer
+flushes them, or when spooled rows are ingested, see :func:`insert`.
+
+Databases created by older versions still contain the old tables. As long
+as they do, we keep writing to them instead. Use ``benchbuild migrate`` to
+move their rows to the new tables and to replace them with views, see
+:func:`migrate`.
+"""
+import logging
+from collections import namedtuple
+
+LOG = logging.getLogger(__name__)
+
+Logical = namedtuple("Logical", [
+    "dimension", "keys", "fact", "fact_key", "view_sql", "legacy",
+    "legacy_key"
+])
+
+MAX_ROWS_PER_STATEMENT = 1000
+
+
+def __logical():
+    from benchbuild.utils import schema as s
+
+    return {
+        "metrics": Logical(
+            s.MetricName.__table__, ("name", ), s.MetricValue.__table__,
+            "metric_id",
+            "SELECT n.name AS name, v.value AS value, v.run_id AS run_id "
+            "FROM metric_values v JOIN metric_names n ON n.id = v.metric_id",
+            s.Metric.__table__, ("name", "run_id")),
+        "compilestats": Logical(
+            s.CompileStatKey.__table__, ("component", "name"),
+            s.CompileStatValue.__table__, "stat_id",
+            "SELECT k.name AS name, k.component AS component, "
+            "v.value AS value, v.run_id AS run_id "
+            "FROM compilestat_values v "
+            "JOIN compilestat_keys k ON k.id = v.stat_id",
+            # The old table has a surrogate key only.
+            s.CompileStat.__table__, None),
+        "config": Logical(
+            s.ConfigKey.__table__, ("name", ), s.ConfigValue.__table__,
+            "key_id",
+            "SELECT v.run_id AS run_id, k.name AS name, v.value AS value "
+            "FROM config_values v JOIN config_keys k ON k.id = v.key_id",
+            s.Config.__table__, ("run_id", "name"))
+    }
+
+
+def is_logical(table_name):
+    """Check, if :table_name: is a view of interned tables."""
+    return table_name in ("metrics", "compilestats", "config")
+
+
+__IDS = {}
+"""Cache of the ids of interned keys, by database and dimension table."""
+
+
+def __ids(session, dimension):
+    from benchbuild.utils.schema import connect_string
+    return __IDS.setdefault((connect_string(), dimension.name), {})
+
+
+def __load(session, dimension, key_columns, keys, ids):
+    """Load the ids of :keys: we know already."""
+    from sqlalchemy import select
+
+    first = dimension.columns[key_columns[0]]
+    wanted = sorted({key[0] for key in keys})
+    columns = [dimension.columns[c] for c in key_columns]
+    for i in range(0, len(wanted), MAX_ROWS_PER_STATEMENT):
+        chunk = wanted[i:i + MAX_ROWS_PER_STATEMENT]
+        query = select([dimension.c.id] + columns).where(first.in_(chunk))
+        for row in session.execute(query):
+            key = tuple(row[1:])
+            if key in keys:
+                ids[key] = row[0]
+
+
+def __insert_ignore(session, table, rows):
+    """Insert :rows:, skip the ones that exist already."""
+    dialect = session.get_bind().dialect.name
+    stmt = table.insert()
+    if dialect == "sqlite":
+        stmt = stmt.prefix_with("OR IGNORE")
+    elif dialect == "postgresql":
+        try:
+            from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(table).on_conflict_do_nothing()
+        except ImportError:
+            pass
+    session.execute(stmt, rows)
+
+
+def __upsert(session, table, rows, key):
+    """
+    Insert :rows:, replace the values of the ones that exist already.
+
+    Args:
+        session: The database session.
+        table: The table we insert into.
+        rows (list(dict)): The rows, all with the same columns.
+        key (tuple(str)): The columns of the primary key of :table:, or
+            None if rows can not conflict.
+    """
+    if not rows:
+        return
+    stmt = table.insert()
+    dialect = session.get_bind().dialect.name
+    if key and dialect == "sqlite":
+        stmt = stmt.prefix_with("OR REPLACE")
+    elif key and dialect == "postgresql":
+        try:
+            from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(key),
+                set_={
+                    c: stmt.excluded[c]
+                    for c in rows[0] if c not in key
+                })
+        except ImportError:
+            pass
+    for i in range(0, len(rows), MAX_ROWS_PER_STATEMENT):
+        session.execute(stmt.values(rows[i:i + MAX_ROWS_PER_STATEMENT]))
+
+
+__LEGACY = {}
+"""The old tables each database still has, by connect string."""
+
+
+def __legacy(session):
+    """The names of the old tables that have not been migrated yet."""
+    from benchbuild.utils.schema import connect_string
+
+    legacy = __LEGACY.get(connect_string())
+    if legacy is None:
+        tables, _ = __relations(session.connection())
+        legacy = __LEGACY[connect_string()] = {
+            name for name in __logical() if name in tables
+        }
+    return legacy
+
+
+def intern(session, dimension, key_columns, keys):
+    """
+    Get the ids of :keys: in a dimension table, create missing ones.
+
+    Args:
+        session: The database session.
+        dimension: The dimension table, e.g., schema.MetricName.__table__.
+        key_columns (tuple(str)): The columns that form the key.
+        keys (set(tuple)): The keys we need ids for.
+
+    Returns (dict):
+        Key to id, for (at least) all :keys:.
+    """
+    ids = __ids(session, dimension)
+    missing = {key for key in keys if key not in ids}
+    if missing:
+        __load(session, dimension, key_columns, missing, ids)
+        missing = {key for key in missing if key not in ids}
+    if missing:
+        __insert_ignore(session, dimension,
+                        [dict(zip(key_columns, key)) for key in missing])
+        __load(session, dimension, key_columns, missing, ids)
+    return ids
+
+
+def insert(session, table_name, rows):
+    """
+    Insert rows of a logical table into its interned tables.
+
+    If the database still has the old table, the rows go there, until
+    it is migrated. A key that exists for a run already gets the new value.
+
+    Args:
+        session: The database session.
+        table_name (str): 'metrics', 'compilestats' or 'config'.
+        rows (list(dict)): The rows, in the shape of the logical table.
+    """
+    logical = __logical()[table_name]
+    keys = [tuple(row[c] for c in logical.keys) for row in rows]
+
+    if table_name in __legacy(session):
+        # The last row wins, if a key is repeated for the same run.
+        legacy_rows = {}
+        for key, row in zip(keys, rows):
+            legacy_row = {c: row.get(c) for c in logical.keys}
+            legacy_row.update(run_id=row["run_id"], value=row.get("value"))
+            legacy_rows[(row["run_id"], key)] = legacy_row
+        __upsert(session, logical.legacy, list(legacy_rows.values()),
+                 logical.legacy_key)
+        return
+
+    ids = intern(session, logical.dimension, logical.keys, set(keys))
+    # The last row wins here, too.
+    facts = {}
+    for key, row in zip(keys, rows):
+        facts[(row["run_id"], ids[key])] = {
+            "run_id": row["run_id"],
+            logical.fact_key: ids[key],
+            "value": row.get("value")
+        }
+    __upsert(session, logical.fact, list(facts.values()),
+             ("run_id", logical.fact_key))
+
+
+def __relations(connection):
+    from sqlalchemy import inspect
+
+    inspector = inspect(connection)
+    return set(inspector.get_table_names()), set(inspector.get_view_names())
+
+
+def create_views(connection):
+    """
+    Create the views of the logical tables, if they do not exist.
+
+    Old tables are left alone, until they are migrated. We keep writing
+    new results to them (see insert).
+    """
+    tables, views = __relations(connection)
+    for name, logical in sorted(__logical().items()):
+        if name in tables:
+            LOG.warning(
+                "The database still has the old '%s' table. Run "
+                "'benchbuild migrate' to move its rows to the interned "
+                "tables.", name)
+        elif name not in views:
+            connection.execute("CREATE VIEW {0} AS {1}".format(
+                name, logical.view_sql))
+
+
+def migrate(connection, drop=False):
+    """
+    Move the rows of old tables into the interned tables.
+
+    Every old table is copied with set-based INSERT ... SELECT statements.
+    It is then renamed to '<name>_legacy' (or dropped) and replaced by its
+    view.
+
+    Args:
+        connection: A database connection, inside a transaction.
+        drop (bool): Drop the old tables, instead of keeping them.
+
+    Returns (dict):
+        Name of each migrated table to the number of rows we copied.
+    """
+    from benchbuild.utils import schema
+
+    schema.BASE.metadata.create_all(connection,
+                                    tables=schema.physical_tables(),
+                                    checkfirst=True)
+    tables, _ = __relations(connection)
+    statements = {
+        "metrics": [
+            "INSERT INTO metric_names (name) SELECT DISTINCT m.name "
+            "FROM metrics m WHERE NOT EXISTS "
+            "(SELECT 1 FROM metric_names n WHERE n.name = m.name)",
+            "INSERT INTO metric_values (run_id, metric_id, value) "
+            "SELECT m.run_id, n.id, m.value FROM metrics m "
+            "JOIN metric_names n ON n.name = m.name WHERE NOT EXISTS "
+            "(SELECT 1 FROM metric_values v "
+            "WHERE v.run_id = m.run_id AND v.metric_id = n.id)"
+        ],
+        "compilestats": [
+            "INSERT INTO compilestat_keys (component, name) "
+            "SELECT DISTINCT c.component, c.name FROM compilestats c "
+            "WHERE c.component IS NOT NULL AND c.name IS NOT NULL "
+            "AND NOT EXISTS (SELECT 1 FROM compilestat_keys k "
+            "WHERE k.component = c.component AND k.name = c.name)",
+            "INSERT INTO compilestat_values (run_id, stat_id, value) "
+            "SELECT c.run_id, k.id, CAST(MAX(c.value) AS BIGINT) "
+            "FROM compilestats c JOIN compilestat_keys k "
+            "ON k.component = c.component AND k.name = c.name "
+            "WHERE c.run_id IS NOT NULL AND NOT EXISTS "
+            "(SELECT 1 FROM compilestat_values v "
+            "WHERE v.run_id = c.run_id AND v.stat_id = k.id) "
+            "GROUP BY c.run_id, k.id"
+        ],
+        "config": [
+            "INSERT INTO config_keys (name) SELECT DISTINCT c.name "
+            "FROM config c WHERE NOT EXISTS "
+            "(SELECT 1 FROM config_keys k WHERE k.name = c.name)",
+            "INSERT INTO config_values (run_id, key_id, value) "
+            "SELECT c.run_id, k.id, c.value FROM config c "
+            "JOIN config_keys k ON k.name = c.name WHERE NOT EXISTS "
+            "(SELECT 1 FROM config_values v "
+            "WHERE v.run_id = c.run_id AND v.key_id = k.id)"
+        ]
+    }
+
+    migrated = {}
+    for name in sorted(statements):
+        if name not in tables:
+            continue
+        copied = 0
+        for statement in statements[name]:
+            copied = connection.execute(statement).rowcount
+        migrated[name] = copied
+        if drop:
+            connection.execute("DROP TABLE {0}".format(name))
+        else:
+            connection.execute(
+                "ALTER TABLE {0} RENAME TO {0}_legacy".format(name))
+    __IDS.clear()
+    __LEGACY.clear()
+    create_views(connection)
+    return migrated
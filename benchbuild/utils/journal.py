@@ -0,0 +1,81 @@
+"""
+Journal of completed project chains.
+
+Every project chain of an experiment that completes successfully leaves an
+entry in a journal file that belongs to the experiment id. If a run of
+benchbuild dies halfway through, it can be resumed with the same experiment
+id and all chains found in the journal are skipped.
+
+The journal is a plain text file with one entry per line. Entries are
+appended with a single write, so concurrent workers do not need to
+coordinate.
+"""
+import os
+from benchbuild.settings import CFG
+
+
+def journal_path(experiment_id=None):
+    """
+    Get the path of the journal file for an experiment id.
+
+    Args:
+        experiment_id: The experiment id. Defaults to CFG["experiment_id"].
+
+    Returns (str):
+        Path to the journal file.
+    """
+    if experiment_id is None:
+        experiment_id = CFG["experiment_id"].value()
+    return os.path.join(str(CFG["build_dir"]), ".journal",
+                        "{0}.log".format(experiment_id))
+
+
+def entries(experiment_id=None):
+    """
+    Get all entries of the journal.
+
+    Args:
+        experiment_id: The experiment id. Defaults to CFG["experiment_id"].
+
+    Returns (set(str)):
+        All entries that have been recorded for this experiment id.
+    """
+    journal_f = journal_path(experiment_id)
+    if not os.path.exists(journal_f):
+        return set()
+    with open(journal_f, 'r') as journal:
+        return set([line.rstrip("\n") for line in journal if line.strip()])
+
+
+def completed(key):
+    """
+    Check, if the chain identified by :key: completed in a previous run.
+
+    This only returns True, if the user asked us to resume an experiment.
+
+    Args:
+        key (str): The key of a chain.
+    """
+    if not CFG["resume"].value():
+        return False
+    return key in entries()
+
+
+def record(key):
+    """
+    Record the chain identified by :key: as completed.
+
+    Args:
+        key (str): The key of a chain.
+    """
+    journal_f = journal_path()
+    journal_dir = os.path.dirname(journal_f)
+    if not os.path.exists(journal_dir):
+        os.makedirs(journal_dir, exist_ok=True)
+
+    line = (key + "\n").encode("utf-8")
+    fd = os.open(journal_f, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
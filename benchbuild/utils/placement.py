@@ -0,0 +1,375 @@
+"""
+CPU placement of measured runs.
+
+With BB_PLACEMENT_ENABLE set, runtime extensions pin the binaries they
+measure to a set of CPUs of their own:
+
+    * Only CPUs we are allowed to run on (Cpus_allowed) are used.
+    * CPUs are chosen from as few NUMA nodes as possible.
+    * SMT siblings of a chosen CPU are left idle, unless there are not enough
+      physical cores and BB_PLACEMENT_SMT allows it.
+    * CPU sets of concurrent measurements are disjoint. Every CPU is guarded
+      by a lock file in BB_TMP_DIR/placement, concurrent benchbuild
+      processes wait until enough CPUs are free, at most BB_PLACEMENT_TIMEOUT
+      seconds.
+    * With BB_PLACEMENT_RESERVE, measurements only use the CPUs of this cpu
+      list. Configure and build steps run on the remaining CPUs (see
+      unreserved), so compiling other projects does not disturb them.
+
+The placement is applied to the current process with sched_setaffinity and
+inherited by the measured binary. guarded_exec records it in the config of
+the run (placement.cpus, placement.nodes).
+"""
+import logging
+import os
+import re
+from collections import namedtuple
+from contextlib import contextmanager
+
+from benchbuild.settings import CFG
+
+LOG = logging.getLogger(__name__)
+
+SYS_CPU = "/sys/devices/system/cpu"
+SYS_NODE = "/sys/devices/system/node"
+
+Cpu = namedtuple("Cpu", ["id", "core", "node"])
+Placement = namedtuple("Placement", ["cpus", "nodes"])
+
+__CURRENT = []
+
+
+def parse_cpu_list(text):
+    """
+    Parse a cpu list, as used by the kernel.
+
+    >>> parse_cpu_list("0-3,8,10-11\\n")
+    [0, 1, 2, 3, 8, 10, 11]
+    >>> parse_cpu_list("")
+    []
+    """
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def format_cpu_list(cpus):
+    """
+    Format cpus as a cpu list.
+
+    >>> format_cpu_list([3, 0, 1, 2, 8, 10, 11])
+    '0-3,8,10-11'
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(
+        str(a) if a == b else "{0}-{1}".format(a, b) for a, b in ranges)
+
+
+def parse_cpu_mask(mask):
+    """
+    Parse a cpu mask, e.g., Cpus_allowed of /proc/self/status.
+
+    >>> parse_cpu_mask("00000000,0000000f")
+    [0, 1, 2, 3]
+    """
+    value = int(mask.replace(",", ""), 16)
+    return [i for i in range(value.bit_length()) if value & (1 << i)]
+
+
+def allowed_cpus():
+    """The CPUs the current process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    with open("/proc/self/status", 'r') as status:
+        match = re.search(r'(?m)^Cpus_allowed:\s*(.*)$', status.read())
+    return parse_cpu_mask(match.group(1))
+
+
+def __read_cpu_list(path):
+    try:
+        with open(path, 'r') as cpu_list:
+            return parse_cpu_list(cpu_list.read())
+    except OSError:
+        return []
+
+
+def topology(cpus=None):
+    """
+    The topology of :cpus:.
+
+    Args:
+        cpus (list(int)): The CPUs, defaults to :func:`allowed_cpus`.
+
+    Returns (list(Cpu)):
+        The physical core (the lowest of its SMT siblings) and the NUMA node
+        of each CPU.
+    """
+    cpus = allowed_cpus() if cpus is None else cpus
+    node_of = {}
+    if os.path.isdir(SYS_NODE):
+        for entry in os.listdir(SYS_NODE):
+            if re.match(r'^node\d+$', entry):
+                for cpu in __read_cpu_list(
+                        os.path.join(SYS_NODE, entry, "cpulist")):
+                    node_of[cpu] = int(entry[4:])
+
+    result = []
+    for cpu in cpus:
+        siblings = __read_cpu_list(
+            os.path.join(SYS_CPU, "cpu{0}".format(cpu), "topology",
+                         "thread_siblings_list"))
+        result.append(Cpu(cpu, min(siblings or [cpu]), node_of.get(cpu, 0)))
+    return result
+
+
+def choose(cpus, jobs, busy=(), smt=False):
+    """
+    Choose :jobs: CPUs for a measurement.
+
+    Args:
+        cpus (list(Cpu)): The topology of all CPUs we may use.
+        jobs (int): The number of CPUs we need.
+        busy (set(int)): CPUs that are in use already.
+        smt (bool): Use SMT siblings, if there are not enough idle cores.
+
+    Returns (list(int)):
+        The chosen CPUs, or None if there are not enough free CPUs.
+
+    >>> topo = [Cpu(0, 0, 0), Cpu(1, 1, 0), Cpu(2, 0, 0), Cpu(3, 1, 0),
+    ...         Cpu(4, 4, 1), Cpu(5, 5, 1), Cpu(6, 4, 1), Cpu(7, 5, 1)]
+    >>> choose(topo, 2)
+    [0, 1]
+    >>> choose(topo, 2, busy={0})
+    [4, 5]
+    >>> choose(topo, 3)
+    [0, 1, 4]
+    >>> choose(topo, 4, busy={4, 5}, smt=True)
+    [0, 1, 2, 3]
+    >>> choose(topo, 5)
+    """
+    busy = set(busy)
+    cores = {}
+    for cpu in cpus:
+        cores.setdefault((cpu.node, cpu.core), []).append(cpu.id)
+    # A core is idle, if none of its SMT siblings is busy.
+    idle = {
+        key: sorted(ids)
+        for key, ids in cores.items() if not busy.intersection(ids)
+    }
+
+    nodes = sorted({node for node, _ in cores})
+    idle_per_node = {
+        node: sorted(key for key in idle if key[0] == node)
+        for node in nodes
+    }
+    # Prefer the smallest node that fits, then fill nodes with most cores.
+    fitting = [n for n in nodes if len(idle_per_node[n]) >= jobs]
+    if fitting:
+        node = min(fitting, key=lambda n: len(idle_per_node[n]))
+        return [idle[key][0] for key in idle_per_node[node][:jobs]]
+
+    order = sorted(nodes, key=lambda n: -len(idle_per_node[n]))
+    chosen = [idle[key][0] for n in order for key in idle_per_node[n]]
+    if len(chosen) < jobs and smt:
+        free = [c.id for n in order for c in cpus
+                if c.node == n and c.id not in busy and c.id not in chosen]
+        chosen.extend(free)
+    if len(chosen) < jobs:
+        return None
+    return sorted(chosen[:jobs])
+
+
+def enabled():
+    """Check, if measured runs are pinned to CPUs."""
+    return bool(CFG["placement"]["enable"].value())
+
+
+def reserved_cpus():
+    """The CPUs reserved for measurements, empty if there is no reserve."""
+    return parse_cpu_list(str(CFG["placement"]["reserve"].value()))
+
+
+@contextmanager
+def unreserved():
+    """
+    Keep the current process off the CPUs reserved for measurements.
+
+    The affinity is inherited by all child processes, e.g., the compiler.
+    Does nothing, if placement is disabled or nothing is reserved.
+    """
+    reserved = set(reserved_cpus()) if enabled() else set()
+    previous = os.sched_getaffinity(0)
+    others = set(previous) - reserved
+    if not reserved or others == set(previous):
+        yield
+        return
+    if not others:
+        LOG.warning("All CPUs we may use are reserved for measurements, "
+                    "using them anyway.")
+        yield
+        return
+
+    os.sched_setaffinity(0, others)
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, previous)
+
+
+def current():
+    """The placement of the current measurement, or None."""
+    return __CURRENT[-1] if __CURRENT else None
+
+
+def config(placement):
+    """
+    The config entries that record :placement:.
+
+    >>> config(Placement([0, 1, 2, 4], [0]))
+    {'placement.cpus': '0-2,4', 'placement.nodes': '0'}
+    """
+    return {
+        "placement.cpus": format_cpu_list(placement.cpus),
+        "placement.nodes": format_cpu_list(placement.nodes)
+    }
+
+
+def __try_lock(lock_dir, cpu, shared=False):
+    import fcntl
+
+    lock_f = open(os.path.join(lock_dir, "cpu{0}.lock".format(cpu)), 'a')
+    try:
+        fcntl.flock(lock_f, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) |
+                    fcntl.LOCK_NB)
+    except OSError:
+        lock_f.close()
+        return None
+    return lock_f
+
+
+def __busy(lock_dir, cpus):
+    """The CPUs of :cpus: that are locked by another measurement."""
+    busy = set()
+    for cpu in cpus:
+        # A shared lock does not get in the way of concurrent probes.
+        lock_f = __try_lock(lock_dir, cpu.id, shared=True)
+        if lock_f is None:
+            busy.add(cpu.id)
+        else:
+            lock_f.close()
+    return busy
+
+
+def __lock_all(lock_dir, cpu_ids):
+    """
+    Lock all of :cpu_ids:, or none of them.
+
+    Returns (dict):
+        CPU to its lock file, or None if another measurement holds one of
+        the locks.
+    """
+    locks = {}
+    for cpu in sorted(cpu_ids):
+        lock_f = __try_lock(lock_dir, cpu)
+        if lock_f is None:
+            for held in locks.values():
+                held.close()
+            return None
+        locks[cpu] = lock_f
+    return locks
+
+
+@contextmanager
+def place(jobs):
+    """
+    Pin the current process to :jobs: CPUs of its own.
+
+    We choose the CPUs from the ones that are free right now and only then
+    lock them, together with their idle SMT siblings. If a concurrent
+    measurement took one of them in the meantime, we choose again. Blocks
+    until enough CPUs are free, but at most BB_PLACEMENT_TIMEOUT seconds.
+    Does nothing, if placement is disabled.
+
+    Args:
+        jobs (int): The number of CPUs we need.
+
+    Yields (Placement):
+        The placement, or None if placement is disabled.
+
+    Raises:
+        RuntimeError: If there are not enough free CPUs within the timeout.
+    """
+    import time
+
+    if not enabled():
+        yield None
+        return
+
+    cpus = topology()
+    reserved = reserved_cpus()
+    if reserved:
+        cpus = [c for c in cpus if c.id in reserved] or cpus
+    smt = bool(CFG["placement"]["smt"].value())
+    usable = len(cpus) if smt else len({(c.node, c.core) for c in cpus})
+    jobs = max(1, min(int(jobs), usable))
+    timeout = float(CFG["placement"]["timeout"].value())
+    lock_dir = os.path.join(str(CFG["tmp_dir"]), "placement")
+    os.makedirs(lock_dir, exist_ok=True)
+
+    locks = {}
+    start = time.time()
+    last_report = None
+    try:
+        while True:
+            busy = __busy(lock_dir, cpus)
+            chosen = choose(cpus, jobs, busy, smt)
+            if chosen is not None:
+                # Keep the SMT siblings of the chosen CPUs idle, too.
+                cores = {c.core for c in cpus if c.id in chosen}
+                siblings = {
+                    c.id
+                    for c in cpus if c.core in cores and c.id not in busy
+                }
+                locks = __lock_all(lock_dir, siblings.union(chosen))
+                if locks is not None:
+                    break
+                locks = {}
+                LOG.debug("CPUs %s were taken concurrently, retrying.",
+                          format_cpu_list(chosen))
+            waited = time.time() - start
+            if timeout and waited > timeout:
+                raise RuntimeError(
+                    "No {0} free CPUs within {1:g}s, CPUs {2} are busy. "
+                    "Lower BB_JOBS or raise BB_PLACEMENT_TIMEOUT.".format(
+                        jobs, timeout, format_cpu_list(busy)))
+            if chosen is None:
+                if last_report is None or waited - last_report >= 60:
+                    last_report = waited
+                    LOG.warning(
+                        "Waiting for %d free CPUs for %ds, CPUs %s are busy "
+                        "(timeout: %gs).", jobs, waited,
+                        format_cpu_list(busy), timeout)
+                time.sleep(0.5)
+
+        placement = Placement(
+            chosen, sorted({c.node for c in cpus if c.id in chosen}))
+        previous = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, chosen)
+        __CURRENT.append(placement)
+        try:
+            yield placement
+        finally:
+            __CURRENT.pop()
+            os.sched_setaffinity(0, previous)
+    finally:
+        for lock_f in locks.values():
+            lock_f.close()
@@ -0,0 +1,352 @@
+"""
+Repetition control for run-time measurements.
+
+A single execution of a binary is a poor estimate of its run time. Instead
+of running every binary a fixed number of times, we repeat a measurement
+until the confidence interval of the median is narrow enough:
+
+    1. Execute BB_REPEAT_WARMUP warm-up runs, which are neither measured
+       nor stored in the database (see run_warmup).
+    2. Execute at least BB_REPEAT_MIN_REPS measurements.
+    3. Stop as soon as the confidence interval of the median (at
+       BB_REPEAT_CONFIDENCE) lies within BB_REPEAT_PRECISION of the median,
+       or after BB_REPEAT_MAX_REPS measurements.
+
+The confidence interval of the median is distribution-free, it is bounded
+by order statistics of the samples. With a confidence of 95% this requires
+at least 6 samples.
+"""
+import math
+from contextlib import contextmanager
+
+from benchbuild.settings import CFG
+
+
+def median(values):
+    """
+    The median of :values:.
+
+    >>> median([3, 1, 2])
+    2
+    >>> median([4, 1, 3, 2])
+    2.5
+    """
+    xs = sorted(values)
+    n = len(xs)
+    mid = n // 2
+    if n % 2:
+        return xs[mid]
+    return (xs[mid - 1] + xs[mid]) / 2
+
+
+def median_ci(values, confidence=0.95):
+    """
+    The confidence interval of the median of :values:.
+
+    Args:
+        values (list(float)): The samples.
+        confidence (float): The confidence level of the interval.
+
+    Returns (tuple(float, float)):
+        The lower and upper bound of the interval, or None if there are too
+        few samples for the requested confidence.
+
+    >>> median_ci([1, 2, 3, 4, 5])
+    >>> median_ci([6, 1, 5, 2, 4, 3])
+    (1, 6)
+    >>> median_ci(list(range(20)))
+    (5, 14)
+    """
+    xs = sorted(values)
+    n = len(xs)
+    tail = (1.0 - confidence) / 2
+    pmf = 0.5**n
+    cdf = 0.0
+    k = -1
+    # Largest k with P(B <= k) <= tail, with B ~ Binomial(n, 1/2).
+    for j in range(n + 1):
+        cdf += pmf
+        if cdf > tail:
+            break
+        k = j
+        pmf = pmf * (n - j) / (j + 1)
+    if k < 0:
+        return None
+    return xs[k], xs[n - 1 - k]
+
+
+def converged(values, precision, confidence=0.95):
+    """
+    Check, if the median of :values: is precise enough.
+
+    Args:
+        values (list(float)): The samples.
+        precision (float): The maximal relative distance of the bounds of
+            the confidence interval to the median, e.g., 0.05 for 5%.
+        confidence (float): The confidence level of the interval.
+
+    >>> converged([10.0, 10.1, 9.9, 10.2, 9.8, 10.0], 0.05)
+    True
+    >>> converged([10.0, 10.1, 9.9, 10.2, 9.8, 20.0], 0.05)
+    False
+    """
+    ci = median_ci(values, confidence)
+    if ci is None:
+        return False
+    med = median(values)
+    return max(med - ci[0], ci[1] - med) <= precision * abs(med)
+
+
+def summarize(values, confidence=0.95):
+    """
+    Summary statistics of :values:.
+
+    Returns (dict):
+        The median, mean, standard deviation, minimum and maximum of
+        :values: and the bounds of the confidence interval of the median,
+        if we have enough samples.
+
+    >>> s = summarize([1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+    >>> s["median"], s["min"], s["max"], s["ci_low"], s["ci_high"]
+    (3.5, 1.0, 6.0, 1.0, 6.0)
+    """
+    n = len(values)
+    mean = sum(values) / n
+    summary = {
+        "median": median(values),
+        "mean": mean,
+        "stddev": math.sqrt(sum((x - mean)**2 for x in values) / (n - 1))
+                  if n > 1 else 0.0,
+        "min": min(values),
+        "max": max(values)
+    }
+    ci = median_ci(values, confidence)
+    if ci is not None:
+        summary["ci_low"], summary["ci_high"] = ci
+    return summary
+
+
+def repeat(measure, key=None, min_reps=None, max_reps=None, warmup=None,
+           precision=None, confidence=None):
+    """
+    Repeat a measurement until its median is precise enough.
+
+    Unset arguments are taken from the configuration (BB_REPEAT_*).
+
+    Args:
+        measure: A function ``f(sample)`` that executes one measurement.
+            ``sample`` is "warmup" for warm-up runs, else the index of the
+            sample. It returns the sample, or None if the measurement
+            failed, which stops the repetition. A failed warm-up run only
+            ends the warm-up, the first measurement records the failure.
+        key: A function that maps a sample to the value we test for
+            convergence. Defaults to the sample itself.
+        min_reps (int): Minimal number of measurements.
+        max_reps (int): Maximal number of measurements.
+        warmup (int): Number of warm-up runs.
+        precision (float): See :func:`converged`.
+        confidence (float): See :func:`converged`.
+
+    Returns (list):
+        The samples of all measurements, without warm-up runs.
+
+    >>> from itertools import count
+    >>> values = count(10)
+    >>> samples = repeat(lambda i: next(values), min_reps=2, max_reps=4,
+    ...                  warmup=1, precision=0.5, confidence=0.95)
+    >>> samples
+    [11, 12, 13, 14]
+    >>> repeat(lambda i: 1.0, min_reps=3, max_reps=50, warmup=0,
+    ...        precision=0.01, confidence=0.95)
+    [1.0, 1.0, 1.0, 1.0, 1.0, 1.0]
+    >>> repeat(lambda i: None if i == "warmup" else 1.0, min_reps=1,
+    ...        max_reps=1, warmup=2, precision=0.01, confidence=0.95)
+    [1.0]
+    """
+    cfg = CFG["repeat"]
+    min_reps = int(cfg["min_reps"].value()) if min_reps is None else min_reps
+    max_reps = int(cfg["max_reps"].value()) if max_reps is None else max_reps
+    warmup = int(cfg["warmup"].value()) if warmup is None else warmup
+    precision = float(cfg["precision"].value()) \
+        if precision is None else precision
+    confidence = float(cfg["confidence"].value()) \
+        if confidence is None else confidence
+    key = key or (lambda sample: sample)
+    max_reps = max(max_reps, min_reps, 1)
+
+    for _ in range(warmup):
+        if measure("warmup") is None:
+            break
+
+    samples = []
+    while len(samples) < max_reps:
+        sample = measure(len(samples))
+        if sample is None:
+            break
+        samples.append(sample)
+        if len(samples) >= min_reps and \
+                converged([key(s) for s in samples], precision, confidence):
+            break
+    return samples
+
+
+def run_warmup(cmd):
+    """
+    Execute a warm-up run of :cmd:.
+
+    Warm-up runs do not go through benchbuild.utils.run.guarded_exec, we
+    do not want them to show up as runs next to the measured samples.
+
+    Args:
+        cmd: The plumbum command of a measurement.
+
+    Returns (bool):
+        True, if :cmd: succeeded.
+
+    >>> from plumbum import local
+    >>> run_warmup(local["true"]), run_warmup(local["false"])
+    (True, False)
+    """
+    retcode, _, _ = cmd.run(retcode=None)
+    return retcode == 0
+
+
+def enabled():
+    """Check, if run-time measurements are repeated at all."""
+    cfg = CFG["repeat"]
+    return int(cfg["max_reps"].value()) > 1 or \
+        int(cfg["min_reps"].value()) > 1 or int(cfg["warmup"].value()) > 0
+
+
+def timing_metrics(timings, confidence=None):
+    """
+    Summary metrics of a series of timings.
+
+    Args:
+        timings (list(tuple)): (user, system, real) time of each sample.
+        confidence (float): See :func:`summarize`.
+
+    Returns (dict):
+        Metric name to value, e.g., 'time.real_s.median'.
+
+    >>> m = timing_metrics([(1.0, 0.0, 2.0), (3.0, 0.0, 4.0)], 0.95)
+    >>> m["time.real_s.median"], m["time.user_s.max"], m["time.repetitions"]
+    (3.0, 3.0, 2)
+    """
+    if confidence is None:
+        confidence = float(CFG["repeat"]["confidence"].value())
+    metrics = {"time.repetitions": len(timings)}
+    for i, name in enumerate(["time.user_s", "time.system_s", "time.real_s"]):
+        summary = summarize([float(t[i]) for t in timings], confidence)
+        for stat, value in summary.items():
+            metrics[name + "." + stat] = value
+    return metrics
+
+
+@contextmanager
+def replay_stdin(cmd, kwargs):
+    """
+    Redirect the stdin of :cmd: such that it can be executed repeatedly.
+
+    If the wrapped binary reads from stdin (see
+    benchbuild.utils.run.handle_stdin) and we repeat measurements, we
+    buffer our stdin in a temporary file and feed each execution from it.
+
+    Args:
+        cmd: The plumbum command.
+        kwargs (dict): The keyword args of the runtime extension.
+
+    Yields:
+        The command with its stdin redirected, if necessary.
+    """
+    import shutil
+    import sys
+    import tempfile
+    from benchbuild.utils.run import handle_stdin
+
+    if not (kwargs.get("has_stdin", False) and enabled()):
+        yield handle_stdin(cmd, kwargs)
+        return
+
+    with tempfile.NamedTemporaryFile(prefix="bb-stdin-") as stdin_f:
+        shutil.copyfileobj(sys.stdin.buffer, stdin_f)
+        stdin_f.flush()
+        yield cmd < stdin_f.name
+
+
+def measure_time(cmd, timing_tag, project, experiment, jobs, sample):
+    """
+    Execute one timed measurement of :cmd: and persist it.
+
+    Args:
+        cmd: The plumbum command, wrapped with time. It prints its timings
+            as ``<timing_tag>user-system-real`` to stderr.
+        timing_tag (str): The marker of the timing line.
+        project: The benchbuild project.
+        experiment: The benchbuild experiment.
+        jobs (int): The number of cores the measurement may use.
+        sample: See :func:`repeat`.
+
+    Returns (tuple):
+        The run info and the (user, system, real) time of the run, or None
+        if the timings are missing.
+    """
+    from benchbuild.utils.db import persist_config, persist_time
+    from benchbuild.utils.run import fetch_time_output, guarded_exec
+
+    if sample == "warmup":
+        return run_warmup(cmd) or None
+
+    with guarded_exec(cmd, project, experiment) as run:
+        ri = run()
+    timings = fetch_time_output(
+        timing_tag, timing_tag + "{:g}-{:g}-{:g}", ri.stderr.split("\n"))
+    if not timings:
+        return None
+
+    persist_time(ri.db_run, ri.session, timings)
+    persist_config(ri.db_run, ri.session, {
+        "cores": str(jobs),
+        "repeat.sample": str(sample)
+    })
+    return ri, timings[0]
+
+
+def run_timed(cmd, timing_tag, project, experiment, jobs, kwargs):
+    """
+    Repeat the timed measurement of :cmd: and persist every sample.
+
+    Every sample is stored as a run of its own, tagged with its index in
+    the config 'repeat.sample'. Warm-up runs are not stored. If we took
+    more than one sample, the last run carries the summary metrics (see
+    :func:`timing_metrics`).
+
+    Args:
+        cmd: The plumbum command, wrapped with time, see
+            :func:`measure_time`.
+        timing_tag (str): The marker of the timing line.
+        project: The benchbuild project.
+        experiment: The benchbuild experiment.
+        jobs (int): The number of cores the measurement may use.
+        kwargs (dict): The keyword args of the runtime extension.
+
+    Returns (list(tuple)):
+        The run info and the timings of all samples.
+    """
+    from functools import partial
+    from plumbum import local
+    from benchbuild.utils import placement
+    from benchbuild.utils.db import persist_metrics
+
+    with placement.place(jobs), local.env(OMP_NUM_THREADS=str(jobs)):
+        with replay_stdin(cmd, kwargs) as run_cmd:
+            samples = repeat(
+                partial(measure_time, run_cmd, timing_tag, project,
+                        experiment, jobs),
+                key=lambda s: s[1][2])
+
+    if len(samples) > 1:
+        ri = samples[-1][0]
+        persist_metrics(ri.db_run, ri.session,
+                        timing_metrics([t for _, t in samples]))
+    return samples
@@ -21,7 +21,9 @@ def partial(func, *args, **kwargs):
         **kwargs: Keyword arguments that should be applied partially.
 
     Returns:
-        A new function that has all given args and kwargs bound.
+        A new function that has all given args and kwargs bound. The bound
+        function and arguments are available as its func, args and kwargs
+        attributes (see benchbuild.utils.run_spec).
     """
     frozen_args = args
     frozen_kwargs = kwargs
@@ -36,6 +38,9 @@ def partial(func, *args, **kwargs):
         thawed_kwargs.update(kwargs)
         func(*thawed_args, **thawed_kwargs)
 
+    partial_func.func = func
+    partial_func.args = frozen_args
+    partial_func.kwargs = frozen_kwargs
     return partial_func
 
 
@@ -152,7 +157,9 @@ def end_run_group(group, session):
         session: The database transaction we will finish.
     """
     from datetime import datetime
+    from benchbuild.utils.db import flush
 
+    flush()
     group.end = datetime.now()
     group.status = 'completed'
     session.commit()
@@ -167,10 +174,14 @@ def fail_run_group(group, session):
         session: The database transaction we will finish.
     """
     from datetime import datetime
+    from benchbuild.utils.db import flush
 
-    group.end = datetime.now()
-    group.status = 'failed'
-    session.commit()
+    try:
+        flush()
+    finally:
+        group.end = datetime.now()
+        group.status = 'failed'
+        session.commit()
 
 
 def begin(command, pname, ename, group):
@@ -220,15 +231,19 @@ def end(db_run, session, stdout, stderr):
         stderr: The stderr we capture of the run.
     """
     from benchbuild.utils.schema import RunLog
+    from benchbuild.utils import spool
     from datetime import datetime
-    log = session.query(RunLog).filter(RunLog.run_id == db_run.id).one()
-    log.stderr = stderr
-    log.stdout = stdout
-    log.status = 0
-    log.end = datetime.now()
+    log = {"stderr": stderr,
+           "stdout": stdout,
+           "status": 0,
+           "end": datetime.now()}
+    if spool.enabled():
+        session.add(RunLog(run_id=db_run.id, **log))
+    else:
+        session.query(RunLog).filter(RunLog.run_id == db_run.id).update(
+            log, synchronize_session=False)
     db_run.end = datetime.now()
     db_run.status = 'completed'
-    session.add(log)
     session.commit()
 
 
@@ -247,15 +262,19 @@ def fail(db_run, session, retcode, stdout, stderr):
         stderr: The stderr we capture of the run.
     """
     from benchbuild.utils.schema import RunLog
+    from benchbuild.utils import spool
     from datetime import datetime
-    log = session.query(RunLog).filter(RunLog.run_id == db_run.id).one()
-    log.stderr = stderr
-    log.stdout = stdout
-    log.status = retcode
-    log.end = datetime.now()
+    log = {"stderr": stderr,
+           "stdout": stdout,
+           "status": retcode,
+           "end": datetime.now()}
+    if spool.enabled():
+        session.add(RunLog(run_id=db_run.id, **log))
+    else:
+        session.query(RunLog).filter(RunLog.run_id == db_run.id).update(
+            log, synchronize_session=False)
     db_run.end = datetime.now()
     db_run.status = 'failed'
-    session.add(log)
     session.commit()
 
 
@@ -279,12 +298,27 @@ def guarded_exec(cmd, project, experiment):
     from plumbum.commands.modifiers import TEE
     from warnings import warn
 
+    from benchbuild.utils import cgroup, placement
+    from benchbuild.utils.db import persist_metrics, persist_config
+
     db_run, session = begin(cmd, project.name, experiment.name,
                             project.run_uuid)
     ex = None
     with local.env(BB_DB_RUN_ID=db_run.id):
         def runner(retcode=0, *args):
-            retcode, stdout, stderr = cmd[args] & TEE(retcode=retcode)
+            run_cmd = cmd[args]
+            cg_path = cgroup.create() if cgroup.enabled() else None
+            if cg_path:
+                run_cmd = cgroup.wrap(run_cmd, cg_path)
+            try:
+                retcode, stdout, stderr = run_cmd & TEE(retcode=retcode)
+            finally:
+                if cg_path:
+                    persist_metrics(db_run, session, cgroup.collect(cg_path))
+                    cgroup.remove(cg_path)
+            if placement.current():
+                persist_config(db_run, session,
+                               placement.config(placement.current()))
             end(db_run, session, stdout, stderr)
             r = SimpleNamespace()
             r.retcode = retcode
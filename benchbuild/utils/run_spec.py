@@ -0,0 +1,198 @@
+"""
+Declarative run specifications for wrapped binaries.
+
+The runtime extension of a project is executed every time a wrapped binary
+runs. Instead of pickling the extension together with its project, its
+experiment and the whole configuration, we describe it by a small JSON
+document:
+
+    {"format": 1,
+     "handler": "benchbuild.experiments.raw.run_with_time",
+     "args": [4],
+     "project": {"module": ..., "class": ..., "state": {...}},
+     "experiment": {"module": ..., "class": ..., "state": {...}}}
+
+"handler" names a function registered with :func:`runtime_handler`, "args"
+are the JSON arguments that follow project, experiment and configuration in
+the partial application of the handler. The configuration is not part of
+the spec, wrapped binaries read the configuration snapshot of the run
+instead (see benchbuild.settings).
+
+Extensions we can not describe this way are pickled, as before. This
+includes extensions whose project or experiment carries an attribute that
+can not be serialized to JSON, because the handler may depend on it.
+"""
+import json
+import uuid
+
+FORMAT = 1
+SPEC_F_EXT = ".spec.json"
+
+HANDLERS = {}
+"""Registered runtime handlers by name."""
+
+
+def runtime_handler(func):
+    """
+    Register a runtime handler.
+
+    A runtime handler has the signature ::
+        f(project, experiment, config, *args, run_f, args, **kwargs)
+
+    Handlers are found by the module and name of the function.
+    """
+    HANDLERS[func.__module__ + "." + func.__name__] = func
+    return func
+
+
+def __encode(value):
+    if isinstance(value, uuid.UUID):
+        return {"__uuid__": str(value)}
+    raise TypeError(repr(value))
+
+
+def __decode(obj):
+    if "__uuid__" in obj:
+        return uuid.UUID(obj["__uuid__"])
+    return obj
+
+
+TRANSIENT = frozenset(
+    ["experiment", "projects", "_actions", "_compiler_extension",
+     "_runtime_extension"])
+"""Attributes we do not describe. load() restores what a handler needs."""
+
+
+def __describe_object(obj):
+    """
+    Describe the class and the JSON-serializable state of :obj:.
+
+    Raises:
+        TypeError: If an attribute, that is not TRANSIENT, can not be
+            serialized to JSON.
+    """
+    state = {}
+    for key, value in obj.__dict__.items():
+        if key in TRANSIENT:
+            continue
+        try:
+            json.dumps(value, default=__encode)
+        except (TypeError, ValueError):
+            raise TypeError("{0}.{1} = {2!r} is not JSON-serializable".format(
+                type(obj).__qualname__, key, value))
+        state[key] = value
+    return {
+        "module": type(obj).__module__,
+        "class": type(obj).__qualname__,
+        "state": state
+    }
+
+
+def describe(runner):
+    """
+    Describe a runtime extension by a run spec.
+
+    Args:
+        runner: The runtime extension, as created by
+            benchbuild.utils.run.partial.
+
+    Returns (dict):
+        The run spec, or None if the extension can not be described.
+    """
+    from benchbuild.project import Project
+    from benchbuild.experiment import Experiment
+
+    func = getattr(runner, "func", None)
+    frozen_args = getattr(runner, "args", None)
+    if func is None or frozen_args is None or getattr(runner, "kwargs", None):
+        return None
+
+    name = func.__module__ + "." + func.__name__
+    if HANDLERS.get(name) is not func or len(frozen_args) < 3:
+        return None
+
+    project, experiment = frozen_args[:2]
+    args = list(frozen_args[3:])
+    if not (isinstance(project, Project) and
+            isinstance(experiment, Experiment)):
+        return None
+    for cls in (type(project), type(experiment)):
+        # The wrapped binary has to import the classes again.
+        if cls.__module__ == "__main__" or "<locals>" in cls.__qualname__:
+            return None
+    try:
+        json.dumps(args, default=__encode)
+    except (TypeError, ValueError):
+        return None
+
+    try:
+        project_d = __describe_object(project)
+        experiment_d = __describe_object(experiment)
+    except TypeError as ex:
+        import logging
+        logging.getLogger(__name__).warning(
+            "Can not describe the runtime extension %s, pickling it: %s",
+            name, ex)
+        return None
+
+    return {
+        "format": FORMAT,
+        "handler": name,
+        "args": args,
+        "project": project_d,
+        "experiment": experiment_d
+    }
+
+
+def store(spec_f, spec):
+    """Write the run spec :spec: to :spec_f:."""
+    with open(spec_f, 'w') as outf:
+        json.dump(spec, outf, default=__encode)
+
+
+def __restore_object(description):
+    import importlib
+
+    module = importlib.import_module(description["module"])
+    cls = module
+    for name in description["class"].split("."):
+        cls = getattr(cls, name)
+    obj = cls.__new__(cls)
+    obj.__dict__.update(description["state"])
+    return obj
+
+
+def load(spec_f):
+    """
+    Load the runtime extension described by a run spec.
+
+    Args:
+        spec_f (str): Path to the run spec.
+
+    Returns:
+        A function ``f(run_f, args, **kwargs)`` that executes the runtime
+        extension.
+    """
+    import importlib
+    from benchbuild.settings import CFG
+
+    with open(spec_f, 'r') as inf:
+        spec = json.load(inf, object_hook=__decode)
+    if spec.get("format") != FORMAT:
+        raise ValueError("{0}: Unsupported run spec format {1}".format(
+            spec_f, spec.get("format")))
+
+    name = spec["handler"]
+    if name not in HANDLERS:
+        importlib.import_module(name.rsplit(".", 1)[0])
+    handler = HANDLERS[name]
+
+    project = __restore_object(spec["project"])
+    experiment = __restore_object(spec["experiment"])
+    project.experiment = experiment
+    frozen_args = [project, experiment, CFG] + spec["args"]
+
+    def run_handler(run_f, args, **kwargs):
+        return handler(*(frozen_args + [run_f, args]), **kwargs)
+
+    return run_handler
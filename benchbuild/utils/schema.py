@@ -1,16 +1,60 @@
 """Database schema for benchbuild."""
 
 import logging
-from sqlalchemy import create_engine
+import uuid
+from sqlalchemy import create_engine, event
 from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, Enum
+from sqlalchemy import UniqueConstraint
+from sqlalchemy import BigInteger, Float, LargeBinary, Numeric, SmallInteger
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.types import CHAR, TypeDecorator
 from benchbuild.settings import CFG
 
 BASE = declarative_base()
 
 
+class GUID(TypeDecorator):
+    """
+    Platform-independent UUID type.
+
+    Uses PostgreSQL's UUID type, otherwise a CHAR(36) that stores the
+    canonical string representation.
+    """
+
+    impl = CHAR
+
+    def __init__(self, as_uuid=False):
+        super(GUID, self).__init__()
+        self.as_uuid = as_uuid
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.UUID())
+        return dialect.type_descriptor(CHAR(36))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return value
+        if not isinstance(value, uuid.UUID):
+            value = uuid.UUID(str(value))
+        return str(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None or not self.as_uuid:
+            return value
+        return uuid.UUID(str(value))
+
+
+DOUBLE = Float(precision=53).with_variant(postgresql.DOUBLE_PRECISION(),
+                                          'postgresql')
+"""Double precision floating point on all backends."""
+
+BIGINT_ID = BigInteger().with_variant(Integer(), 'sqlite')
+"""SQLite only assigns row ids to INTEGER primary keys."""
+
+
 class Run(BASE):
     """Store a run for each executed test binary."""
 
@@ -20,8 +64,8 @@ class Run(BASE):
     command = Column(String)
     project_name = Column(String, ForeignKey("project.name"), index=True)
     experiment_name = Column(String, index=True)
-    run_group = Column(postgresql.UUID, index=True)
-    experiment_group = Column(postgresql.UUID,
+    run_group = Column(GUID, index=True)
+    experiment_group = Column(GUID,
                               ForeignKey("experiment.id"),
                               index=True)
     begin = Column(DateTime(timezone=False))
@@ -34,10 +78,10 @@ class RunGroup(BASE):
 
     __tablename__ = 'rungroup'
 
-    id = Column(postgresql.UUID(as_uuid=True), primary_key=True, index=True)
+    id = Column(GUID(as_uuid=True), primary_key=True, index=True)
     project = Column(String, ForeignKey("project.name"), index=True)
     experiment = Column(
-        postgresql.UUID(as_uuid=True),
+        GUID(as_uuid=True),
         ForeignKey("experiment.id",
                    ondelete="CASCADE",
                    onupdate="CASCADE"),
@@ -55,7 +99,7 @@ class Experiment(BASE):
 
     name = Column(String)
     description = Column(String)
-    id = Column(postgresql.UUID(as_uuid=True), primary_key=True)
+    id = Column(GUID(as_uuid=True), primary_key=True)
     begin = Column(DateTime(timezone=False))
     end = Column(DateTime(timezone=False))
 
@@ -70,7 +114,7 @@ class Likwid(BASE):
 
     metric = Column(String, primary_key=True, index=True)
     region = Column(String, primary_key=True, index=True)
-    value = Column(postgresql.DOUBLE_PRECISION)
+    value = Column(DOUBLE)
     core = Column(String, primary_key=True)
     run_id = Column(Integer,
                     ForeignKey("run.id",
@@ -80,13 +124,46 @@ class Likwid(BASE):
                     primary_key=True)
 
 
+class MetricName(BASE):
+    """Intern the names of metrics."""
+
+    __tablename__ = 'metric_names'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
+
+class MetricValue(BASE):
+    """Store the values of metrics, by the id of their name."""
+
+    __tablename__ = 'metric_values'
+
+    run_id = Column(Integer,
+                    ForeignKey("run.id",
+                               onupdate="CASCADE",
+                               ondelete="CASCADE"),
+                    primary_key=True)
+    metric_id = Column(Integer,
+                       ForeignKey("metric_names.id"),
+                       index=True,
+                       primary_key=True)
+    value = Column(DOUBLE)
+
+
 class Metric(BASE):
-    """Store default metrics, simple name value store."""
+    """
+    Default metrics, simple name value store.
+
+    This is a view of metric_values and metric_names. Rows written through
+    the write-behind buffer (benchbuild.utils.db) are interned on the way,
+    see benchbuild.utils.interning.
+    """
 
     __tablename__ = 'metrics'
+    __table_args__ = {"info": {"view": True}}
 
     name = Column(String, primary_key=True, index=True, nullable=False)
-    value = Column(postgresql.DOUBLE_PRECISION)
+    value = Column(DOUBLE)
     run_id = Column(Integer,
                     ForeignKey("run.id",
                                onupdate="CASCADE",
@@ -101,11 +178,11 @@ class Event(BASE):
     __tablename__ = 'benchbuild_events'
 
     name = Column(String, index=True)
-    start = Column(postgresql.NUMERIC, primary_key=True)
-    duration = Column(postgresql.NUMERIC)
+    start = Column(Numeric, primary_key=True)
+    duration = Column(Numeric)
     id = Column(Integer, primary_key=True)
-    type = Column(postgresql.SMALLINT)
-    tid = Column(postgresql.BIGINT)
+    type = Column(SmallInteger)
+    tid = Column(BigInteger)
     run_id = Column(Integer,
                     ForeignKey("run.id",
                                onupdate="CASCADE",
@@ -120,11 +197,11 @@ class PerfEvent(BASE):
     __tablename__ = 'benchbuild_perf_events'
 
     name = Column(String, index=True)
-    start = Column(postgresql.NUMERIC, primary_key=True)
-    duration = Column(postgresql.NUMERIC)
+    start = Column(Numeric, primary_key=True)
+    duration = Column(Numeric)
     id = Column(Integer, primary_key=True)
-    type = Column(postgresql.SMALLINT)
-    tid = Column(postgresql.BIGINT)
+    type = Column(SmallInteger)
+    tid = Column(BigInteger)
     run_id = Column(Integer,
                     ForeignKey("run.id",
                                onupdate="CASCADE",
@@ -151,20 +228,54 @@ class Project(BASE):
             name=self.name)
 
 
+class CompileStatKey(BASE):
+    """Intern the component and name of compilestats."""
+
+    __tablename__ = 'compilestat_keys'
+    __table_args__ = (UniqueConstraint("component", "name"), )
+
+    id = Column(Integer, primary_key=True)
+    component = Column(String, nullable=False)
+    name = Column(String, nullable=False)
+
+
+class CompileStatValue(BASE):
+    """Store the values of compilestats, by the id of their key."""
+
+    __tablename__ = 'compilestat_values'
+
+    run_id = Column(Integer,
+                    ForeignKey("run.id",
+                               onupdate="CASCADE",
+                               ondelete="CASCADE"),
+                    primary_key=True)
+    stat_id = Column(Integer,
+                     ForeignKey("compilestat_keys.id"),
+                     index=True,
+                     primary_key=True)
+    value = Column(BigInteger)
+
+
 class CompileStat(BASE):
-    """Store compilestats as given by LLVM's '-stats' commoand."""
+    """
+    Compilestats as given by LLVM's '-stats' command.
+
+    This is a view of compilestat_values and compilestat_keys, see
+    :class:`Metric`.
+    """
 
     __tablename__ = 'compilestats'
+    __table_args__ = {"info": {"view": True}}
 
-    id = Column(postgresql.BIGINT, primary_key=True)
-    name = Column(String, index=True)
-    component = Column(String, index=True)
-    value = Column(postgresql.NUMERIC)
+    name = Column(String, index=True, primary_key=True)
+    component = Column(String, index=True, primary_key=True)
+    value = Column(BigInteger)
     run_id = Column(Integer,
                     ForeignKey("run.id",
                                onupdate="CASCADE",
                                ondelete="CASCADE"),
-                    index=True)
+                    index=True,
+                    primary_key=True)
 
 
 class RunLog(BASE):
@@ -211,15 +322,65 @@ class Metadata(BASE):
     value = Column(String)
 
 
+class FoldedStacks(BASE):
+    """
+    Store the sampled call stacks of a run.
+
+    The stacks are stored as a compressed profile with an interned frame
+    table, see benchbuild.utils.folded.
+    """
+
+    __tablename__ = "folded_stacks"
+
+    run_id = Column(Integer,
+                    ForeignKey("run.id",
+                               onupdate="CASCADE",
+                               ondelete="CASCADE"),
+                    index=True,
+                    primary_key=True)
+    frames = Column(Integer)
+    samples = Column(BigInteger)
+    data = Column(LargeBinary)
+
+
+class ConfigKey(BASE):
+    """Intern the names of config entries."""
+
+    __tablename__ = 'config_keys'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
+
+class ConfigValue(BASE):
+    """Store the values of config entries, by the id of their name."""
+
+    __tablename__ = 'config_values'
+
+    run_id = Column(Integer,
+                    ForeignKey("run.id",
+                               onupdate="CASCADE",
+                               ondelete="CASCADE"),
+                    primary_key=True)
+    key_id = Column(Integer,
+                    ForeignKey("config_keys.id"),
+                    index=True,
+                    primary_key=True)
+    value = Column(String)
+
+
 class Config(BASE):
     """
-    Store customized information about a run.
+    Customized information about a run.
 
     You can store arbitrary configuration information about a run here.
     Use it for extended filtering against the run table.
+
+    This is a view of config_values and config_keys, see :class:`Metric`.
     """
 
     __tablename__ = 'config'
+    __table_args__ = {"info": {"view": True}}
 
     run_id = Column(Integer,
                     ForeignKey("run.id",
@@ -242,7 +403,7 @@ class GlobalConfig(BASE):
     __tablename__ = 'globalconfig'
 
     experiment_group = Column(
-        postgresql.UUID(as_uuid=True),
+        GUID(as_uuid=True),
         ForeignKey("experiment.id",
                    onupdate="CASCADE",
                    ondelete="CASCADE"),
@@ -273,36 +434,150 @@ class RegressionTest(BASE):
     project_name = Column(String)
 
 
+class SpooledRecord(BASE):
+    """
+    Store the spool records that have been ingested.
+
+    Ingesting the same spool twice must not duplicate any results. Spooled
+    runs keep the id they got in the database.
+    """
+
+    __tablename__ = 'spool'
+
+    id = Column(String, primary_key=True)
+    run_id = Column(Integer,
+                    ForeignKey("run.id",
+                               onupdate="CASCADE",
+                               ondelete="CASCADE"),
+                    nullable=True)
+
+
+def connect_string():
+    """
+    Get the SQLAlchemy connect string of the result database.
+
+    BB_DB_CONNECT_STRING takes precedence. Without it, we connect to the
+    PostgreSQL server given by BB_DB_{HOST,PORT,NAME,USER,PASS}.
+    """
+    connect_s = CFG["db"]["connect_string"].value()
+    if connect_s:
+        return connect_s
+    return "postgresql+psycopg2://{u}:{p}@{h}:{P}/{db}".format(
+        u=CFG["db"]["user"],
+        h=CFG["db"]["host"],
+        P=CFG["db"]["port"],
+        p=CFG["db"]["pass"],
+        db=CFG["db"]["name"])
+
+
+def _sqlite_pragmas(dbapi_connection, _):
+    """Let concurrent benchbuild processes share a SQLite database file."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=30000")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
 class SessionManager(object):
     def __init__(self):
         logger = logging.getLogger(__name__)
 
         self.__test_mode = CFG['db']['rollback'].value()
-        self.__engine = create_engine(
-            "postgresql+psycopg2://{u}:{p}@{h}:{P}/{db}".format(
-                u=CFG["db"]["user"],
-                h=CFG["db"]["host"],
-                P=CFG["db"]["port"],
-                p=CFG["db"]["pass"],
-                db=CFG["db"]["name"]))
+        self.__engine = create_engine(connect_string())
+        if self.__engine.dialect.name == 'sqlite':
+            event.listen(self.__engine, 'connect', _sqlite_pragmas)
         self.__connection = self.__engine.connect()
         self.__transaction = None
         if self.__test_mode:
             logger.warning(
                 "DB test mode active, all actions will be rolled back.")
             self.__transaction = self.__connection.begin()
-        BASE.metadata.create_all(self.__connection, checkfirst=True)
+        self.__verify_schema()
+        self.__maker = sessionmaker(bind=self.__connection,
+                                    expire_on_commit=False)
+
+    def __verify_schema(self):
+        """
+        Create missing tables, once per experiment.
+
+        The first process that connects checks the schema and leaves a marker
+        in the environment, all processes we spawn afterwards inherit it.
+        In test mode all tables vanish with the rollback, so we check every
+        time.
+        """
+        import hashlib
+        import os
+        from plumbum import local
+
+        marker = hashlib.sha1(connect_string().encode("utf-8")).hexdigest()
+        if not self.__test_mode and \
+           os.getenv(SCHEMA_VERIFIED_ENV) == marker:
+            return
+        from benchbuild.utils import interning
+
+        BASE.metadata.create_all(self.__connection,
+                                 tables=physical_tables(),
+                                 checkfirst=True)
+        interning.create_views(self.__connection)
+        if not self.__test_mode:
+            os.environ[SCHEMA_VERIFIED_ENV] = marker
+            local.env[SCHEMA_VERIFIED_ENV] = marker
 
     def get(self):
-        return sessionmaker(bind=self.__connection)
+        return self.__maker
 
     def __del__(self):
         if hasattr(self, '__transaction') and self.__transaction:
             self.__transaction.rollback()
 
 
-CONNECTION_MANAGER = SessionManager()
+def physical_tables():
+    """All tables of our schema, except the ones that are views."""
+    return [
+        table for table in BASE.metadata.sorted_tables
+        if not table.info.get("view")
+    ]
+
+
+SCHEMA_VERIFIED_ENV = "BB_DB_SCHEMA_VERIFIED"
+"""Environment variable that marks a database as verified."""
+
+CONNECTION_MANAGER = None
 """
- Import this session manager to create new database sessions as needes.
+ The session manager of this process. Use Session() to get new sessions,
+ it connects to the database on first use.
 """
-Session = CONNECTION_MANAGER.get()
+
+__STALE_MANAGERS = []
+
+
+def Session(*args, **kwargs):
+    """
+    Create a new database session.
+
+    The connection to the database is established lazily, when the first
+    session is requested. Importing this module is cheap.
+    """
+    global CONNECTION_MANAGER
+
+    if CONNECTION_MANAGER is None:
+        CONNECTION_MANAGER = SessionManager()
+    return CONNECTION_MANAGER.get()(*args, **kwargs)
+
+
+def reconnect():
+    """
+    Open a fresh database connection for this process.
+
+    A forked child must not talk through the connection of its parent.
+    We keep the inherited manager alive, because closing it would terminate
+    the connection of the parent as well. The new connection is opened on
+    the next call to Session().
+    """
+    global CONNECTION_MANAGER
+
+    if CONNECTION_MANAGER is not None:
+        __STALE_MANAGERS.append(CONNECTION_MANAGER)
+    CONNECTION_MANAGER = None
@@ -0,0 +1,237 @@
+/*
+ * Native exec shim for wrapped binaries (see benchbuild/utils/shim.py).
+ *
+ * Usage: bb-shim RECORD_FILE BINARY [ARGS...]
+ *
+ * Runs BINARY with ARGS and appends a single JSON line with wall clock time,
+ * resource usage, exit status and output of BINARY to RECORD_FILE. stdin is
+ * inherited. stdout and stderr of BINARY are passed through to ours and
+ * captured, up to MAX_CAPTURE bytes each. The shim exits with the status of
+ * BINARY.
+ */
+#define _GNU_SOURCE
+#include <errno.h>
+#include <fcntl.h>
+#include <poll.h>
+#include <signal.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/resource.h>
+#include <sys/time.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+#include <time.h>
+#include <unistd.h>
+
+#define MAX_CAPTURE (1 << 20)
+
+struct buffer {
+  char *data;
+  size_t len;
+  size_t cap;
+};
+
+static void append(struct buffer *buf, const char *s, size_t n) {
+  if (buf->len + n + 1 > buf->cap) {
+    size_t cap = buf->cap ? buf->cap : 1024;
+    while (buf->len + n + 1 > cap)
+      cap *= 2;
+    char *data = realloc(buf->data, cap);
+    if (!data)
+      return;
+    buf->data = data;
+    buf->cap = cap;
+  }
+  memcpy(buf->data + buf->len, s, n);
+  buf->len += n;
+  buf->data[buf->len] = '\0';
+}
+
+static void append_str(struct buffer *buf, const char *s) {
+  append(buf, s, strlen(s));
+}
+
+static void append_json_n(struct buffer *buf, const char *s, size_t n) {
+  char esc[8];
+  append_str(buf, "\"");
+  for (size_t i = 0; i < n; ++i) {
+    unsigned char c = (unsigned char)s[i];
+    if (c == '"' || c == '\\') {
+      esc[0] = '\\';
+      esc[1] = c;
+      append(buf, esc, 2);
+    } else if (c < 0x20) {
+      snprintf(esc, sizeof(esc), "\\u%04x", c);
+      append_str(buf, esc);
+    } else {
+      append(buf, (const char *)&c, 1);
+    }
+  }
+  append_str(buf, "\"");
+}
+
+static void append_json(struct buffer *buf, const char *s) {
+  append_json_n(buf, s, strlen(s));
+}
+
+static int write_all(int fd, const char *s, size_t n) {
+  while (n > 0) {
+    ssize_t written = write(fd, s, n);
+    if (written < 0) {
+      if (errno == EINTR)
+        continue;
+      return -1;
+    }
+    s += written;
+    n -= (size_t)written;
+  }
+  return 0;
+}
+
+/* Copy the output of the binary to ours and keep the first MAX_CAPTURE
+ * bytes of each stream, until both pipes are closed. If our output goes
+ * away, we close the pipe, so the binary gets SIGPIPE as it would without
+ * the shim. */
+static void tee_output(int out_fd, int err_fd, struct buffer *out,
+                       struct buffer *err) {
+  struct pollfd fds[2] = {{out_fd, POLLIN, 0}, {err_fd, POLLIN, 0}};
+  int targets[2] = {STDOUT_FILENO, STDERR_FILENO};
+  struct buffer *captured[2] = {out, err};
+  char chunk[65536];
+  int open_fds = 2;
+
+  while (open_fds > 0) {
+    if (poll(fds, 2, -1) < 0) {
+      if (errno == EINTR)
+        continue;
+      return;
+    }
+    for (int i = 0; i < 2; ++i) {
+      if (fds[i].fd < 0 || !fds[i].revents)
+        continue;
+      ssize_t n = read(fds[i].fd, chunk, sizeof(chunk));
+      if (n < 0 && errno == EINTR)
+        continue;
+      if (n > 0 && captured[i]->len < MAX_CAPTURE) {
+        size_t keep = MAX_CAPTURE - captured[i]->len;
+        append(captured[i], chunk, (size_t)n < keep ? (size_t)n : keep);
+      }
+      if (n <= 0 || write_all(targets[i], chunk, (size_t)n) < 0) {
+        close(fds[i].fd);
+        fds[i].fd = -1;
+        --open_fds;
+      }
+    }
+  }
+}
+
+static double seconds(struct timeval tv) {
+  return tv.tv_sec + tv.tv_usec / 1e6;
+}
+
+static double elapsed(struct timespec from, struct timespec to) {
+  return (to.tv_sec - from.tv_sec) + (to.tv_nsec - from.tv_nsec) / 1e9;
+}
+
+int main(int argc, char **argv) {
+  if (argc < 3) {
+    fprintf(stderr, "usage: %s RECORD_FILE BINARY [ARGS...]\n", argv[0]);
+    return 127;
+  }
+
+  int out_pipe[2], err_pipe[2];
+  if (pipe(out_pipe) < 0 || pipe(err_pipe) < 0) {
+    perror("bb-shim: pipe");
+    return 127;
+  }
+
+  struct timespec wall, start, stop;
+  clock_gettime(CLOCK_REALTIME, &wall);
+  clock_gettime(CLOCK_MONOTONIC, &start);
+
+  pid_t pid = fork();
+  if (pid < 0) {
+    perror("bb-shim: fork");
+    return 127;
+  }
+  if (pid == 0) {
+    dup2(out_pipe[1], STDOUT_FILENO);
+    dup2(err_pipe[1], STDERR_FILENO);
+    close(out_pipe[0]);
+    close(out_pipe[1]);
+    close(err_pipe[0]);
+    close(err_pipe[1]);
+    execv(argv[2], argv + 2);
+    fprintf(stderr, "bb-shim: %s: %s\n", argv[2], strerror(errno));
+    _exit(127);
+  }
+  close(out_pipe[1]);
+  close(err_pipe[1]);
+
+  /* The shell forwards terminal signals to the whole process group. */
+  signal(SIGINT, SIG_IGN);
+  signal(SIGQUIT, SIG_IGN);
+  /* We notice it in tee_output, if our own output goes away. */
+  signal(SIGPIPE, SIG_IGN);
+
+  struct buffer out = {NULL, 0, 0}, err = {NULL, 0, 0};
+  tee_output(out_pipe[0], err_pipe[0], &out, &err);
+
+  int status = 0;
+  struct rusage usage;
+  while (wait4(pid, &status, 0, &usage) < 0) {
+    if (errno != EINTR) {
+      perror("bb-shim: wait4");
+      return 127;
+    }
+  }
+  clock_gettime(CLOCK_MONOTONIC, &stop);
+
+  int retcode = WIFEXITED(status) ? WEXITSTATUS(status) : -1;
+  int sig = WIFSIGNALED(status) ? WTERMSIG(status) : 0;
+
+  struct buffer buf = {NULL, 0, 0};
+  char num[128];
+  append_str(&buf, "{\"argv\":[");
+  for (int i = 2; i < argc; ++i) {
+    if (i > 2)
+      append_str(&buf, ",");
+    append_json(&buf, argv[i]);
+  }
+  snprintf(num, sizeof(num),
+           "],\"begin\":%.6f,\"real_s\":%.6f,\"user_s\":%.6f,"
+           "\"system_s\":%.6f,\"maxrss_kb\":%ld,\"retcode\":%d,"
+           "\"signal\":%d",
+           wall.tv_sec + wall.tv_nsec / 1e9, elapsed(start, stop),
+           seconds(usage.ru_utime), seconds(usage.ru_stime),
+           usage.ru_maxrss, retcode, sig);
+  append_str(&buf, num);
+  append_str(&buf, ",\"stdout\":");
+  append_json_n(&buf, out.data ? out.data : "", out.len);
+  append_str(&buf, ",\"stderr\":");
+  append_json_n(&buf, err.data ? err.data : "", err.len);
+  const char *threads = getenv("OMP_NUM_THREADS");
+  if (threads) {
+    append_str(&buf, ",\"threads\":");
+    append_json(&buf, threads);
+  }
+  append_str(&buf, "}\n");
+
+  /* A single write with O_APPEND keeps concurrent records intact. */
+  int fd = open(argv[1], O_WRONLY | O_APPEND | O_CREAT | O_CLOEXEC, 0644);
+  if (fd >= 0 && buf.data) {
+    ssize_t written = write(fd, buf.data, buf.len);
+    (void)written;
+    close(fd);
+  }
+  free(buf.data);
+  free(out.data);
+  free(err.data);
+
+  if (sig) {
+    signal(sig, SIG_DFL);
+    kill(getpid(), sig);
+  }
+  return retcode < 0 ? 128 + sig : retcode;
+}
@@ -0,0 +1,178 @@
+"""
+Native exec shim for wrapped binaries.
+
+Wrapped binaries (see benchbuild.project.wrap) normally execute a python
+script that loads benchbuild before it starts the real binary. For short
+running binaries this overhead dominates the measurement.
+
+With BB_SHIM_ENABLE set, binaries whose runtime extension only measures
+the execution time are wrapped with a shell script that executes a small
+compiled helper (shim.c) instead. The shim runs the real binary and appends
+its wall clock time, resource usage, exit status and output to a record
+file. The records are loaded into the database after the project's run-time
+tests finished (see :func:`ingest`).
+
+The shim is compiled on first use and cached in BB_TMP_DIR.
+"""
+import hashlib
+import json
+import logging
+import os
+from benchbuild.settings import CFG
+
+SHIM_SOURCE = os.path.join(os.path.dirname(__file__), "shim.c")
+RECORDS_EXT = ".shim.jsonl"
+
+TIMING_HANDLERS = [
+    "benchbuild.experiments.raw.run_with_time",
+    "benchbuild.experiments.polyjit.run_with_time",
+]
+"""Runtime handlers the shim can replace. Their first argument is jobs."""
+
+LOG = logging.getLogger(__name__)
+
+
+def build():
+    """
+    Compile the shim, if necessary.
+
+    Returns (str):
+        Path to the shim binary, or None if we could not compile it.
+    """
+    from plumbum import local, ProcessExecutionError, CommandNotFound
+
+    with open(SHIM_SOURCE, 'rb') as source:
+        digest = hashlib.sha1(source.read()).hexdigest()[:16]
+    shim_dir = os.path.join(str(CFG["tmp_dir"]), "shim", digest)
+    shim_f = os.path.join(shim_dir, "bb-shim")
+    if os.path.exists(shim_f):
+        return shim_f
+
+    os.makedirs(shim_dir, exist_ok=True)
+    tmp_f = "{0}.{1}.tmp".format(shim_f, os.getpid())
+    try:
+        cc = local[str(CFG["shim"]["cc"])]
+        cc("-O2", "-std=c99", "-o", tmp_f, SHIM_SOURCE)
+    except (ProcessExecutionError, CommandNotFound) as ex:
+        LOG.warning("Could not compile the exec shim: %s", str(ex))
+        return None
+    os.replace(tmp_f, shim_f)
+    return shim_f
+
+
+def supports(runner):
+    """
+    Check, if the shim can replace the runtime extension :runner:.
+
+    Returns (dict):
+        The run spec of :runner:, if the shim supports it, else None.
+    """
+    from benchbuild.utils import run_spec, repetition, cgroup, placement
+
+    if not CFG["shim"]["enable"].value():
+        return None
+    # The shim executes the binary exactly once, unpinned and outside of a
+    # cgroup.
+    if repetition.enabled() or cgroup.enabled() or placement.enabled():
+        return None
+    spec = run_spec.describe(runner)
+    if spec is None or spec["handler"] not in TIMING_HANDLERS:
+        return None
+    return spec
+
+
+def print_wrapper(filepath, real_f, shim_f, spec, path, ld_lib_path):
+    """
+    Write a shell wrapper that executes :real_f: through the shim.
+
+    Args:
+        filepath (str): Path of the wrapper.
+        real_f (str): The real binary.
+        shim_f (str): The shim binary.
+        spec (dict): The run spec of the replaced runtime extension.
+        path (str): The PATH of the real binary.
+        ld_lib_path (str): The LD_LIBRARY_PATH of the real binary.
+    """
+    from shlex import quote
+    from plumbum.cmd import chmod
+
+    jobs = spec["args"][0] if spec["args"] else CFG["jobs"].value()
+    with open(filepath, 'w') as wrapper:
+        wrapper.write("""#!/bin/sh
+PATH={path}
+LD_LIBRARY_PATH={ld_lib_path}
+OMP_NUM_THREADS={jobs}
+export PATH LD_LIBRARY_PATH OMP_NUM_THREADS
+records={records}
+exec {shim} "${{BB_SHIM_RECORDS:-$records}}" {real} "$@"
+""".format(path=quote(path),
+           ld_lib_path=quote(ld_lib_path),
+           jobs=quote(str(jobs)),
+           shim=quote(shim_f),
+           records=quote(filepath + RECORDS_EXT),
+           real=quote(real_f)))
+    chmod("+x", filepath)
+
+
+def records(records_f):
+    """Read all complete records of a record file."""
+    with open(records_f, 'r', errors='replace') as records_file:
+        for line in records_file:
+            if line.endswith("\n"):
+                yield json.loads(line)
+
+
+def ingest(records_f, project):
+    """
+    Store the records of the shim as runs of :project:.
+
+    The record file is removed afterwards.
+
+    Args:
+        records_f (str): The record file of the shim.
+        project: The project the records belong to.
+
+    Returns (int):
+        The number of failed executions.
+    """
+    from datetime import datetime, timedelta
+    from benchbuild.utils.db import create_run, persist_time, persist_config
+    from benchbuild.utils import schema as s
+
+    if not os.path.exists(records_f):
+        return 0
+
+    failed = 0
+    for record in records(records_f):
+        command = " ".join(record["argv"])
+        db_run, session = create_run(command, project.name,
+                                     project.experiment.name,
+                                     project.run_uuid)
+        begin = datetime.fromtimestamp(record["begin"])
+        end = begin + timedelta(seconds=record["real_s"])
+        success = record["retcode"] == 0 and record["signal"] == 0
+        db_run.begin = begin
+        db_run.end = end
+        db_run.status = "completed" if success else "failed"
+        failed += 0 if success else 1
+
+        log = s.RunLog()
+        log.run_id = db_run.id
+        log.begin = begin
+        log.end = end
+        log.status = record["retcode"] if record["signal"] == 0 \
+            else -record["signal"]
+        log.stdout = record.get("stdout")
+        log.stderr = record.get("stderr")
+        log.config = repr(CFG)
+        session.add(log)
+
+        persist_time(db_run, session, [(record["user_s"], record["system_s"],
+                                        record["real_s"])])
+        config = {"shim.maxrss_kb": str(record["maxrss_kb"])}
+        if "threads" in record:
+            config["cores"] = record["threads"]
+        persist_config(db_run, session, config)
+        session.commit()
+    os.unlink(records_f)
+    return failed
@@ -0,0 +1,172 @@
+"""
+Offline result spool.
+
+With BB_SPOOL_ENABLE set, benchbuild does not talk to the result database
+while it runs. Runs, run groups, logs and measurements are appended to a
+spool file of the node instead, one compact JSON record per line. The spool
+is loaded into the database later with `benchbuild ingest`.
+
+There are two kinds of records:
+    {"t": "obj", "table": ..., "values": {...}}
+        The current state of a single object (e.g., a run or its log).
+        Later records of the same object update the earlier ones.
+    {"t": "rows", "id": ..., "table": ..., "rows": [...]}
+        A batch of measurement rows, written by the write-behind buffer of
+        benchbuild.utils.db.
+
+Runs get a spool id instead of a database id. All references to it are
+replaced with the real id of the run during ingestion.
+"""
+import json
+import os
+import socket
+import uuid
+from benchbuild.settings import CFG
+
+SPOOL_ID_PREFIX = "spool-"
+
+
+def enabled():
+    """Check, if results go to the spool instead of the database."""
+    return bool(CFG["spool"]["enable"].value())
+
+
+def spool_path():
+    """Get the path of the spool file of this node."""
+    return os.path.join(str(CFG["spool"]["dir"]),
+                        "{0}.jsonl".format(socket.gethostname()))
+
+
+def is_spool_id(value):
+    """
+    Check, if :value: is a spool id.
+
+    Examples:
+        >>> is_spool_id(new_id())
+        True
+        >>> is_spool_id(42)
+        False
+    """
+    return isinstance(value, str) and value.startswith(SPOOL_ID_PREFIX)
+
+
+def new_id():
+    """Create a new spool id."""
+    return SPOOL_ID_PREFIX + uuid.uuid4().hex
+
+
+def __encode(obj):
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    return str(obj)
+
+
+def append(record):
+    """
+    Append a single record to the spool of this node.
+
+    Concurrent writers on this node serialize on a lock of the spool file.
+
+    Args:
+        record (dict): The record we want to append.
+    """
+    import fcntl
+
+    line = json.dumps(record, separators=(",", ":"), default=__encode) + "\n"
+    spool_f = spool_path()
+    spool_dir = os.path.dirname(spool_f)
+    if not os.path.exists(spool_dir):
+        os.makedirs(spool_dir, exist_ok=True)
+
+    while True:
+        fd = os.open(spool_f, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # benchbuild ingest renames the spool, before it reads it.
+            if os.fstat(fd).st_ino == os.stat(spool_f).st_ino:
+                os.write(fd, line.encode("utf-8"))
+                return
+        except FileNotFoundError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def values(obj):
+    """
+    Get all column values of a schema object that are set.
+
+    Args:
+        obj: An instance of one of our schema classes.
+
+    Returns (dict):
+        Column name to value.
+    """
+    row = {}
+    for column in obj.__table__.columns:
+        value = getattr(obj, column.key, None)
+        if value is not None:
+            row[column.key] = value
+    return row
+
+
+def records(spool_f):
+    """
+    Read all records of a spool file.
+
+    A truncated last line, e.g., from a node that died while writing, is
+    skipped.
+
+    Args:
+        spool_f (str): Path of the spool file.
+    """
+    with open(spool_f, 'r') as spool:
+        for line in spool:
+            if not line.endswith("\n"):
+                break
+            yield json.loads(line)
+
+
+class Session(object):
+    """
+    Stand-in for a database session that writes to the spool.
+
+    It supports the subset of the session interface that benchbuild uses
+    to create and update runs and run groups. Objects stay attached after a
+    commit, every commit appends the objects that changed since.
+    """
+
+    def __init__(self):
+        self.__objects = []
+        self.__written = {}
+
+    def add(self, obj):
+        """Attach :obj: to this session."""
+        if not any(obj is known for known in self.__objects):
+            self.__objects.append(obj)
+
+    def flush(self):
+        """Assign spool ids to all objects without a primary key."""
+        for obj in self.__objects:
+            for column in obj.__table__.primary_key.columns:
+                if getattr(obj, column.key, None) is None:
+                    setattr(obj, column.key, new_id())
+
+    def commit(self):
+        """Append all objects that changed since the last commit."""
+        self.flush()
+        for obj in self.__objects:
+            row = values(obj)
+            if self.__written.get(id(obj)) == row:
+                continue
+            append({"t": "obj", "table": obj.__tablename__, "values": row})
+            self.__written[id(obj)] = row
+
+    def rollback(self):
+        """Forget all changes since the last commit."""
+        pass
+
+    def close(self):
+        """Detach all objects."""
+        self.__objects = []
+        self.__written = {}
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Measure the cost of configuration lookups and of importing the settings.
+
+It measures the checkout in the current directory. To compare with an
+older revision:
+
+    python benchmarks/bench_settings.py
+    git worktree add /tmp/old <revision>
+    (cd /tmp/old && python $OLDPWD/benchmarks/bench_settings.py)
+"""
+import os
+import statistics
+import subprocess
+import sys
+import timeit
+
+ROOT = os.getcwd()
+sys.path.insert(0, ROOT)
+
+
+def per_call(stmt, number):
+    """Best time of a single execution of :stmt:, in microseconds."""
+    times = timeit.repeat(stmt, "from benchbuild.settings import CFG",
+                          repeat=5, number=number)
+    return min(times) / number * 1e6
+
+
+def import_time(repeat=10):
+    """Median wall time of importing benchbuild.settings, in milliseconds."""
+    script = ("import time; t = time.perf_counter(); "
+              "import benchbuild.settings; "
+              "print(time.perf_counter() - t)")
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop("BB_CONFIG_SNAPSHOT", None)
+    times = []
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, "-c", script],
+                                      env=env)
+        times.append(float(out) * 1e3)
+    return statistics.median(times)
+
+
+def main():
+    print("CFG[\"db\"][\"host\"].value()  {0:8.2f}us".format(
+        per_call('CFG["db"]["host"].value()', 100000)))
+    print("repr(CFG)                   {0:8.2f}us".format(
+        per_call("repr(CFG)", 1000)))
+    print("CFG.init_from_env()         {0:8.2f}us".format(
+        per_call("CFG.init_from_env()", 100)))
+    print("import benchbuild.settings  {0:8.2f}ms".format(import_time()))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ setup(
     url='https://github.com/PolyJIT/benchbuild',
     packages=find_packages(exclude=["docs", "extern", "filters", "linker",
                                     "src", "statistics", "tests", "results"]),
+    package_data={"benchbuild.utils": ["*.c"]},
     install_requires=
     ["lazy==1.2", "SQLAlchemy==1.0.4", "dill==0.2.4", "plumbum>=1.5.0",
      "regex==2015.5.28", "wheel==0.24.0", "parse==1.6.6", "virtualenv==13.1.0",